@@ -0,0 +1,348 @@
+"""
+邮件处理流水线模块
+把一批已匹配的邮件拆成 下载 -> 解析 -> 入库 三个阶段并行执行，ERP录入严格串行
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import Logger
+from modules.file_processor.excel_handler import parse_attachments
+
+# 统计耗时的阶段
+STAGES = ('fetch', 'parse', 'store', 'erp')
+# 需要按邮件顺序处理的类别：同一供应商的进度表依次入库，送货单依次录入ERP
+ORDERED_CATEGORIES = ('封装送货单', '封装进度表', '晶圆进度表')
+# 只解析（解压）不需要排序的类别
+UNORDERED_CATEGORIES = ('测试报告',)
+
+# 同一(类别, 供应商)的顺序凭证：(前一封邮件处理完成的Future, 本封邮件处理完成的Future)
+Ticket = Tuple[Optional[Future], Future]
+
+
+class EmailPipeline:
+    """
+    分阶段邮件处理流水线
+
+    - 下载阶段：使用该邮箱的最多 fetch_connections 个IMAP连接并行下载，每个连接同时只下载一封；
+      下载完成的邮件立即进入后续阶段
+    - 解析阶段：进程池执行pandas解析（CPU密集）
+    - 入库阶段：线程池执行BLL批量更新；同一(类别, 供应商)的进度表按UID顺序依次入库
+    - ERP阶段：单线程执行，送货单的解析和E10录入都在其中完成，同一供应商按UID顺序录入
+
+    多个邮箱可以在各自的线程中同时调用 process，共用解析、入库和ERP阶段。
+    已下载但未处理完的邮件总数受 queue_size 限制，下游积压时下载阶段会等待
+    """
+
+    def __init__(self, processor, parse_workers: int = 2, store_workers: int = 2,
+                 queue_size: int = 4, use_processes: bool = True, fetch_connections: int = 1):
+        """
+        初始化流水线
+        Args:
+            processor: EmailProcessor实例，提供各阶段的处理方法
+            parse_workers: 解析阶段的工作进程数
+            store_workers: 入库阶段的工作线程数
+            queue_size: 已下载未完成邮件的上限
+            use_processes: 解析阶段是否使用进程池（False时使用线程池）
+            fetch_connections: 每个邮箱并行下载的IMAP连接数
+        """
+        self.logger = Logger(__name__)
+        self.processor = processor
+        self.parse_workers = parse_workers
+        self.store_workers = store_workers
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.fetch_connections = max(1, fetch_connections)
+        self._lock = threading.Lock()
+        self._batch_done = threading.Condition(self._lock)
+        self._slots = threading.BoundedSemaphore(queue_size)
+        # 每个(类别, 供应商)最近一封邮件处理完成的Future，用于保证同一供应商按顺序处理
+        self._last_store: Dict[Tuple[str, str], Future] = {}
+        self._parse_pool = None
+        self._store_pool: Optional[ThreadPoolExecutor] = None
+        self._erp_pool: Optional[ThreadPoolExecutor] = None
+
+    def open(self) -> 'EmailPipeline':
+        """创建各阶段的工作池"""
+        parse_pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        self._parse_pool = parse_pool_class(max_workers=self.parse_workers)
+        self._store_pool = ThreadPoolExecutor(max_workers=self.store_workers, thread_name_prefix='email_store')
+        self._erp_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email_erp')
+        self._last_store = {}
+        return self
+
+    def close(self) -> None:
+        """等待已提交的任务完成并关闭工作池"""
+        for pool in (self._erp_pool, self._store_pool, self._parse_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._parse_pool = self._store_pool = self._erp_pool = None
+
+    def __enter__(self) -> 'EmailPipeline':
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.close()
+        return False
+
+    @staticmethod
+    def _new_stats() -> Dict[str, Any]:
+        return {
+            'processed': 0,
+            'failed': 0,
+            'duplicates': 0,
+            'attachments': 0,
+            'failed_ids': [],
+            'succeeded_ids': [],
+            'stages': {
+                stage: {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+                for stage in STAGES
+            },
+            'fetch_connections': 1,
+            'wall_seconds': 0.0,
+        }
+
+    def _record_stage(self, batch: Dict[str, Any], stage: str, started: float) -> None:
+        """记录阶段耗时"""
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stage_stats = batch['stats']['stages'][stage]
+            stage_stats['count'] += 1
+            stage_stats['seconds'] += elapsed
+            stage_stats['max_seconds'] = max(stage_stats['max_seconds'], elapsed)
+
+    def _finish(self, batch: Dict[str, Any], email_id: bytes, success: Optional[bool],
+                match_result: Optional[Dict[str, Any]] = None) -> None:
+        """邮件处理结束：更新统计、登记已读标记并释放名额"""
+        if success is not False:
+            self.processor.acknowledge(email_id, match_result, batch['client'])
+        with self._lock:
+            stats = batch['stats']
+            if success is True:
+                stats['processed'] += 1
+                stats['succeeded_ids'].append(email_id)
+            elif success is False:
+                stats['failed'] += 1
+                stats['failed_ids'].append(email_id)
+            batch['pending'] -= 1
+            self._batch_done.notify_all()
+        self._slots.release()
+
+    def _timed(self, batch: Dict[str, Any], stage: str, func: Callable, *args) -> Any:
+        """在工作线程中执行并记录阶段耗时"""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._record_stage(batch, stage, started)
+
+    @staticmethod
+    def _when_all_done(futures: List[Future], callback: Callable[[], None]) -> None:
+        """所有Future完成后执行回调（不占用工作线程等待）"""
+        pending = [f for f in futures if f is not None]
+        if not pending:
+            callback()
+            return
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                callback()
+
+        for future in pending:
+            future.add_done_callback(on_done)
+
+    def run(self, candidates: List[Tuple[bytes, Optional[Dict[str, Any]]]], email_client=None) -> Dict[str, Any]:
+        """
+        处理单个邮箱的一批候选邮件（自动创建和关闭工作池）
+        Args:
+            candidates: [(UID, 邮件头匹配结果)]
+            email_client: 邮件所在邮箱的EmailClient，默认为处理器的主邮箱
+        Returns:
+            统计信息（含 failed_ids、succeeded_ids 与各阶段耗时）
+        """
+        with self:
+            return self.process(candidates, email_client)
+
+    def process(self, candidates: List[Tuple[bytes, Optional[Dict[str, Any]]]], email_client=None) -> Dict[str, Any]:
+        """
+        处理单个邮箱的一批候选邮件，返回时该批邮件已全部处理完成
+
+        需先调用 open()；不同邮箱可以在各自线程中同时调用
+
+        Args:
+            candidates: [(UID, 邮件头匹配结果)]
+            email_client: 邮件所在邮箱的EmailClient，默认为处理器的主邮箱
+        Returns:
+            统计信息（含 failed_ids、succeeded_ids 与各阶段耗时）
+        """
+        batch = {
+            'client': email_client or self.processor.email_client,
+            'stats': self._new_stats(),
+            'pending': 0,
+            'take_lock': threading.Lock(),
+        }
+        started = time.perf_counter()
+        work: queue.Queue = queue.Queue()
+        for candidate in candidates:
+            work.put(candidate)
+
+        extra = min(self.fetch_connections, len(candidates)) - 1
+        try:
+            if extra > 0:
+                # 附加连接在各自线程中建立，主连接不等待，立即开始下载
+                with ThreadPoolExecutor(max_workers=extra + 1, thread_name_prefix='email_fetch') as executor:
+                    futures = [executor.submit(self._fetch_worker, batch, batch['client'], work)]
+                    futures += [executor.submit(self._session_worker, batch, work) for _ in range(extra)]
+                    for future in futures:
+                        future.result()
+            else:
+                self._fetch_worker(batch, batch['client'], work)
+        finally:
+            # 等待本批已提交的任务完成
+            with self._batch_done:
+                self._batch_done.wait_for(lambda: batch['pending'] == 0)
+
+        stats = batch['stats']
+        stats['wall_seconds'] = round(time.perf_counter() - started, 3)
+        self.logger.info(
+            f"{batch['client'].name} 流水线阶段耗时: " + ", ".join(
+                f"{stage} {data['seconds']:.2f}s/{data['count']}"
+                for stage, data in stats['stages'].items()
+            ) + f", 下载连接 {stats['fetch_connections']}, 总耗时 {stats['wall_seconds']:.2f}s"
+        )
+        return stats
+
+    def _session_worker(self, batch: Dict[str, Any], work: queue.Queue) -> None:
+        """附加下载线程：打开一个附加IMAP会话参与下载，连接池已满或邮件已取完时直接退出"""
+        if work.empty():
+            return
+        client = batch['client']
+        session = client.open_session()
+        if session is None:
+            return
+        with self._lock:
+            batch['stats']['fetch_connections'] += 1
+        try:
+            self._fetch_worker(batch, session, work)
+        finally:
+            client.close_session(session)
+
+    def _fetch_worker(self, batch: Dict[str, Any], client, work: queue.Queue) -> None:
+        """下载线程：用自己的IMAP连接从队列中取邮件逐封下载，下载完成后分发到后续阶段"""
+        while True:
+            # 下游积压时在此等待。先占名额再取邮件，保证排在前面的邮件都已占到名额，
+            # 等待前一封邮件的后续邮件不会占满名额
+            self._slots.acquire()
+            # 下载可能乱序完成，取邮件时按UID顺序登记处理顺序
+            with batch['take_lock']:
+                try:
+                    email_id, header_match = work.get_nowait()
+                except queue.Empty:
+                    self._slots.release()
+                    return
+                ticket = self._reserve(header_match)
+            with self._lock:
+                batch['pending'] += 1
+            try:
+                match_result = self._timed(
+                    batch, 'fetch', self.processor.fetch_candidate, email_id, header_match, client
+                )
+            except Exception as e:
+                self.logger.error(f"下载邮件失败: {str(e)}", exc_info=True)
+                self._release(ticket)
+                self._finish(batch, email_id, False)
+                continue
+            self._dispatch(batch, email_id, match_result, ticket)
+
+    def _reserve(self, match_result: Optional[Dict[str, Any]]) -> Optional[Ticket]:
+        """为需要按顺序处理的邮件登记顺序凭证"""
+        category = match_result.get('category') if match_result else None
+        if category not in ORDERED_CATEGORIES:
+            return None
+        key = (category, match_result.get('supplier'))
+        done: Future = Future()
+        with self._lock:
+            previous = self._last_store.get(key)
+            self._last_store[key] = done
+        return previous, done
+
+    def _release(self, ticket: Optional[Ticket]) -> None:
+        """邮件不再进入入库/ERP阶段时释放顺序凭证（前一封处理完成后放行下一封）"""
+        if ticket is None:
+            return
+        previous, done = ticket
+        self._when_all_done([previous], lambda: done.set_result(None))
+
+    def _dispatch(self, batch: Dict[str, Any], email_id: bytes, match_result: Dict[str, Any],
+                  ticket: Optional[Ticket] = None) -> None:
+        """按类别把已下载的邮件分发到后续阶段"""
+        attachments = match_result.get('attachments', []) if match_result else []
+        with self._lock:
+            batch['stats']['attachments'] += len(attachments)
+
+        category = match_result.get('category') if match_result else None
+        if not attachments or category not in ORDERED_CATEGORIES + UNORDERED_CATEGORIES:
+            self._release(ticket)
+            self._finish(batch, email_id, None, match_result)
+            return
+
+        # 附件内容与已处理过的完全相同，不再解析入库
+        if self.processor.is_duplicate(match_result):
+            with self._lock:
+                batch['stats']['duplicates'] += 1
+            self._release(ticket)
+            self._finish(batch, email_id, True, match_result)
+            return
+
+        if category in UNORDERED_CATEGORIES:
+            previous, done = None, Future()
+        else:
+            # 未做邮件头首轮匹配的邮件下载后才知道类别，按到达顺序登记
+            previous, done = ticket or self._reserve(match_result)
+        done.add_done_callback(lambda f: self._finish(batch, email_id, f.result(), match_result))
+
+        if category == '封装送货单':
+            def submit_erp():
+                erp_future = self._erp_pool.submit(
+                    self._timed, batch, 'erp', self.processor.process_delivery, match_result
+                )
+                erp_future.add_done_callback(lambda f: done.set_result(self._success(f)))
+
+            self._when_all_done([previous], submit_erp)
+            return
+
+        parse_started = time.perf_counter()
+        parse_future = self._parse_pool.submit(parse_attachments, match_result)
+        parse_future.add_done_callback(lambda _: self._record_stage(batch, 'parse', parse_started))
+
+        store = self.processor.store_report if category in UNORDERED_CATEGORIES else self.processor.store_wip
+
+        def submit_store():
+            try:
+                result = parse_future.result()
+            except Exception as e:
+                self.logger.error(f"解析附件失败: {str(e)}", exc_info=True)
+                done.set_result(False)
+                return
+            store_future = self._store_pool.submit(
+                self._timed, batch, 'store', store, match_result, result
+            )
+            store_future.add_done_callback(lambda f: done.set_result(self._success(f)))
+
+        self._when_all_done([parse_future, previous], submit_store)
+
+    def _success(self, future: Future) -> bool:
+        """取出阶段结果，异常视为失败"""
+        try:
+            return bool(future.result())
+        except Exception as e:
+            self.logger.error(f"邮件处理失败: {str(e)}", exc_info=True)
+            return False
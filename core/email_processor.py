@@ -3,140 +3,682 @@
 负责协调邮件检查、规则应用和文件处理的整体流程
 """
 
-from typing import Dict, Any
+import email
+import email.utils
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
 from utils.logger import Logger
-from infrastructure.email_client import EmailClient
-from modules.file_processor.excel_handler import ExcelHandler
+from utils.helpers import load_yaml
+from utils.emailHelper import EmailHelper
+from infrastructure.email_client import EmailClient, load_mailboxes
+from infrastructure.attachment_store import AttachmentStore
+from infrastructure.message_ledger import MessageLedger
+from infrastructure.mail_cache import MailCache
+from modules.file_processor.excel_handler import ExcelHandler, parse_attachments
 from bll.wip_fab import WipFabBLL
 from bll.wip_assy import WipAssyBLL
 from modules.erp_integration.workflows.receipt import ReceiptErp
+from .email_pipeline import EmailPipeline
+
+# 邮件配置文件
+EMAIL_CONFIG_PATH = 'config/email_config.yaml'
+# 解析后写入数据库的进度表类别
+WIP_CATEGORIES = ('封装进度表', '晶圆进度表')
+# 附件可能是压缩包、解压后交给处理器的测试报告类别
+REPORT_CATEGORIES = ('测试报告',)
+# 各邮箱统计中需要汇总的计数
+COUNTERS = ('total', 'processed', 'failed', 'duplicates', 'superseded', 'attachments')
 
 class EmailProcessor:
     """邮件处理器核心类"""
     
-    def __init__(self):
-        """初始化邮件处理器"""
+    def __init__(self, mailboxes: Optional[List[Dict[str, Any]]] = None):
+        """
+        初始化邮件处理器
+        Args:
+            mailboxes: 邮箱配置覆盖项列表，默认读取邮件配置中的 accounts
+        """
         self.logger = Logger(__name__)
-        self._init_email_client()
+        self.settings = load_yaml('config/settings.yaml')
+        self.mail_cache = self._init_mail_cache()
+        self._init_email_clients(mailboxes)
         self.excel_handler = ExcelHandler()
         self.wip_fab_bll = WipFabBLL()
         self.wip_assy_bll = WipAssyBLL()
+        self.attachment_store = self._init_attachment_store()
+        self.message_ledger = self._init_message_ledger()
+        # 同一供应商积压的多封进度表只处理最新一封
+        self.coalesce_wip = self.settings['features']['email_processor'].get('coalesce_wip', False)
+        # 多个邮箱同时处理时，ERP录入仍需串行
+        self._erp_lock = threading.Lock()
 
-    def _init_email_client(self):
-        """初始化邮件客户端"""
-        self.email_client = EmailClient('config/email_config.yaml')
-        self.email_client.connect()
-        self.imap = self.email_client.imap
+    def _init_email_clients(self, mailboxes: Optional[List[Dict[str, Any]]] = None):
+        """初始化各邮箱的邮件客户端，连接在处理时按邮箱建立"""
+        if mailboxes is None:
+            mailboxes = load_mailboxes(EMAIL_CONFIG_PATH)
+        self.email_clients = [EmailClient(EMAIL_CONFIG_PATH, mailbox) for mailbox in mailboxes]
+        self.email_client = self.email_clients[0]
+        for client in self.email_clients:
+            client.mail_cache = self.mail_cache
 
-    def process_unread_emails(self) -> Dict[str, int]:
+    def _init_mail_cache(self) -> Optional[MailCache]:
+        """获取进程内共享的本地邮件缓存，未启用时返回None"""
+        cache_config = self.settings['features']['email_processor'].get('mail_cache', {})
+        if not cache_config.get('enabled', False):
+            return None
+        return MailCache.get_shared(
+            cache_config.get('root', 'data/mail_cache'),
+            retention_days=cache_config.get('retention_days', 90)
+        )
+
+    def _init_attachment_store(self) -> Optional[AttachmentStore]:
+        """获取进程内共享的附件去重索引，未启用时返回None"""
+        store_config = self.settings['features']['email_processor'].get('attachment_store', {})
+        if not store_config.get('enabled', False):
+            return None
+        return AttachmentStore.get_shared(
+            store_config.get('db_file', 'data/attachment_store.db'),
+            retention_days=store_config.get('retention_days', 30),
+            max_entries=store_config.get('max_entries', 20000)
+        )
+
+    def _init_message_ledger(self) -> Optional[MessageLedger]:
+        """获取进程内共享的已处理邮件台账，未启用时返回None"""
+        ledger_config = self.settings['features']['email_processor'].get('message_ledger', {})
+        if not ledger_config.get('enabled', False):
+            return None
+        return MessageLedger.get_shared(
+            ledger_config.get('db_file', 'data/message_ledger.db'),
+            retention_days=ledger_config.get('retention_days', 180),
+            capacity=ledger_config.get('capacity', 100000),
+            error_rate=ledger_config.get('error_rate', 0.001)
+        )
+
+    def process_unread_emails(self) -> Dict[str, Any]:
         """
-        处理所有未读邮件
+        处理所有邮箱的未读邮件
+
+        每个邮箱在各自线程中同步和下载，解析、入库和ERP录入共用一条流水线
+
         Returns:
-            处理统计信息
+            处理统计信息，mailboxes 中为各邮箱的统计
+        """
+        stats: Dict[str, Any] = {key: 0 for key in COUNTERS}
+        stats['mailboxes'] = {}
+        errors = []
+
+        pipeline_config = self.settings['features']['email_processor'].get('pipeline', {})
+        pipeline = None
+        if pipeline_config.get('enabled', False):
+            # 分阶段流水线：下载、解析、入库并行，ERP录入串行
+            pipeline = EmailPipeline(self, **{k: v for k, v in pipeline_config.items() if k != 'enabled'})
+            pipeline.open()
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.email_clients), thread_name_prefix='mailbox') as executor:
+                futures = [
+                    (client, executor.submit(self.process_mailbox, client, pipeline))
+                    for client in self.email_clients
+                ]
+                for client, future in futures:
+                    try:
+                        mailbox_stats = future.result()
+                    except Exception as e:
+                        self.logger.error(f"{client.name} 邮件处理过程发生错误: {str(e)}", exc_info=True)
+                        errors.append(e)
+                        mailbox_stats = {'error': str(e)}
+                    stats['mailboxes'][client.name] = mailbox_stats
+                    for key in COUNTERS:
+                        stats[key] += mailbox_stats.get(key, 0)
+        finally:
+            if pipeline:
+                pipeline.close()
+
+        # 所有邮箱都失败时按原来的方式抛出，由调度器记录任务失败
+        if errors and len(errors) == len(self.email_clients):
+            raise errors[0]
+
+        self.logger.info(
+            f"邮件处理完成: 邮箱 {len(self.email_clients)}, "
+            f"总数 {stats['total']}, "
+            f"成功 {stats['processed']}, "
+            f"失败 {stats['failed']}, "
+            f"重复 {stats['duplicates']}, "
+            f"附件 {stats['attachments']}"
+        )
+        return stats
+
+    def process_mailbox(self, email_client: EmailClient, pipeline: Optional[EmailPipeline] = None) -> Dict[str, Any]:
+        """
+        处理单个邮箱的未读邮件
+        Args:
+            email_client: 邮箱客户端
+            pipeline: 已打开的共用流水线，为None时顺序处理
+        Returns:
+            该邮箱的处理统计信息
         """
-        stats = {
-            'total': 0,
-            'processed': 0,
-            'failed': 0,
-            'attachments': 0
-        }
-        
+        started = time.perf_counter()
+        stats: Dict[str, Any] = {key: 0 for key in COUNTERS}
+        # 处理失败的邮件UID，检查点不会越过它们，下次运行会重试
+        failed_ids = []
+        # 处理成功（含内容重复）的邮件UID，被取代的进度表只在最新一封成功后登记
+        succeeded_ids = []
+
+        email_client.connect()
         try:
             # 获取所有未读邮件
-            unread_emails = self.email_client.get_unread_emails()
+            unread_emails = email_client.get_unread_emails()
             stats['total'] = len(unread_emails)
-            
-            # 处理每封邮件
-            for email_id in unread_emails:
-                try:
-                    # 应用规则引擎，得到匹配结果
-                    match_result = self.email_client.process_email(email_id)
-                    self.logger.debug(f"匹配结果: {match_result}")
-                    
-                    # 检查是否有匹配结果
-                    if not match_result:
-                        self.logger.debug("邮件不匹配任何规则，跳过处理")
-                        continue
-                        
-                    # 统计附件数
-                    attachments = match_result.get('attachments', [])
-                    if attachments:
-                        stats['attachments'] += len(attachments)
-                    
-                    # 根据匹配结果，处理附件
-                    category = match_result.get('category')
-                    if category == '封装送货单' and attachments:
-                        result = self.excel_handler.process_excel(match_result)
-                        stats['processed'] += 1
-                        self.logger.debug(f"处理结果: {result}")
-                        try:
-                            receipt_handler = ReceiptErp()
-                            # 从result中提取必要的数据
-                            # result是一个字典，key是日期，value是该日期的送货单数据列表
-                            for delivery_date, delivery_items in result.items():
-                                supplier = match_result.get('supplier')
-                                success = receipt_handler.process_delivery_data(
-                                    date=delivery_date,
-                                    supplier=supplier,
-                                    data=delivery_items
-                                )
-                                if success:
-                                    self.logger.info(f"{supplier}送货单数据录入E10成功！")
-                                else:
-                                    self.logger.error(f"{supplier}送货单数据录入E10失败：返回值为False")
-                                    stats['failed'] += 1
-                                    break
-                        except Exception as e:
-                            self.logger.error(f"{match_result.get('supplier')}送货单数据录入E10失败：{str(e)}", exc_info=True)
-                            stats['failed'] += 1
-                        continue
-                    
-                    if category == '封装进度表' and attachments:
-                        result = self.excel_handler.process_excel(match_result)
-                        if result is None:
-                            stats['failed'] += 1
-                            self.logger.debug("该封装进度表内容可能为空或格式错误，跳过处理")
-                            continue
-                        stats['processed'] += 1
-                        self.logger.debug(f"处理结果: {result}")
-                        self.wip_assy_bll.update_supplier_progress(result.to_dict(orient="records"))
-                        continue
-
-                    if category == '晶圆进度表' and attachments:
-                        result = self.excel_handler.process_excel(match_result)
-                        if result is None:
-                            stats['failed'] += 1
-                            self.logger.debug("该晶圆进度表内容可能为空或格式错误，跳过处理")
-                            continue
+
+            # 首轮只按邮件头匹配规则，未命中的邮件不下载正文
+            if email_client.config.get('header_first_pass', True):
+                candidates = email_client.match_emails(unread_emails)
+            else:
+                candidates = [(email_id, None) for email_id in unread_emails]
+            # 台账中已处理过的邮件（重新投递或被标记为未读）不再下载和处理
+            candidates, processed_before = self._skip_processed(candidates, email_client)
+            # 积压的进度表只保留每个供应商最新的一封，较早的在最新一封处理成功后才登记已读
+            candidates, superseded_by = self._coalesce_snapshots(candidates, email_client)
+            # 搜索和邮件头匹配的耗时
+            stats['sync_seconds'] = round(time.perf_counter() - started, 3)
+
+            if pipeline and len(candidates) > 1:
+                pipeline_stats = pipeline.process(candidates, email_client)
+                failed_ids.extend(pipeline_stats.pop('failed_ids'))
+                succeeded_ids.extend(pipeline_stats.pop('succeeded_ids'))
+                stats.update(pipeline_stats)
+            else:
+                for email_id, header_match in candidates:
+                    outcome = self.process_candidate(email_id, header_match, email_client)
+                    stats['attachments'] += outcome['attachments']
+                    if outcome['status'] in ('processed', 'duplicate'):
                         stats['processed'] += 1
-                        self.logger.debug(f"处理结果: {result}")
+                        stats['duplicates'] += outcome['status'] == 'duplicate'
+                        succeeded_ids.append(email_id)
+                    elif outcome['status'] == 'failed':
+                        stats['failed'] += 1
+                        failed_ids.append(email_id)
+            superseded, deferred_ids = self._settle_superseded(superseded_by, succeeded_ids, email_client)
+            stats['processed'] += processed_before + superseded
+            stats['duplicates'] += processed_before
+            stats['superseded'] = superseded
 
-                        self.wip_fab_bll.update_supplier_progress(result.to_dict(orient="records"))
-                        continue
+            # 处理完成的邮件统一标记为已读，失败的保持未读
+            flags_committed = email_client.commit_flags()
+            if not flags_committed:
+                self.logger.error(f"{email_client.name} 提交已读标记失败，本次不更新同步检查点")
 
-                    # TODO: 处理其他规则 封装进度表\fab进度表\测试报告\
-                        
-                except Exception as e:
-                    stats['failed'] += 1
-                    self.logger.error(f"处理邮件失败: {str(e)}", exc_info=True)
-                    continue
-                    
+            # 提交增量同步检查点：有失败（或被失败邮件取代而未登记）的邮件时停在最早的一封之前
+            if unread_emails and flags_committed:
+                if failed_ids or deferred_ids:
+                    email_client.commit_sync(min(int(uid) for uid in failed_ids + deferred_ids) - 1)
+                else:
+                    email_client.commit_sync(max(int(uid) for uid in unread_emails))
+
+            stats['seconds'] = round(time.perf_counter() - started, 3)
+            # 本次运行结束时使用的规则版本
+            stats['rules_version'] = email_client.rule_engine.version
+            # 压缩和流水线节省的流量与时间
+            stats['transfer'] = email_client.transfer_stats()
             self.logger.info(
-                f"邮件处理完成: 总数 {stats['total']}, "
+                f"{email_client.name} 处理完成: 总数 {stats['total']}, "
                 f"成功 {stats['processed']}, "
                 f"失败 {stats['failed']}, "
-                f"附件 {stats['attachments']}"
+                f"重复 {stats['duplicates']}, "
+                f"附件 {stats['attachments']}, "
+                f"耗时 {stats['seconds']:.2f}s"
             )
+            if stats['transfer']:
+                transfer = stats['transfer']
+                self.logger.info(
+                    f"{email_client.name} 传输: 接收 {transfer['bytes_in']} 字节(线上 {transfer['wire_in']}), "
+                    f"压缩节省 {transfer['compression_saved_bytes']} 字节, "
+                    f"流水线节省往返 {transfer['round_trips_saved']} 次(约 {transfer['pipeline_saved_seconds']:.2f}s)"
+                )
             return stats
+
+        finally:
+            email_client.disconnect()
+
+    def _skip_processed(self, candidates: List[Tuple[bytes, Optional[Dict[str, Any]]]],
+                        email_client: EmailClient) -> Tuple[List[Tuple[bytes, Optional[Dict[str, Any]]]], int]:
+        """
+        按台账过滤已处理过的邮件，过滤掉的邮件直接登记已读
+        Args:
+            candidates: [(UID, 邮件头匹配结果)]
+            email_client: 邮件所在邮箱
+        Returns:
+            (需要处理的候选邮件, 跳过的邮件数)
+        """
+        if self.message_ledger is None:
+            return candidates, 0
+        remaining = []
+        skipped = 0
+        for email_id, header_match in candidates:
+            # 未做邮件头首轮匹配时没有邮件头，下载后由 is_duplicate 判断
+            if header_match and self.message_ledger.contains(self._message_key(header_match)):
+                self.logger.info(f"邮件已处理过，跳过: {header_match['email_data'].get('subject')}")
+                self.acknowledge(email_id, header_match, email_client)
+                skipped += 1
+            else:
+                remaining.append((email_id, header_match))
+        return remaining, skipped
+
+    def _coalesce_snapshots(self, candidates: List[Tuple[bytes, Optional[Dict[str, Any]]]],
+                            email_client: EmailClient) -> Tuple[List[Tuple[bytes, Optional[Dict[str, Any]]]], Dict[bytes, Any]]:
+        """
+        合并积压的进度表：同一(类别, 供应商)只处理最新的一封，较早的邮件不下载、不解析
+
+        进度表是全量快照，按顺序入库时较早的快照会立即被最新的覆盖；送货单每封都要录入ERP，不合并。
+        较早的邮件此时不登记已读，最新一封处理成功后由 _settle_superseded 登记
+        Args:
+            candidates: [(UID, 邮件头匹配结果)]
+            email_client: 邮件所在邮箱
+        Returns:
+            (需要处理的候选邮件, {最新一封的UID: (其邮件头匹配结果, [(被取代的UID, 邮件头匹配结果)])})
+        """
+        if not self.coalesce_wip:
+            return candidates, {}
+        newest: Dict[Tuple[str, str], Tuple[bytes, Dict[str, Any]]] = {}
+        for email_id, header_match in candidates:
+            # 未做邮件头首轮匹配时下载前不知道类别，不参与合并
+            if not header_match or header_match.get('category') not in WIP_CATEGORIES:
+                continue
+            key = (header_match['category'], header_match.get('supplier'))
+            current = newest.get(key)
+            if current is None or self._snapshot_order(email_id, header_match) > self._snapshot_order(*current):
+                newest[key] = (email_id, header_match)
+
+        keep = {email_id for email_id, _ in newest.values()}
+        remaining = []
+        superseded_by: Dict[bytes, Any] = {}
+        for email_id, header_match in candidates:
+            key = (header_match.get('category'), header_match.get('supplier')) if header_match else None
+            if key not in newest or email_id in keep:
+                remaining.append((email_id, header_match))
+                continue
+            latest_id, latest = newest[key]
+            superseded_by.setdefault(latest_id, (latest, []))[1].append((email_id, header_match))
+        if superseded_by:
+            skipped = sum(len(older) for _, older in superseded_by.values())
+            self.logger.info(f"{email_client.name} 合并积压的进度表: 跳过 {skipped} 封，处理 {len(newest)} 封")
+        return remaining, superseded_by
+
+    def _settle_superseded(self, superseded_by: Dict[bytes, Any], succeeded_ids: List[bytes],
+                           email_client: EmailClient) -> Tuple[int, List[bytes]]:
+        """
+        最新一封进度表处理完成后，登记被它取代的较早邮件
+
+        最新一封入库成功（或内容已入库过）时较早的邮件记入台账并登记已读；
+        最新一封失败或没有可入库的附件（如附件超过大小限制）时较早的邮件保持未读，
+        下次运行重新合并，由其中最新的一封入库
+        Args:
+            superseded_by: _coalesce_snapshots 返回的取代关系
+            succeeded_ids: 本次处理成功（含内容重复）的UID
+            email_client: 邮件所在邮箱
+        Returns:
+            (登记已读的邮件数, 保持未读的邮件UID)
+        """
+        settled = 0
+        deferred_ids: List[bytes] = []
+        for latest_id, (latest, older) in superseded_by.items():
+            if latest_id not in succeeded_ids:
+                deferred_ids.extend(email_id for email_id, _ in older)
+                self.logger.info(
+                    f"最新的进度表未入库，被取代的 {len(older)} 封保持未读: {latest['email_data'].get('subject')}"
+                )
+                continue
+            latest_data = latest['email_data']
+            for email_id, header_match in older:
+                self.logger.info(
+                    f"进度表已被较新的邮件取代，跳过: {header_match['email_data'].get('subject')} "
+                    f"-> {latest_data.get('subject')}"
+                )
+                self._remember_message(
+                    header_match, {'superseded_by': latest_data.get('message_id') or latest_data.get('subject')}
+                )
+                self.acknowledge(email_id, header_match, email_client)
+                settled += 1
+        return settled, deferred_ids
+
+    @staticmethod
+    def _snapshot_order(email_id: bytes, header_match: Dict[str, Any]) -> Tuple[float, int]:
+        """进度表的新旧顺序：先比较发送时间，时间相同或缺失时比较UID"""
+        try:
+            sent_at = email.utils.parsedate_to_datetime(header_match['email_data'].get('date') or '').timestamp()
+        except (TypeError, ValueError):
+            sent_at = float('-inf')
+        return sent_at, int(email_id)
+
+    @staticmethod
+    def _message_key(match_result: Dict[str, Any]) -> Optional[str]:
+        """匹配结果对应的台账键"""
+        email_data = match_result.get('email_data')
+        return MessageLedger.message_key(email_data) if email_data else None
+
+    def fetch_candidate(self, email_id: bytes, header_match: Optional[Dict[str, Any]],
+                        email_client: Optional[EmailClient] = None) -> Dict[str, Any]:
+        """
+        下载阶段：下载附件并返回匹配结果
+        Args:
+            email_id: 邮件UID
+            header_match: 邮件头首轮匹配结果
+            email_client: 邮件所在邮箱，默认为主邮箱
+        Returns:
+            匹配结果，未匹配时为空字典
+        Raises:
+            RuntimeError: 下载或解析邮件失败（该邮件记为失败，保持未读）
+        """
+        email_client = email_client or self.email_client
+        match_result = email_client.process_email(email_id, header_match)
+        self.logger.debug(f"匹配结果: {match_result}")
+        return match_result
+
+    def process_candidate(self, email_id: bytes, header_match: Optional[Dict[str, Any]],
+                          email_client: Optional[EmailClient] = None) -> Dict[str, Any]:
+        """
+        顺序处理单封邮件：下载 -> 解析 -> 入库/录入ERP
+        Args:
+            email_id: 邮件UID
+            header_match: 邮件头首轮匹配结果
+            email_client: 邮件所在邮箱，默认为主邮箱
+        Returns:
+            {'status': 'processed'/'duplicate'/'failed'/'skipped', 'attachments': 附件数}
+        """
+        outcome = {'status': 'skipped', 'attachments': 0}
+        match_result: Dict[str, Any] = {}
+        try:
+            # 应用规则引擎，得到匹配结果
+            match_result = self.fetch_candidate(email_id, header_match, email_client)
             
+            # 检查是否有匹配结果
+            if not match_result:
+                self.logger.debug("邮件不匹配任何规则，跳过处理")
+                return outcome
+                
+            # 统计附件数
+            attachments = match_result.get('attachments', [])
+            outcome['attachments'] = len(attachments)
+            if not attachments:
+                return outcome
+
+            outcome['status'] = self.handle_match(match_result)
+            return outcome
+                
         except Exception as e:
-            self.logger.error(f"邮件处理过程发生错误: {str(e)}", exc_info=True)
-            raise
+            self.logger.error(f"处理邮件失败: {str(e)}", exc_info=True)
+            outcome['status'] = 'failed'
+            return outcome
 
         finally:
-            self.email_client.disconnect()
+            if outcome['status'] != 'failed':
+                self.acknowledge(email_id, match_result, email_client)
+
+    def handle_match(self, match_result: Dict[str, Any], skip_duplicates: bool = True) -> str:
+        """
+        按类别处理已下载附件的邮件：进度表解析入库，送货单录入ERP
+        Args:
+            match_result: 匹配结果（含附件路径）
+            skip_duplicates: 是否跳过已处理过的邮件
+        Returns:
+            'processed'/'duplicate'/'failed'/'skipped'
+        """
+        if skip_duplicates and self.is_duplicate(match_result):
+            return 'duplicate'
+
+        category = match_result.get('category')
+        if category == '封装送货单':
+            success = self.process_delivery(match_result)
+        elif category in WIP_CATEGORIES:
+            success = self.store_wip(match_result, parse_attachments(match_result))
+        elif category in REPORT_CATEGORIES:
+            success = self.store_report(match_result, parse_attachments(match_result))
+        else:
+            return 'skipped'
+        return 'processed' if success else 'failed'
+
+    def reprocess_cached(self, supplier: Optional[str] = None, category: Optional[str] = None,
+                         since: Optional[float] = None, until: Optional[float] = None,
+                         message_id: Optional[str] = None, include_delivery: bool = False) -> Dict[str, Any]:
+        """
+        从本地邮件缓存重新处理邮件（不连接邮箱）
+
+        按当前规则重新匹配、取出附件后解析入库，用于处理程序修复后的补处理。
+        已处理台账和附件去重不生效；送货单会重复录入ERP，默认跳过
+
+        Args:
+            supplier: 供应商
+            category: 类别
+            since: 邮件时间下限（时间戳）
+            until: 邮件时间上限（时间戳）
+            message_id: 只处理指定Message-ID的邮件
+            include_delivery: 是否包含送货单
+        Returns:
+            处理统计信息
+        """
+        if self.mail_cache is None:
+            raise RuntimeError("未启用本地邮件缓存(features.email_processor.mail_cache)")
+        entries = self.mail_cache.find(
+            supplier=supplier, category=category, since=since, until=until, message_id=message_id
+        )
+        clients = {client.name: client for client in self.email_clients}
+        stats: Dict[str, Any] = {key: 0 for key in COUNTERS}
+        stats['total'] = len(entries)
+        stats['skipped'] = 0
+        started = time.perf_counter()
+
+        for entry in entries:
+            client = clients.get(entry['mailbox'], self.email_client)
+            email_id = str(entry['uid'] or 0).encode()
+            try:
+                msg = email.message_from_bytes(self.mail_cache.read(entry))
+                email_helper = EmailHelper(None)
+                email_data = email_helper.parse_email_data(msg, email_id)
+                match_result = client.rule_engine.apply_rules(email_data)
+                if not match_result or (match_result.get('category') == '封装送货单' and not include_delivery):
+                    stats['skipped'] += 1
+                    continue
+                match_result['email_data'] = email_data
+                client.assign_message_folder(match_result, email_id)
+                match_result['attachments'] = email_helper.save_attachments(
+                    msg,
+                    email_id,
+                    match_result['actions']['attachment_folder'],
+                    match_result.get('allowed_extensions', []),
+                    match_result['actions'].get('max_attachment_size', client.config.get('max_attachment_size'))
+                )
+                match_result['attachment_hashes'] = email_helper.attachment_hashes
+                stats['attachments'] += len(match_result['attachments'])
+                if not match_result['attachments']:
+                    stats['skipped'] += 1
+                    continue
+                status = self.handle_match(match_result, skip_duplicates=False)
+            except Exception as e:
+                self.logger.error(f"重新处理缓存邮件失败 {entry['filename']}: {str(e)}", exc_info=True)
+                status = 'failed'
+            if status in stats:
+                stats[status] += 1
+
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+        self.logger.info(
+            f"缓存邮件重新处理完成: 总数 {stats['total']}, "
+            f"成功 {stats['processed']}, "
+            f"失败 {stats['failed']}, "
+            f"跳过 {stats['skipped']}, "
+            f"附件 {stats['attachments']}, "
+            f"耗时 {stats['seconds']:.2f}s"
+        )
+        return stats
+
+    def acknowledge(self, email_id: bytes, match_result: Optional[Dict[str, Any]],
+                    email_client: Optional[EmailClient] = None) -> None:
+        """
+        下游处理完成后登记已读标记，本次运行结束时统一提交
+        Args:
+            email_id: 邮件UID
+            match_result: 匹配结果，未匹配规则的邮件保持未读
+            email_client: 邮件所在邮箱，默认为主邮箱
+        """
+        if match_result and match_result.get('actions', {}).get('mark_as_read', True):
+            (email_client or self.email_client).queue_mark_as_read(email_id)
+
+    def process_delivery(self, match_result: Dict[str, Any]) -> bool:
+        """
+        送货单处理：解析后逐日录入E10（ERP操作界面，只能串行执行）
+        Args:
+            match_result: 匹配结果
+        Returns:
+            bool: 是否全部录入成功
+        """
+        # 送货单解析会写入共享的工作进程表，多个邮箱同时处理时在此排队
+        with self._erp_lock:
+            return self._process_delivery(match_result)
+
+    def _process_delivery(self, match_result: Dict[str, Any]) -> bool:
+        """送货单解析并录入E10（调用方持有 _erp_lock）"""
+        result = self.excel_handler.process_excel(match_result)
+        self.logger.debug(f"处理结果: {result}")
+        if not result:
+            self.logger.error(f"{match_result.get('supplier')}送货单解析失败")
+            return False
+        supplier = match_result.get('supplier')
+        try:
+            receipt_handler = ReceiptErp()
+            # result是一个字典，key是日期，value是该日期的送货单数据列表
+            for delivery_date, delivery_items in result.items():
+                success = receipt_handler.process_delivery_data(
+                    date=delivery_date,
+                    supplier=supplier,
+                    data=delivery_items
+                )
+                if success:
+                    self.logger.info(f"{supplier}送货单数据录入E10成功！")
+                else:
+                    self.logger.error(f"{supplier}送货单数据录入E10失败：返回值为False")
+                    return False
+            self.remember_processed(match_result, {'dates': len(result)})
+            return True
+        except Exception as e:
+            self.logger.error(f"{supplier}送货单数据录入E10失败：{str(e)}", exc_info=True)
+            return False
+
+    def store_wip(self, match_result: Dict[str, Any], result: Any) -> bool:
+        """
+        入库阶段：把进度表解析结果写入数据库
+        Args:
+            match_result: 匹配结果
+            result: 解析得到的DataFrame
+        Returns:
+            bool: 是否成功
+        """
+        category = match_result.get('category')
+        if result is None:
+            self.logger.debug(f"该{category}内容可能为空或格式错误，跳过处理")
+            return False
+        self.logger.debug(f"处理结果: {result}")
+        if category == '封装进度表':
+            self.wip_assy_bll.update_supplier_progress(result.to_dict(orient="records"))
+        else:
+            self.wip_fab_bll.update_supplier_progress(result.to_dict(orient="records"))
+        self.remember_processed(match_result, {'rows': len(result)})
+        return True
+
+    def store_report(self, match_result: Dict[str, Any], result: Any) -> bool:
+        """
+        测试报告的处理结果：附件（含压缩包中解出的表格）已交给处理器，记录为已处理
+        Args:
+            match_result: 匹配结果
+            result: 处理器的结果，暂无处理器时为 {'files': 解出的文件列表}
+        Returns:
+            bool: 是否成功
+        """
+        if result is None:
+            self.logger.debug(f"测试报告 {match_result.get('name')} 未得到处理结果，跳过处理")
+            return False
+        files = result.get('files', []) if isinstance(result, dict) else []
+        self.logger.info(f"测试报告 {match_result.get('name')} 处理完成: 文件 {len(files)} 个")
+        self.remember_processed(match_result, {'files': len(files)})
+        return True
+
+    def _attachment_hashes(self, match_result: Dict[str, Any]) -> List[str]:
+        """获取邮件所有附件的内容哈希"""
+        known_hashes = match_result.get('attachment_hashes', {})
+        return [
+            AttachmentStore.file_hash(path, known_hashes)
+            for path in match_result.get('attachments', [])
+        ]
+
+    def is_duplicate(self, match_result: Dict[str, Any]) -> bool:
+        """
+        判断邮件是否已处理过（台账中有记录，或附件内容完全相同）
+        Args:
+            match_result: 匹配结果
+        Returns:
+            bool: 是否可以跳过解析和入库
+        """
+        if self.message_ledger is not None and self.message_ledger.contains(self._message_key(match_result)):
+            self.logger.info(f"{match_result.get('supplier')}{match_result.get('category')}邮件已处理过，跳过解析和入库")
+            return True
+        if self.attachment_store is None or not match_result.get('attachments'):
+            return False
+        try:
+            if not self.attachment_store.contains_all(self._attachment_hashes(match_result)):
+                return False
+        except OSError as e:
+            self.logger.warning(f"计算附件哈希失败: {str(e)}")
+            return False
+        self.logger.info(
+            f"{match_result.get('supplier')}{match_result.get('category')}附件已处理过，跳过解析和入库"
+        )
+        return True
+
+    def remember_processed(self, match_result: Dict[str, Any], stats: Dict[str, Any]) -> None:
+        """
+        记录处理成功的邮件和附件，之后再收到同一封邮件或内容相同的附件时直接跳过
+        Args:
+            match_result: 匹配结果
+            stats: 处理结果统计
+        """
+        self._remember_message(match_result, stats)
+        if self.attachment_store is None:
+            return
+        try:
+            for path, file_hash in zip(match_result.get('attachments', []), self._attachment_hashes(match_result)):
+                self.attachment_store.add(
+                    file_hash,
+                    match_result.get('supplier'),
+                    match_result.get('category'),
+                    filename=Path(path).name,
+                    stats=stats
+                )
+        except Exception as e:
+            # 索引写入失败不影响本次处理结果
+            self.logger.warning(f"记录附件索引失败: {str(e)}")
             
+    def _remember_message(self, match_result: Dict[str, Any], stats: Dict[str, Any]) -> None:
+        """把处理成功的邮件写入台账（数据库提交或ERP录入成功之后调用）"""
+        if self.message_ledger is None:
+            return
+        key = self._message_key(match_result)
+        if key is None:
+            return
+        try:
+            self.message_ledger.record(
+                key,
+                match_result['email_data'],
+                match_result.get('supplier'),
+                match_result.get('category'),
+                attachment_hashes=self._attachment_hashes(match_result),
+                stats=stats
+            )
+        except Exception as e:
+            # 台账写入失败不影响本次处理结果
+            self.logger.warning(f"记录已处理邮件台账失败: {str(e)}")
+
     def _process_attachment(self, attachment: Dict[str, Any], rule_type: str) -> None:
         """
         处理单个附件
@@ -13,6 +13,12 @@ from apscheduler.triggers.interval import IntervalTrigger
 
 from utils.logger import Logger
 from utils.helpers import load_yaml
+from infrastructure.attachment_store import AttachmentStore
+from infrastructure.email_client import ImapConnectionPool, load_mailboxes
+from infrastructure.mail_cache import MailCache
+from infrastructure.message_ledger import MessageLedger
+from infrastructure.email_listener import EmailIdleListener
+from modules.email_processor.rules.engine import RuleEngine
 from .email_processor import EmailProcessor
 from .crawler_processor import CrawlerProcessor
 
@@ -27,6 +33,9 @@ class Scheduler:
         self.scheduler = BackgroundScheduler()
         self.crawler_processor = CrawlerProcessor()
         self.email_processor = None  # 初始化时不创建EmailProcessor实例
+        self.email_listeners = []  # IDLE模式下各邮箱的新邮件监听器
+        # 定时任务与IDLE监听可能同时触发，邮件处理需串行执行
+        self._email_lock = threading.Lock()
         self._setup_jobs()
         
     def _setup_jobs(self):
@@ -68,35 +77,65 @@ class Scheduler:
                 self.logger.debug("系统启动，执行首次邮件处理任务...")
                 self._run_email_processor()
             
+            # IDLE模式：新邮件到达时立即处理，定时任务仅作为兜底
+            check_interval = email_config['check_interval']
+            if email_config.get('mode', 'poll') == 'idle':
+                mailboxes = load_mailboxes('config/email_config.yaml')
+                for mailbox in mailboxes:
+                    listener = EmailIdleListener(
+                        'config/email_config.yaml',
+                        on_new_mail=self._run_email_processor,
+                        idle_timeout=email_config.get('idle_timeout', 1500),
+                        mailbox=mailbox
+                    )
+                    if listener.supports_idle():
+                        self.email_listeners.append(listener)
+                # 只有全部邮箱都能推送时才放宽轮询间隔
+                if self.email_listeners and len(self.email_listeners) == len(mailboxes):
+                    check_interval = email_config.get('idle_fallback_interval', 3600)
+                    self.logger.debug("邮件处理使用IMAP IDLE推送模式")
+            
             # 设置定时任务
             self.scheduler.add_job(
                 func=self._run_email_processor,
                 trigger=IntervalTrigger(
-                    seconds=email_config['check_interval']
+                    seconds=check_interval
                 ),
                 id='email_processor',
                 name='邮件处理任务',
                 replace_existing=True
             )
             self.logger.debug(
-                f"邮件处理任务已设置，间隔：{email_config['check_interval']}秒"
+                f"邮件处理任务已设置，间隔：{check_interval}秒"
             )
+
+            # 连接池中的空闲连接定期NOOP保活，避免服务器端超时断开
+            keepalive_interval = email_config.get('imap_keepalive_interval', 300)
+            if keepalive_interval:
+                self.scheduler.add_job(
+                    func=ImapConnectionPool.keepalive_all,
+                    trigger=IntervalTrigger(seconds=keepalive_interval),
+                    id='imap_keepalive',
+                    name='IMAP连接保活',
+                    replace_existing=True
+                )
             
     def _run_email_processor(self):
         """运行邮件处理器"""
-        try:
-            self.logger.info("开始执行邮件处理任务...")
-            # 每次运行时创建新的EmailProcessor实例
-            self.email_processor = EmailProcessor()
-            stats = self.email_processor.process_unread_emails()
-            self.logger.debug(f"邮件处理任务完成: {stats}")
-            
-        except Exception as e:
-            self.logger.error(f"邮件处理任务失败: {str(e)}", exc_info=True)
-        finally:
-            # 任务完成后清理资源
-            if self.email_processor:
-                self.email_processor = None
+        with self._email_lock:
+            try:
+                self.logger.info("开始执行邮件处理任务...")
+                # 每次运行时创建新的EmailProcessor实例
+                self.email_processor = EmailProcessor()
+                stats = self.email_processor.process_unread_emails()
+                self.logger.debug(f"邮件处理任务完成: {stats}")
+                
+            except Exception as e:
+                self.logger.error(f"邮件处理任务失败: {str(e)}", exc_info=True)
+            finally:
+                # 任务完成后清理资源
+                if self.email_processor:
+                    self.email_processor = None
             
     def _run_crawler_processor(self):
         """运行爬虫处理器"""
@@ -120,6 +159,8 @@ class Scheduler:
         """启动调度器"""
         try:
             self.scheduler.start()
+            for listener in self.email_listeners:
+                listener.start()
             self.logger.debug("调度器已启动")
             
         except Exception as e:
@@ -129,7 +170,14 @@ class Scheduler:
     def stop(self):
         """停止调度器"""
         try:
+            for listener in self.email_listeners:
+                listener.stop()
             self.scheduler.shutdown()
+            ImapConnectionPool.close_all()
+            RuleEngine.close_all()
+            AttachmentStore.close_all()
+            MessageLedger.close_all()
+            MailCache.close_all()
             self.logger.debug("调度器已停止")
             
         except Exception as e:
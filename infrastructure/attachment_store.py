@@ -0,0 +1,210 @@
+"""
+附件去重存储模块
+按附件内容哈希记录已处理过的附件，供应商重复发送同一份文件时跳过解析和入库
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Set, Union
+
+from utils.logger import Logger
+from utils.helpers import get_file_hash
+
+# 附件哈希算法，与邮件下载时流式计算的哈希保持一致
+HASH_ALGORITHM = 'sha256'
+
+
+class AttachmentStore:
+    """
+    基于内容哈希的附件索引
+
+    索引保存在本地SQLite文件中：哈希 -> (供应商, 类别, 处理时间, 处理结果统计)。
+    启动时把全部哈希加载到内存集合，查询时先查集合，命中后才访问数据库。
+    超过保留天数或条目上限的记录会被清理。
+    """
+
+    # 进程内共享的索引：数据库文件的绝对路径 -> 索引
+    _shared: Dict[str, 'AttachmentStore'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_file: Union[str, Path], retention_days: int = 30, max_entries: int = 20000):
+        """
+        初始化附件索引
+        Args:
+            db_file: SQLite索引文件路径
+            retention_days: 记录保留天数
+            max_entries: 最多保留的记录数
+        """
+        self.logger = Logger(__name__)
+        self.db_file = Path(db_file)
+        self.retention_days = retention_days
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._hashes: Set[str] = set()
+
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        # 流水线的入库线程也会写入，由 _lock 串行化
+        self._conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS attachments ("
+            " hash TEXT PRIMARY KEY,"
+            " supplier TEXT,"
+            " category TEXT,"
+            " filename TEXT,"
+            " processed_at REAL NOT NULL,"
+            " stats TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_attachments_processed_at ON attachments(processed_at)")
+        self._conn.commit()
+
+        with self._lock:
+            self._prune()
+            self._load_hashes()
+        self.logger.debug(f"附件索引已加载: {len(self._hashes)} 条")
+
+    @classmethod
+    def get_shared(cls, db_file: Union[str, Path], retention_days: int = 30,
+                   max_entries: int = 20000) -> 'AttachmentStore':
+        """
+        获取进程内共享的附件索引
+
+        调度器每次运行都会创建新的邮件处理器，共享索引后全部哈希只在首次使用时加载一次；
+        保留天数和条目上限以首次创建时为准
+        Args:
+            db_file: SQLite索引文件路径
+            retention_days: 记录保留天数
+            max_entries: 最多保留的记录数
+        Returns:
+            该索引文件对应的附件索引
+        """
+        key = str(Path(db_file).resolve())
+        with cls._shared_lock:
+            store = cls._shared.get(key)
+            if store is None:
+                store = cls._shared[key] = cls(db_file, retention_days, max_entries)
+            return store
+
+    @classmethod
+    def close_all(cls) -> None:
+        """关闭所有共享的附件索引"""
+        with cls._shared_lock:
+            stores = list(cls._shared.values())
+            cls._shared.clear()
+        for store in stores:
+            store.close()
+
+    @staticmethod
+    def file_hash(file_path: Union[str, Path], known_hashes: Optional[Dict[str, str]] = None) -> str:
+        """
+        获取附件内容哈希，优先使用下载时已计算的结果
+        Args:
+            file_path: 附件路径
+            known_hashes: 下载时计算的 {路径: 哈希}
+        Returns:
+            哈希值
+        """
+        if known_hashes and str(file_path) in known_hashes:
+            return known_hashes[str(file_path)]
+        return get_file_hash(file_path, HASH_ALGORITHM)
+
+    def contains(self, file_hash: str) -> bool:
+        """
+        判断附件是否已处理过
+        Args:
+            file_hash: 附件哈希
+        Returns:
+            bool: 是否已处理
+        """
+        return file_hash in self._hashes
+
+    def contains_all(self, file_hashes: Iterable[str]) -> bool:
+        """
+        判断一组附件是否都已处理过
+        Args:
+            file_hashes: 附件哈希列表
+        Returns:
+            bool: 列表非空且全部已处理时返回True
+        """
+        file_hashes = list(file_hashes)
+        return bool(file_hashes) and all(h in self._hashes for h in file_hashes)
+
+    def get(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        查询附件的处理记录
+        Args:
+            file_hash: 附件哈希
+        Returns:
+            处理记录，不存在时返回None
+        """
+        if file_hash not in self._hashes:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT supplier, category, filename, processed_at, stats FROM attachments WHERE hash = ?",
+                (file_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'hash': file_hash,
+            'supplier': row[0],
+            'category': row[1],
+            'filename': row[2],
+            'processed_at': row[3],
+            'stats': json.loads(row[4]) if row[4] else {}
+        }
+
+    def add(self, file_hash: str, supplier: Optional[str], category: Optional[str],
+            filename: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> None:
+        """
+        记录已处理的附件
+        Args:
+            file_hash: 附件哈希
+            supplier: 供应商
+            category: 类别
+            filename: 文件名
+            stats: 处理结果统计
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments (hash, supplier, category, filename, processed_at, stats) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_hash, supplier, category, filename, time.time(),
+                 json.dumps(stats or {}, ensure_ascii=False, default=str))
+            )
+            self._conn.commit()
+            self._hashes.add(file_hash)
+            self._inserts += 1
+            # 每写入一批清理一次，避免每次写入都扫描
+            if self._inserts % 100 == 0:
+                self._prune()
+
+    def _prune(self) -> None:
+        """清理过期和超出上限的记录（调用方持有锁）"""
+        removed = 0
+        if self.retention_days:
+            cutoff = time.time() - self.retention_days * 86400
+            removed += self._conn.execute("DELETE FROM attachments WHERE processed_at < ?", (cutoff,)).rowcount
+        if self.max_entries:
+            removed += self._conn.execute(
+                "DELETE FROM attachments WHERE hash NOT IN "
+                "(SELECT hash FROM attachments ORDER BY processed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            ).rowcount
+        if removed:
+            self._conn.commit()
+            self._load_hashes()
+            self.logger.info(f"附件索引清理过期记录 {removed} 条")
+
+    def _load_hashes(self) -> None:
+        """把索引中的哈希加载到内存（调用方持有锁）"""
+        self._hashes = {row[0] for row in self._conn.execute("SELECT hash FROM attachments")}
+
+    def close(self) -> None:
+        """关闭索引"""
+        with self._lock:
+            self._conn.close()
@@ -1,45 +1,328 @@
+import copy
 import imaplib
 import email
 from email import message
 import os
 import re
+import threading
 from email.header import decode_header
-from typing import List, Dict, Any, Optional, Union
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Union, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 
 from modules.email_processor.rules.engine import RuleEngine
 from utils.emailHelper import EmailHelper
+from utils.imap_utils import build_uid_set, encode_folder_name
+from utils.imap_extensions import IMAP4, IMAP4_SSL, transfer_stats
 from utils.logger import Logger
 from utils.retry import retry_network, RetryError
-from utils.helpers import load_yaml, ensure_dir, get_env_var
+from utils.helpers import load_yaml, load_json, save_json, ensure_dir, get_env_var
 from utils.cache import cache_5min
 
 
+class MailboxSyncState:
+    """
+    邮箱增量同步检查点
+
+    按 "邮箱地址/文件夹" 记录 UIDVALIDITY 与已同步的最大UID，
+    保存在本地JSON文件中，进程重启后仍可继续增量同步
+    """
+
+    # 多个邮箱共用同一个检查点文件，按文件共享锁
+    _file_locks: Dict[str, threading.Lock] = {}
+    _file_locks_lock = threading.Lock()
+
+    def __init__(self, state_file: str):
+        """
+        初始化检查点存储
+        Args:
+            state_file: 检查点文件路径
+        """
+        self.logger = Logger(__name__)
+        self.state_file = Path(state_file)
+        with self._file_locks_lock:
+            self.lock = self._file_locks.setdefault(str(self.state_file.resolve()), threading.Lock())
+
+    def _read_all(self) -> Dict[str, Dict[str, int]]:
+        """读取全部检查点"""
+        if not self.state_file.exists():
+            return {}
+        try:
+            return load_json(self.state_file)
+        except Exception as e:
+            self.logger.warning(f"读取同步检查点失败，将执行全量同步: {str(e)}")
+            return {}
+
+    def load(self, key: str) -> Optional[Dict[str, int]]:
+        """
+        获取检查点
+        Args:
+            key: 邮箱标识（邮箱地址/文件夹）
+        Returns:
+            {'uidvalidity': int, 'last_uid': int}，不存在时返回None
+        """
+        with self.lock:
+            return self._read_all().get(key)
+
+    def save(self, key: str, uidvalidity: int, last_uid: int) -> None:
+        """
+        保存检查点（先写临时文件再替换，避免写入中断损坏文件）
+        Args:
+            key: 邮箱标识（邮箱地址/文件夹）
+            uidvalidity: 文件夹的UIDVALIDITY
+            last_uid: 已同步的最大UID
+        """
+        with self.lock:
+            states = self._read_all()
+            states[key] = {'uidvalidity': uidvalidity, 'last_uid': last_uid}
+            ensure_dir(self.state_file.parent)
+            tmp_file = self.state_file.with_suffix('.tmp')
+            save_json(states, tmp_file)
+            os.replace(tmp_file, self.state_file)
+
+
+def load_mailboxes(config_path: str) -> List[Dict[str, Any]]:
+    """
+    读取需要同步的邮箱列表
+
+    配置了 accounts 时，每个账号的每个文件夹为一个邮箱，账号中的配置项覆盖顶层配置；
+    未配置时只同步顶层配置的邮箱
+
+    Args:
+        config_path: 邮件配置文件路径
+    Returns:
+        [邮箱配置覆盖项]，可直接传给 EmailClient(config_path, mailbox)
+    """
+    config = load_yaml(config_path)
+    accounts = config.get('accounts') or [{}]
+    mailboxes = []
+    for account in accounts:
+        folders = account.get('folders') or [account.get('folder', config.get('folder', 'INBOX'))]
+        for folder in folders:
+            mailbox = {key: value for key, value in account.items() if key != 'folders'}
+            mailbox['folder'] = folder
+            mailboxes.append(mailbox)
+    return mailboxes
+
+
+@retry_network
+def open_imap_connection(config: Dict[str, Any], compress: Optional[bool] = None) -> imaplib.IMAP4:
+    """
+    建立并登录IMAP连接
+    Args:
+        config: 邮件配置
+        compress: 是否协商COMPRESS=DEFLATE，默认读取配置 compress
+    Returns:
+        已登录的IMAP连接
+    """
+    try:
+        if config.get('use_ssl', True):
+            imap = IMAP4_SSL(
+                config['imap_server'],
+                int(config.get('imap_port', 993))
+            )
+        else:
+            imap = IMAP4(
+                config['imap_server'],
+                int(config.get('imap_port', 143))
+            )
+        imap.login(config['email'], config['password'])
+        imap.measure_rtt()
+        if compress is None:
+            compress = config.get('compress', True)
+        if compress and imap.enable_compression():
+            Logger(__name__).debug(f"IMAP连接已开启COMPRESS=DEFLATE: {config['imap_server']}")
+        return imap
+    except Exception as e:
+        Logger(__name__).error(f"连接IMAP服务器失败: {str(e)}")
+        raise
+
+
+class ImapConnectionPool:
+    """
+    IMAP连接池
+
+    同一进程内按 "邮箱地址@服务器" 共享已登录的连接，取用时用NOOP检查健康状态，
+    服务器端断开的连接会被丢弃并透明重连，TLS握手和登录只在首次或断线后发生
+    """
+
+    _pools: Dict[str, 'ImapConnectionPool'] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, config: Dict[str, Any], size: int = 2):
+        """
+        初始化连接池
+        Args:
+            config: 邮件配置
+            size: 最大连接数
+        """
+        self.logger = Logger(__name__)
+        self.config = config
+        self.size = size
+        self._idle: List[imaplib.IMAP4] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @classmethod
+    def get_shared(cls, config: Dict[str, Any]) -> 'ImapConnectionPool':
+        """
+        获取进程内共享的连接池
+        Args:
+            config: 邮件配置
+        Returns:
+            该邮箱对应的连接池
+        """
+        key = f"{config['email']}@{config['imap_server']}:{config.get('imap_port', '')}"
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(config, int(config.get('pool_size', 2)))
+            return cls._pools[key]
+
+    @classmethod
+    def keepalive_all(cls) -> None:
+        """对所有共享连接池执行保活"""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+        for pool in pools:
+            pool.keepalive()
+
+    @classmethod
+    def close_all(cls) -> None:
+        """关闭所有共享连接池"""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def _is_alive(self, imap: imaplib.IMAP4) -> bool:
+        """用NOOP检查连接是否可用"""
+        try:
+            status, _ = imap.noop()
+            return status == 'OK'
+        except Exception:
+            return False
+
+    def _logout(self, imap: imaplib.IMAP4) -> None:
+        """关闭连接，忽略已断开连接的错误"""
+        try:
+            imap.logout()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: Optional[float] = None) -> imaplib.IMAP4:
+        """
+        取出一个可用连接，没有空闲连接时新建
+        Args:
+            timeout: 等待空闲名额的超时时间（秒），None表示一直等待
+        Returns:
+            已登录的IMAP连接
+        异常:
+            TimeoutError: 等待超时
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("等待IMAP连接超时")
+        try:
+            while True:
+                with self._lock:
+                    imap = self._idle.pop() if self._idle else None
+                if imap is None:
+                    imap = open_imap_connection(self.config)
+                    self.logger.debug(f"新建IMAP连接: {self.config['imap_server']}")
+                    return imap
+                if self._is_alive(imap):
+                    return imap
+                self.logger.debug("丢弃已断开的IMAP连接")
+                self._logout(imap)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, imap: imaplib.IMAP4, discard: bool = False) -> None:
+        """
+        归还连接
+        Args:
+            imap: 取出的连接
+            discard: 是否丢弃（连接已损坏时）
+        """
+        try:
+            if discard or imap.state == 'LOGOUT':
+                self._logout(imap)
+            else:
+                with self._lock:
+                    self._idle.append(imap)
+        finally:
+            self._slots.release()
+
+    def keepalive(self) -> None:
+        """对空闲连接发送NOOP保活，丢弃已断开的连接"""
+        with self._lock:
+            idle = self._idle
+            self._idle = [imap for imap in idle if self._is_alive(imap)]
+            for imap in idle:
+                if imap not in self._idle:
+                    self._logout(imap)
+        self.logger.debug(f"IMAP连接保活完成: 可用 {len(self._idle)}/{len(idle)}")
+
+    def close(self) -> None:
+        """关闭全部空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for imap in idle:
+            self._logout(imap)
+
+
 class EmailClient:
     """IMAP邮件客户端"""
     
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, mailbox: Optional[Dict[str, Any]] = None):
         """
         初始化邮件客户端
         Args:
             config_path: 配置文件路径
+            mailbox: 邮箱配置覆盖项（见 load_mailboxes），为None时使用顶层配置
         """
         self.logger = Logger(__name__)
-        self.config = self._load_config(config_path)
-        self.rule_engine = RuleEngine(self.config['rules_file'])
+        self.config = self._load_config(config_path, mailbox)
+        # 同一规则文件的各邮箱共用一个引擎和一个监视线程
+        self.rule_engine = RuleEngine.get_shared(self.config['rules_file'])
+        if self.config.get('rules_hot_reload', False):
+            # 后台监视规则文件，修改后在两封邮件之间切换到新规则（进程退出前由 RuleEngine.close_all 停止）
+            self.rule_engine.start_watching(self.config.get('rules_reload_interval', 30))
         self.imap = None
+        self.pool: Optional[ImapConnectionPool] = None
+        self.folder = self.config.get('folder', 'INBOX')
+        self.sync_state = MailboxSyncState(
+            self.config.get('sync_state_file', 'data/email_sync_state.json')
+        )
+        # 本次同步时文件夹的UIDVALIDITY，提交检查点时使用
+        self._uidvalidity = None
+        # 服务器拒绝过规则条件搜索时不再下推
+        self._pushdown_unsupported = False
+        # 命中规则的邮件原文缓存（MailCache），由EmailProcessor按配置设置
+        self.mail_cache = None
+        # 取得连接时的收发统计，用于计算本次运行的传输量
+        self._io_baseline: Dict[str, float] = {}
+        # 本次连接期间已关闭的附加会话的传输统计
+        self._session_transfers: List[Dict[str, float]] = []
+        # 下游处理完成、等待统一标记为已读的邮件UID
+        self._pending_seen: List[bytes] = []
+        self._pending_lock = threading.Lock()
         
-    def _load_config(self, config_path: str) -> Dict[str, Any]:
+    def _load_config(self, config_path: str, mailbox: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         加载配置文件
         Args:
             config_path: 配置文件路径
+            mailbox: 邮箱配置覆盖项
         Returns:
             配置信息
         """
         try:
             config = load_yaml(config_path)
+            config.pop('accounts', None)
+            config.update(mailbox or {})
             # 替换环境变量
             for key, value in config.items():
                 if isinstance(value, str) and value.startswith('${') and value.endswith('}'):
@@ -50,25 +333,83 @@ class EmailClient:
             self.logger.error(f"加载配置文件失败: {str(e)}")
             raise
     
-    @retry_network
-    def connect(self) -> None:
-        """连接IMAP服务器"""
+    def connect(self, pooled: Optional[bool] = None, compress: Optional[bool] = None) -> None:
+        """
+        连接IMAP服务器
+
+        默认从进程共享的连接池取连接；IDLE等需要独占连接的场景传入pooled=False
+
+        参数:
+            pooled: 是否使用连接池，默认读取配置 use_connection_pool
+            compress: 独占连接是否开启压缩，默认读取配置 compress（连接池中的连接按配置）
+        """
+        if pooled is None:
+            pooled = self.config.get('use_connection_pool', True)
+        if pooled:
+            self.pool = ImapConnectionPool.get_shared(self.config)
+            self.imap = self.pool.acquire()
+        else:
+            self.pool = None
+            self.imap = open_imap_connection(self.config, compress)
+        self._io_baseline = dict(getattr(self.imap, 'io_stats', {}))
+        self._session_transfers = []
+        self.logger.debug(f"成功连接到IMAP服务器: {self.config['imap_server']}")
+
+    def open_session(self) -> Optional['EmailClient']:
+        """
+        打开一个附加会话：共用配置、规则和缓存，使用独立的IMAP连接并选择同一文件夹，用于并行下载
+
+        使用连接池时不等待空闲名额，连接池已满时返回None
+
+        返回:
+            已连接的会话，用完后调用 disconnect 归还连接
+        """
+        session = copy.copy(self)
+        session.imap = None
+        session.pool = None
+        session._session_transfers = []
         try:
-            if self.config.get('use_ssl', True):
-                self.imap = imaplib.IMAP4_SSL(
-                    self.config['imap_server'],
-                    int(self.config.get('imap_port', 993))
-                )
+            if self.config.get('use_connection_pool', True):
+                session.pool = ImapConnectionPool.get_shared(self.config)
+                session.imap = session.pool.acquire(timeout=0)
             else:
-                self.imap = imaplib.IMAP4(
-                    self.config['imap_server'],
-                    int(self.config.get('imap_port', 143))
-                )
-            self.imap.login(self.config['email'], self.config['password'])
-            self.logger.debug(f"成功连接到IMAP服务器: {self.config['imap_server']}")
+                session.imap = open_imap_connection(self.config)
+            status, _ = session.imap.select(encode_folder_name(self.folder))
+            if status != 'OK':
+                raise Exception(f"无法选择文件夹 {self.folder}，状态: {status}")
+        except TimeoutError:
+            return None
         except Exception as e:
-            self.logger.error(f"连接IMAP服务器失败: {str(e)}")
-            raise
+            self.logger.warning(f"打开附加IMAP会话失败: {str(e)}")
+            session.disconnect()
+            return None
+        session._io_baseline = dict(getattr(session.imap, 'io_stats', {}))
+        return session
+
+    def close_session(self, session: 'EmailClient') -> None:
+        """
+        关闭附加会话，其传输统计计入本邮箱
+        参数:
+            session: open_session 返回的会话
+        """
+        transfer = session.transfer_stats()
+        if transfer:
+            self._session_transfers.append(transfer)
+        session.disconnect()
+
+    def reconnect(self) -> None:
+        """丢弃当前连接并重新连接"""
+        if self.imap:
+            if self.pool:
+                self.pool.release(self.imap, discard=True)
+            else:
+                try:
+                    self.imap.shutdown()
+                except Exception:
+                    pass
+            self.imap = None
+        self.connect(pooled=self.pool is not None)
+        self.logger.info("IMAP连接已重建")
     
     def check_connection(self) -> None:
         """检查IMAP连接状态"""
@@ -77,21 +418,84 @@ class EmailClient:
             raise ConnectionError("未连接到邮件服务器")
     
     def disconnect(self) -> None:
-        """断开IMAP连接"""
+        """断开IMAP连接（使用连接池时归还连接）"""
         if self.imap:
             try:
-                self.imap.logout()
-                self.logger.info("已断开IMAP连接")
+                if self.pool:
+                    self.pool.release(self.imap)
+                    self.logger.debug("IMAP连接已归还连接池")
+                else:
+                    self.imap.logout()
+                    self.logger.info("已断开IMAP连接")
             except Exception as e:
                 self.logger.error(f"断开IMAP连接失败: {str(e)}")
+            finally:
+                self.imap = None
+
+    def transfer_stats(self) -> Dict[str, float]:
+        """
+        本次连接以来的传输统计
+        返回:
+            明文/线上字节数、压缩节省的字节数、流水线节省的往返次数和估算节省的时间
+        """
+        io_stats = getattr(self.imap, 'io_stats', None)
+        totals = transfer_stats(self._io_baseline, io_stats) if io_stats else {}
+        for transfer in self._session_transfers:
+            for key, value in transfer.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    @property
+    def name(self) -> str:
+        """邮箱名称（账号名/文件夹），用于日志和统计"""
+        return f"{self.config.get('name') or self.config['email']}/{self.folder}"
+
+    def assign_message_folder(self, match_result: Dict[str, Any], email_id: bytes) -> str:
+        """
+        为单封邮件指定附件目录：规则目录下按 "邮箱_UID" 建子目录，
+        并行下载的多封邮件中的同名附件（如 WIP.xlsx）互不覆盖
+
+        替换 match_result 中的 attachment_folder（不修改规则配置），送货单处理器按该目录读取附件
+
+        参数:
+            match_result: 匹配结果
+            email_id: 邮件UID
+
+        返回:
+            str: 附件目录
+        """
+        actions = match_result['actions']
+        key = re.sub(r'[^\w.-]+', '_', f"{self.name}_{email_id.decode()}")
+        folder = Path(actions['attachment_folder'])
+        if folder.name != key:
+            folder = folder / key
+            match_result['actions'] = dict(actions, attachment_folder=str(folder))
+        return str(folder)
+
+    @property
+    def sync_key(self) -> str:
+        """增量同步检查点的键"""
+        return f"{self.config['email']}/{self.folder}"
+
+    def _get_uidvalidity(self) -> Optional[int]:
+        """从SELECT的响应中读取UIDVALIDITY"""
+        _, data = self.imap.response('UIDVALIDITY')
+        if data and data[0]:
+            return int(data[0])
+        return None
 
     @retry_network
     def get_unread_emails(self) -> List[bytes]:
         """
         获取未读邮件列表
         
+        开启增量同步时，只搜索检查点之后的新邮件(UID n+1:*)；
+        UIDVALIDITY变化或没有检查点时执行全量同步。
+        开启条件下推时，规则的主题/地址条件作为SEARCH条件由服务器过滤，
+        服务器不支持时退回只按UNSEEN搜索
+        
         返回:
-            list: 未读邮件ID列表
+            list: 未读邮件UID列表
             
         异常:
             ConnectionError: 未连接到服务器时抛出
@@ -101,37 +505,189 @@ class EmailClient:
         self.logger.debug("开始获取未读邮件...")
 
         try:
-            status, _ = self.imap.select('INBOX')
+            status, _ = self.imap.select(encode_folder_name(self.folder))
             if status != 'OK':
-                raise Exception(f"无法选择收件箱，状态: {status}")
-            status, messages = self.imap.search(None, 'UNSEEN')
+                raise Exception(f"无法选择文件夹 {self.folder}，状态: {status}")
+            self._uidvalidity = self._get_uidvalidity()
+
+            checkpoint = None
+            if self.config.get('incremental_sync', True) and self._uidvalidity is not None:
+                checkpoint = self.sync_state.load(self.sync_key)
+                if checkpoint and checkpoint['uidvalidity'] != self._uidvalidity:
+                    self.logger.warning(
+                        f"{self.sync_key} 的UIDVALIDITY已变化"
+                        f"({checkpoint['uidvalidity']} -> {self._uidvalidity})，执行全量同步"
+                    )
+                    checkpoint = None
+
+            if checkpoint:
+                last_uid = checkpoint['last_uid']
+                criteria = [f'UID {last_uid + 1}:*', 'UNSEEN']
+            else:
+                last_uid = 0
+                criteria = ['UNSEEN']
+
+            status, messages = None, None
+            rule_criteria = self._rule_search_criteria()
+            if rule_criteria:
+                status, messages = self._search_with_rules(criteria, rule_criteria)
+            if status != 'OK':
+                status, messages = self.imap.uid('SEARCH', None, *criteria)
             if status != 'OK':
                 raise Exception(f"无法搜索未读邮件，状态: {status}")
-            email_ids = messages[0].split()
-            self.logger.debug(f"找到 {len(email_ids)} 封未读邮件")
+
+            # "n+1:*" 在没有新邮件时仍会返回最后一封，需要再按UID过滤
+            email_ids = [uid for uid in messages[0].split() if int(uid) > last_uid]
+            self.logger.debug(f"找到 {len(email_ids)} 封未读邮件（检查点UID: {last_uid}）")
             return email_ids
+        except (imaplib.IMAP4.abort, OSError) as e:
+            # 服务器端断开：重建连接后交给retry_network重试
+            self.logger.warning(f"IMAP连接中断: {str(e)}")
+            self.reconnect()
+            raise ConnectionError(f"IMAP连接中断: {str(e)}") from e
         except Exception as e:
             self.logger.error(f"获取未读邮件失败: {str(e)}")
             raise
+
+    def _rule_search_criteria(self) -> Optional[bytes]:
+        """规则编译出的SEARCH条件，未开启下推或规则无法下推时返回None"""
+        if not self.config.get('search_pushdown', True) or self._pushdown_unsupported:
+            return None
+        return self.rule_engine.build_search_criteria()
+
+    def _search_with_rules(self, criteria: List[str], rule_criteria: bytes) -> Tuple[Optional[str], Any]:
+        """
+        带规则条件搜索
+
+        参数:
+            criteria: 基础条件（UNSEEN及UID范围）
+            rule_criteria: 规则编译出的条件
+
+        返回:
+            (状态, 数据)；服务器拒绝时（如不支持 CHARSET UTF-8）返回 (None, None)，并在本连接上不再尝试
+        """
+        # 中文关键词以字面量发送，需要声明字符集
+        charset = 'UTF-8' if not rule_criteria.isascii() else None
+        try:
+            status, messages = self.imap.uid_search_literals(
+                ' '.join(criteria).encode('ascii') + b' ' + rule_criteria, charset
+            )
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            status, messages = 'BAD', [str(e)]
+        if status == 'OK':
+            return status, messages
+        self.logger.warning(f"服务器不支持规则条件搜索，改为只按UNSEEN搜索: {status} {messages}")
+        self._pushdown_unsupported = True
+        return None, None
+
+    def commit_sync(self, last_uid: Union[str, bytes, int]) -> None:
+        """
+        提交增量同步检查点
+
+        处理完成后调用，下次只同步UID大于last_uid的邮件
+
+        参数:
+            last_uid: 已处理完成的最大UID
+        """
+        if not self.config.get('incremental_sync', True) or self._uidvalidity is None:
+            return
+        last_uid = int(last_uid)
+        checkpoint = self.sync_state.load(self.sync_key)
+        if checkpoint and checkpoint['uidvalidity'] == self._uidvalidity and checkpoint['last_uid'] >= last_uid:
+            return
+        self.sync_state.save(self.sync_key, self._uidvalidity, last_uid)
+        self.logger.debug(f"同步检查点已更新: {self.sync_key} -> UID {last_uid}")
     
-    def process_email(self, email_id: Union[str, bytes]) -> Dict[str, Any]:
+    def queue_mark_as_read(self, email_id: Union[str, bytes]) -> None:
+        """
+        登记待标记为已读的邮件，由 commit_flags 统一提交
+
+        参数:
+            email_id: 邮件UID
+        """
+        if isinstance(email_id, str):
+            email_id = email_id.encode()
+        with self._pending_lock:
+            self._pending_seen.append(email_id)
+
+    def commit_flags(self) -> bool:
+        """
+        提交本次运行登记的已读标记
+
+        所有邮件合并为一条 UID STORE 命令；提交前进程中断时这些邮件保持未读，下次运行会重新处理
+
+        返回:
+            bool: 是否提交成功（失败时保留待提交列表）
+        """
+        with self._pending_lock:
+            pending = list(self._pending_seen)
+        if not pending:
+            return True
+        self.check_connection()
+        if not EmailHelper(self.imap).mark_emails_as_read(pending):
+            return False
+        with self._pending_lock:
+            self._pending_seen = self._pending_seen[len(pending):]
+        self.logger.debug(f"已标记 {len(pending)} 封邮件为已读: {build_uid_set(pending)}")
+        return True
+
+    def match_emails(self, email_ids: List[bytes]) -> List[Tuple[bytes, Dict[str, Any]]]:
+        """
+        首轮匹配：只下载邮件头进行规则匹配
+
+        一条批量 UID FETCH 取回全部邮件头，未命中任何规则的邮件不会再下载正文
+
+        参数:
+            email_ids: 邮件UID列表
+
+        返回:
+            list: [(UID, 匹配结果)]，仅包含命中规则的邮件
+        """
+        self.check_connection()
+        if not email_ids:
+            return []
+
+        email_helper = EmailHelper(self.imap)
+        headers = [
+            (email_id, email_helper.parse_email_data(header_msg, email_id))
+            for email_id, header_msg in email_helper.fetch_headers(email_ids)
+        ]
+        # 整批邮件头一次匹配，只记录一行汇总日志
+        match_results = self.rule_engine.match_batch([email_data for _, email_data in headers])
+        matched = []
+        for (email_id, email_data), match_result in zip(headers, match_results):
+            if not match_result:
+                continue
+            match_result['email_data'] = email_data
+            matched.append((email_id, match_result))
+
+        self.logger.debug(f"邮件头首轮匹配: {len(email_ids)} 封中命中 {len(matched)} 封")
+        return matched
+
+    def process_email(self, email_id: Union[str, bytes],
+                      match_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         处理单个邮件
         
-        获取邮件内容，应用规则，处理附件，设置已读状态
+        获取邮件内容，应用规则，处理附件；已读状态由调用方在下游处理完成后通过 queue_mark_as_read 登记。
+        附件保存在规则目录下该邮件单独的子目录中（见 assign_message_folder）。
+        设置了邮件缓存时，已整封下载的邮件缓存原文；按部件下载的邮件只缓存邮件头和已保存的附件，不为缓存整封下载
         
         参数:
-            email_id: 邮件ID
+            email_id: 邮件UID
+            match_result: 邮件头首轮匹配的结果，传入时跳过规则匹配
             
         返回:
             Dict[str, Any]: 匹配结果
             枚举：
             {
-                'actions': {'save_attachment': True, 'mark_as_read': True, 'attachment_folder': 'attachments/temp/封装送货单/池州华宇'},
+                'actions': {'save_attachment': True, 'mark_as_read': True, 'attachment_folder': 'attachments/temp/封装送货单/池州华宇/华新_INBOX_123'},
                 'name': '封装送货单-池州华宇',
                 'category': '封装送货单',
                 'supplier': '池州华宇',
-                'attachments': ['attachments/temp/封装送货单/池州华宇/1.pdf', 'attachments/temp/封装送货单/池州华宇/2.pdf']
+                'attachments': ['attachments/temp/封装送货单/池州华宇/华新_INBOX_123/1.pdf', 'attachments/temp/封装送货单/池州华宇/华新_INBOX_123/2.pdf']
             }
             
         异常:
@@ -147,46 +703,92 @@ class EmailClient:
         """
         self.check_connection()
 
-        email_helper = EmailHelper(self.imap)
+        email_helper = EmailHelper(
+            self.imap,
+            int(self.config.get('fetch_chunk_size', 1024 * 1024)),
+            int(self.config.get('pipeline_depth', 4))
+        )
 
         email_id = email_helper.normalize_email_id(email_id)
-        msg = email_helper.fetch_email(email_id)
+        # 按部件下载附件时不需要整封邮件
+        partial_fetch = self.config.get('partial_fetch', True)
+        msg = None
+        raw = None
 
         try:
-            # 解析邮件信息
-            email_data = email_helper.parse_email_data(msg, email_id)
-            
-            # 使用规则引擎匹配邮件
-            match_result = self.rule_engine.apply_rules(email_data)
-
-            category = match_result['category']
+            # 首轮已匹配时直接复用邮件头和匹配结果，否则下载整封邮件后匹配
+            if match_result is None:
+                raw = email_helper.fetch_raw(email_id)
+                msg = email.message_from_bytes(raw)
+                email_data = email_helper.parse_email_data(msg, email_id)
+                match_result = self.rule_engine.apply_rules(email_data)
+            else:
+                email_data = match_result['email_data']
 
             # 如果未匹配到任何规则，则保持未读状态
-            if category == '未分类':
+            if not match_result:
                 self.logger.debug(f"邮件不匹配任何规则，保持未读状态: {email_data['subject']}")
                 return {}
+            match_result['email_data'] = email_data
+            self.assign_message_folder(match_result, email_id)
+
+            category = match_result['category']
             
-            # 保存附件
+            # 保存附件：任一附件下载失败时整封邮件记为失败，保持未读，下次重试
             try:
                 # 获取允许的附件类型
                 allowed_extensions = match_result.get('allowed_extensions', [])
-                attachments = email_helper.save_attachments(
-                    msg, 
-                    email_id, 
-                    match_result['actions']['attachment_folder'],
-                    allowed_extensions
-                )
+                # 规则可以单独放宽大小限制（如测试报告的压缩包）
+                max_size = match_result['actions'].get('max_attachment_size', self.config.get('max_attachment_size'))
+                if msg is None and partial_fetch:
+                    attachments = email_helper.save_attachment_parts(
+                        email_id,
+                        match_result['actions']['attachment_folder'],
+                        allowed_extensions,
+                        max_size
+                    )
+                else:
+                    if msg is None:
+                        raw = email_helper.fetch_raw(email_id)
+                        msg = email.message_from_bytes(raw)
+                    attachments = email_helper.save_attachments(
+                        msg, 
+                        email_id, 
+                        match_result['actions']['attachment_folder'],
+                        allowed_extensions,
+                        max_size
+                    )
                 match_result['attachments'] = attachments
+                match_result['attachment_hashes'] = email_helper.attachment_hashes
             except Exception as e:
                 self.logger.error(f"保存附件失败: {str(e)}")
+                raise
 
-            # 标记为已读
-            if match_result['actions'].get('mark_as_read', True):
-                email_helper.mark_email_as_read(email_id)
+            if self.mail_cache is not None:
+                self._cache_message(email_helper, email_id, raw, email_data, match_result)
 
             self.logger.debug(f"邮件处理完成: [{category}] {email_data['subject']}")
             return match_result
             
         except Exception as e:
+            # 与“不匹配任何规则”区分：调用方把该邮件记为失败，保持未读且检查点不越过它
             self.logger.error(f"处理邮件失败: {str(e)}")
-            return {}
\ No newline at end of file
+            raise RuntimeError(f"处理邮件失败 UID {email_id.decode()}: {str(e)}") from e
+
+    def _cache_message(self, email_helper: EmailHelper, email_id: bytes, raw: Optional[bytes],
+                       email_data: Dict[str, Any], match_result: Dict[str, Any]) -> None:
+        """
+        把命中规则的邮件写入本地缓存，失败不影响处理
+
+        已整封下载时缓存原文；按部件下载时只取邮件头，与已保存的附件一起分块写入缓存
+        """
+        try:
+            if raw is not None:
+                self.mail_cache.store(raw, email_data, match_result, self.name)
+            else:
+                self.mail_cache.store_parts(
+                    email_helper.fetch_header(email_id), match_result.get('attachments', []),
+                    email_data, match_result, self.name
+                )
+        except Exception as e:
+            self.logger.warning(f"缓存邮件失败: {str(e)}")
@@ -0,0 +1,228 @@
+"""
+IMAP IDLE 监听模块
+保持一个已认证的长连接，新邮件到达(EXISTS/RECENT)时立即触发邮件处理
+"""
+
+import imaplib
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from infrastructure.email_client import EmailClient
+from utils.imap_utils import encode_folder_name
+from utils.logger import Logger
+
+
+class EmailIdleListener:
+    """IMAP IDLE 监听器"""
+
+    def __init__(self, config_path: str, on_new_mail: Callable[[], None],
+                 idle_timeout: int = 1500, reconnect_delay: int = 30,
+                 mailbox: Optional[Dict[str, Any]] = None):
+        """
+        初始化监听器
+        Args:
+            config_path: 邮件配置文件路径
+            on_new_mail: 新邮件到达时的回调（在监听线程中同步执行）
+            idle_timeout: 单次IDLE最长时间（秒），需小于服务器的29分钟超时
+            reconnect_delay: 连接断开后的重连间隔（秒）
+            mailbox: 监听的邮箱配置覆盖项（见 load_mailboxes）
+        """
+        self.logger = Logger(__name__)
+        self.email_client = EmailClient(config_path, mailbox)
+        self.on_new_mail = on_new_mail
+        self.idle_timeout = idle_timeout
+        self.reconnect_delay = reconnect_delay
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._exists = 0
+        self._buffer = b''
+
+    @property
+    def imap(self) -> imaplib.IMAP4:
+        return self.email_client.imap
+
+    def supports_idle(self) -> bool:
+        """
+        连接服务器并检查是否支持IDLE
+        Returns:
+            bool: 服务器是否支持IDLE
+        """
+        try:
+            self._open()
+        except Exception as e:
+            self.logger.error(f"IDLE监听连接失败: {str(e)}")
+            return False
+        if 'IDLE' not in self.imap.capabilities:
+            self.logger.warning("邮件服务器不支持IDLE，使用定时轮询")
+            self.email_client.disconnect()
+            return False
+        return True
+
+    def start(self) -> None:
+        """启动监听线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'email_idle_listener:{self.email_client.name}', daemon=True)
+        self._thread.start()
+        self.logger.info(f"IMAP IDLE监听已启动: {self.email_client.name}")
+
+    def stop(self) -> None:
+        """停止监听线程"""
+        self._stop_event.set()
+        try:
+            # 关闭套接字以打断阻塞中的读取
+            if self.imap:
+                self.imap.shutdown()
+        except Exception:
+            pass
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.logger.info(f"IMAP IDLE监听已停止: {self.email_client.name}")
+
+    def _open(self) -> None:
+        """建立连接并以只读方式选择文件夹"""
+        # IDLE期间直接读套接字，不能开启压缩
+        self.email_client.connect(pooled=False, compress=False)
+        status, data = self.imap.select(encode_folder_name(self.email_client.folder), readonly=True)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"无法选择文件夹 {self.email_client.folder}，状态: {status}")
+        self._exists = int(data[0]) if data and data[0] else 0
+        self._buffer = b''
+
+    def _run(self) -> None:
+        """监听主循环：IDLE -> 新邮件回调 -> 再次IDLE，断线后自动重连"""
+        while not self._stop_event.is_set():
+            try:
+                if not self.imap or self.imap.state != 'SELECTED':
+                    self._open()
+                if self._idle_once():
+                    self.on_new_mail()
+                    # 回调期间到达的邮件不会在下一次IDLE中通知，用NOOP补查
+                    while not self._stop_event.is_set() and self._check_new_mail():
+                        self.on_new_mail()
+            except (OSError, imaplib.IMAP4.abort, imaplib.IMAP4.error) as e:
+                if self._stop_event.is_set():
+                    break
+                self.logger.warning(f"IDLE连接中断，{self.reconnect_delay}秒后重连: {str(e)}")
+                self._close()
+                self._stop_event.wait(self.reconnect_delay)
+            except Exception as e:
+                self.logger.error(f"IDLE监听异常: {str(e)}", exc_info=True)
+                self._close()
+                self._stop_event.wait(self.reconnect_delay)
+        self._close()
+
+    def _close(self) -> None:
+        """关闭连接"""
+        try:
+            if self.imap:
+                self.imap.shutdown()
+        except Exception:
+            pass
+        self.email_client.imap = None
+
+    def _idle_once(self) -> bool:
+        """
+        执行一次IDLE，直到收到新邮件通知或超时
+        Returns:
+            bool: 是否收到新邮件通知
+        """
+        tag = self.imap._new_tag()
+        self.imap.send(tag + b' IDLE\r\n')
+        line = self._read_line(timeout=30)
+        if line is None or not line.startswith(b'+'):
+            raise imaplib.IMAP4.abort(f"服务器拒绝IDLE: {line!r}")
+
+        has_new_mail = False
+        deadline = time.monotonic() + self.idle_timeout
+        try:
+            while not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                line = self._read_line(timeout=min(remaining, 60))
+                if line is None:
+                    continue
+                if self._is_new_mail(line):
+                    has_new_mail = True
+                    break
+        finally:
+            # 结束IDLE，读取标签响应
+            self.imap.send(b'DONE\r\n')
+            for line in self._read_until_tagged(tag):
+                has_new_mail = self._is_new_mail(line) or has_new_mail
+            self.imap.sock.settimeout(None)
+        return has_new_mail
+
+    def _check_new_mail(self) -> bool:
+        """通过NOOP检查非IDLE期间是否有新邮件"""
+        tag = self.imap._new_tag()
+        self.imap.send(tag + b' NOOP\r\n')
+        has_new_mail = False
+        for line in self._read_until_tagged(tag):
+            has_new_mail = self._is_new_mail(line) or has_new_mail
+        self.imap.sock.settimeout(None)
+        return has_new_mail
+
+    def _is_new_mail(self, line: bytes) -> bool:
+        """
+        判断未标记响应是否表示新邮件
+        Args:
+            line: 服务器响应行，如 b'* 23 EXISTS'
+        """
+        parts = line.split()
+        if len(parts) < 3 or parts[0] != b'*' or not parts[1].isdigit():
+            return False
+        keyword = parts[2].upper()
+        if keyword == b'EXISTS':
+            exists = int(parts[1])
+            has_new_mail = exists > self._exists
+            self._exists = exists
+            return has_new_mail
+        if keyword == b'EXPUNGE':
+            self._exists = max(self._exists - 1, 0)
+            return False
+        return keyword == b'RECENT' and int(parts[1]) > 0
+
+    def _read_line(self, timeout: float) -> Optional[bytes]:
+        """
+        直接从套接字读取一行响应
+
+        选择文件夹之后的所有命令都绕过imaplib的文件对象：其底层SocketIO一旦超时就不可再用，
+        而套接字本身在超时后仍可继续读取
+        Args:
+            timeout: 超时时间（秒）
+        Returns:
+            去掉换行的响应行，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while b'\r\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.imap.sock.settimeout(remaining)
+            try:
+                chunk = self.imap.sock.recv(4096)
+            except socket.timeout:
+                return None
+            if not chunk:
+                raise imaplib.IMAP4.abort("服务器关闭了连接")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\r\n', 1)
+        return line
+
+    def _read_until_tagged(self, tag: bytes) -> List[bytes]:
+        """读取响应直到出现指定标签，返回之前的未标记响应"""
+        lines = []
+        while True:
+            line = self._read_line(timeout=30)
+            if line is None:
+                raise imaplib.IMAP4.abort(f"等待命令 {tag.decode()} 的响应超时")
+            if line.startswith(tag + b' '):
+                if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                    raise imaplib.IMAP4.error(f"命令执行失败: {line!r}")
+                return lines
+            lines.append(line)
@@ -138,16 +138,21 @@ class FileManager:
                         file_path.unlink()
                         self.logger.info(f"清理临时文件: {file_path}")
             
-            # 清理临时附件目录
+            # 清理临时附件目录（含每封邮件的附件子目录）
             temp_attachment_dir = self.attachment_dir / 'temp'
-            for category_dir in temp_attachment_dir.glob('*'):
-                if category_dir.is_dir():
-                    for file_path in category_dir.glob('*'):
-                        if file_path.is_file():
-                            file_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                            if file_time < cutoff_date:
-                                file_path.unlink()
-                                self.logger.info(f"清理临时附件: {file_path}")
+            for file_path in temp_attachment_dir.rglob('*'):
+                if file_path.is_file():
+                    file_time = datetime.fromtimestamp(file_path.stat().st_mtime)
+                    if file_time < cutoff_date:
+                        file_path.unlink()
+                        self.logger.info(f"清理临时附件: {file_path}")
+
+            # 由深到浅删除已清空的目录（邮件附件目录及其中的解压目录），类别/供应商目录保留
+            for dir_path in sorted(temp_attachment_dir.rglob('*'), key=lambda p: len(p.parts), reverse=True):
+                if (dir_path.is_dir()
+                        and len(dir_path.relative_to(temp_attachment_dir).parts) > 2
+                        and not any(dir_path.iterdir())):
+                    dir_path.rmdir()
                                 
         except Exception as e:
             self.logger.error(f"清理临时文件失败: {str(e)}", exc_info=True)
@@ -0,0 +1,300 @@
+"""
+本地邮件缓存模块
+命中规则的邮件原文按Maildir方式压缩保存在本地，处理程序修复后可以离线重新处理，不需要供应商重发
+"""
+
+import base64
+import email.utils
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Union
+from urllib.parse import quote
+
+from utils.logger import Logger
+from infrastructure.message_ledger import MessageLedger
+
+# 按部件缓存时由缓存重新生成的MIME头
+_MIME_HEADERS = (b'mime-version', b'content-type', b'content-transfer-encoding')
+# 按部件缓存时每次读取的附件字节数（57的倍数，base64编码后正好是完整的行）
+_PART_CHUNK = 57 * 16384
+
+
+class MailCache:
+    """
+    Maildir风格的邮件缓存
+
+    目录结构：
+        root/tmp/    写入中的文件
+        root/cur/    已完成的邮件原文（gzip压缩，写完后原子改名移入）
+        root/index.db  索引：邮件键 -> (文件, 邮箱, UID, Message-ID, 供应商, 类别, 主题, 邮件时间, 缓存时间)
+
+    同一封邮件（按Message-ID识别）只保存一次，超过保留天数的邮件连同文件一起清理。
+    按部件下载的邮件只缓存邮件头和已下载的附件（store_parts），不为缓存下载整封邮件。
+    """
+
+    # 进程内共享的缓存：缓存根目录的绝对路径 -> 缓存
+    _shared: Dict[str, 'MailCache'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, root: Union[str, Path], retention_days: int = 90):
+        """
+        初始化邮件缓存
+        Args:
+            root: 缓存根目录
+            retention_days: 邮件保留天数，0表示不清理
+        """
+        self.logger = Logger(__name__)
+        self.root = Path(root)
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._inserts = 0
+
+        for folder in ('tmp', 'cur'):
+            (self.root / folder).mkdir(parents=True, exist_ok=True)
+        # 多个邮箱的下载线程会同时写入，由 _lock 串行化
+        self._conn = sqlite3.connect(str(self.root / 'index.db'), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " key TEXT PRIMARY KEY,"
+            " filename TEXT NOT NULL,"
+            " mailbox TEXT,"
+            " uid INTEGER,"
+            " message_id TEXT,"
+            " supplier TEXT,"
+            " category TEXT,"
+            " subject TEXT,"
+            " sent_at REAL,"
+            " cached_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_supplier ON messages(supplier, sent_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_cached_at ON messages(cached_at)")
+        self._conn.commit()
+
+        with self._lock:
+            self._prune()
+
+    @classmethod
+    def get_shared(cls, root: Union[str, Path], retention_days: int = 90) -> 'MailCache':
+        """
+        获取进程内共享的邮件缓存，索引只打开一次，过期清理也只在首次打开时执行
+        Args:
+            root: 缓存根目录
+            retention_days: 邮件保留天数（以首次创建时为准）
+        Returns:
+            该目录对应的邮件缓存
+        """
+        key = str(Path(root).resolve())
+        with cls._shared_lock:
+            cache = cls._shared.get(key)
+            if cache is None:
+                cache = cls._shared[key] = cls(root, retention_days)
+            return cache
+
+    @classmethod
+    def close_all(cls) -> None:
+        """关闭所有共享的邮件缓存"""
+        with cls._shared_lock:
+            caches = list(cls._shared.values())
+            cls._shared.clear()
+        for cache in caches:
+            cache.close()
+
+    @staticmethod
+    def _sent_at(email_data: Dict[str, Any]) -> Optional[float]:
+        """解析邮件的发送时间"""
+        try:
+            return email.utils.parsedate_to_datetime(email_data.get('date') or '').timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def contains(self, key: str) -> bool:
+        """
+        判断邮件是否已缓存
+        Args:
+            key: 邮件键
+        Returns:
+            bool: 是否已缓存
+        """
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM messages WHERE key = ?", (key,)).fetchone() is not None
+
+    def store(self, raw: bytes, email_data: Dict[str, Any], match_result: Dict[str, Any],
+              mailbox: Optional[str] = None) -> Optional[Path]:
+        """
+        缓存邮件原文
+        Args:
+            raw: 邮件原文（RFC822）
+            email_data: 邮件数据
+            match_result: 规则匹配结果
+            mailbox: 邮箱名称
+        Returns:
+            缓存文件路径，已缓存过时返回None
+        """
+        key = MessageLedger.message_key(email_data) or 'sha256:' + hashlib.sha256(raw).hexdigest()
+        if self.contains(key):
+            return None
+        return self._write(key, lambda f: f.write(raw), email_data, match_result, mailbox)
+
+    def store_parts(self, header: bytes, attachments: List[Union[str, Path]], email_data: Dict[str, Any],
+                    match_result: Dict[str, Any], mailbox: Optional[str] = None) -> Optional[Path]:
+        """
+        缓存按部件下载的邮件：原邮件头加已保存的附件，重新组成一封 multipart/mixed 邮件
+
+        附件从磁盘分块读取并base64编码后写入，内存占用与附件大小无关；
+        正文和未下载的部件不缓存，重新处理只需要邮件头和附件
+        Args:
+            header: 原邮件头（RFC822）
+            attachments: 已保存的附件路径
+            email_data: 邮件数据
+            match_result: 规则匹配结果
+            mailbox: 邮箱名称
+        Returns:
+            缓存文件路径，已缓存过时返回None
+        """
+        key = MessageLedger.message_key(email_data) or 'sha256:' + hashlib.sha256(header).hexdigest()
+        if self.contains(key):
+            return None
+        return self._write(
+            key, lambda f: self._write_parts(f, header, attachments), email_data, match_result, mailbox
+        )
+
+    @staticmethod
+    def _write_parts(f: BinaryIO, header: bytes, attachments: List[Union[str, Path]]) -> None:
+        """把邮件头和附件按MIME格式写入文件"""
+        boundary = f"=_mail_cache_{uuid.uuid4().hex}".encode()
+        # 按字段拆分（续行属于上一个字段），去掉原邮件的MIME头
+        fields = re.split(rb'\r?\n(?![ \t])', header.rstrip(b'\r\n'))
+        for field in fields:
+            if field and field.split(b':', 1)[0].strip().lower() not in _MIME_HEADERS:
+                f.write(field + b'\r\n')
+        f.write(b'MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n')
+        for attachment in attachments:
+            attachment = Path(attachment)
+            f.write(
+                b'--' + boundary + b'\r\n'
+                b'Content-Type: application/octet-stream\r\n'
+                b"Content-Disposition: attachment; filename*=utf-8''" + quote(attachment.name).encode() + b'\r\n'
+                b'Content-Transfer-Encoding: base64\r\n\r\n'
+            )
+            with open(attachment, 'rb') as source:
+                for chunk in iter(lambda: source.read(_PART_CHUNK), b''):
+                    f.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+        f.write(b'--' + boundary + b'--\r\n')
+
+    def _write(self, key: str, write: Callable[[BinaryIO], Any], email_data: Dict[str, Any],
+               match_result: Dict[str, Any], mailbox: Optional[str]) -> Optional[Path]:
+        """写入临时文件后原子改名移入cur并登记索引，其他线程已缓存同一封邮件时返回None"""
+        filename = f"{int(time.time())}.{uuid.uuid4().hex}.eml.gz"
+        tmp_path = self.root / 'tmp' / filename
+        path = self.root / 'cur' / filename
+        try:
+            with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                write(f)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO messages "
+                "(key, filename, mailbox, uid, message_id, supplier, category, subject, sent_at, cached_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, filename, mailbox, int(email_data['id']) if email_data.get('id') else None,
+                 email_data.get('message_id'), match_result.get('supplier'), match_result.get('category'),
+                 email_data.get('subject'), self._sent_at(email_data), time.time())
+            )
+            self._conn.commit()
+            inserted = cursor.rowcount == 1
+            if inserted:
+                self._inserts += 1
+                # 每写入一批清理一次，避免每次写入都扫描
+                if self._inserts % 100 == 0:
+                    self._prune()
+        if not inserted:
+            # 其他线程已缓存了同一封邮件
+            path.unlink()
+            return None
+        self.logger.debug(f"邮件已缓存: {email_data.get('subject')} -> {path}")
+        return path
+
+    def find(self, supplier: Optional[str] = None, category: Optional[str] = None,
+             since: Optional[float] = None, until: Optional[float] = None,
+             message_id: Optional[str] = None, mailbox: Optional[str] = None,
+             uid: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        查询缓存的邮件
+        Args:
+            supplier: 供应商
+            category: 类别
+            since: 邮件时间下限（时间戳）
+            until: 邮件时间上限（时间戳）
+            message_id: Message-ID
+            mailbox: 邮箱名称
+            uid: 邮件UID
+        Returns:
+            缓存记录列表，按邮件时间排序
+        """
+        filters = {
+            'supplier = ?': supplier,
+            'category = ?': category,
+            'COALESCE(sent_at, cached_at) >= ?': since,
+            'COALESCE(sent_at, cached_at) < ?': until,
+            'message_id = ?': message_id,
+            'mailbox = ?': mailbox,
+            'uid = ?': uid,
+        }
+        conditions = [condition for condition, value in filters.items() if value is not None]
+        params = tuple(value for value in filters.values() if value is not None)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, filename, mailbox, uid, message_id, supplier, category, subject, sent_at, cached_at "
+                f"FROM messages {where}ORDER BY COALESCE(sent_at, cached_at)",
+                params
+            ).fetchall()
+        columns = ('key', 'filename', 'mailbox', 'uid', 'message_id', 'supplier',
+                   'category', 'subject', 'sent_at', 'cached_at')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def read(self, entry: Dict[str, Any]) -> bytes:
+        """
+        读取缓存的邮件原文
+        Args:
+            entry: find 返回的缓存记录
+        Returns:
+            邮件原文
+        """
+        with gzip.open(self.root / 'cur' / entry['filename'], 'rb') as f:
+            return f.read()
+
+    def _prune(self) -> None:
+        """清理过期邮件及其文件（调用方持有锁）"""
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        expired = [row[0] for row in self._conn.execute(
+            "SELECT filename FROM messages WHERE cached_at < ?", (cutoff,)
+        )]
+        if not expired:
+            return
+        self._conn.execute("DELETE FROM messages WHERE cached_at < ?", (cutoff,))
+        self._conn.commit()
+        for filename in expired:
+            try:
+                (self.root / 'cur' / filename).unlink()
+            except FileNotFoundError:
+                pass
+        self.logger.info(f"邮件缓存清理过期邮件 {len(expired)} 封")
+
+    def close(self) -> None:
+        """关闭缓存索引"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,272 @@
+"""
+已处理邮件台账模块
+按Message-ID记录处理成功的邮件，邮件被重新投递或被人工标记为未读时不会重复入库和录入ERP
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from utils.logger import Logger
+from utils.bloom_filter import BloomFilter
+
+
+class MessageLedger:
+    """
+    已处理邮件台账
+
+    台账保存在本地SQLite文件中：邮件键 -> (Message-ID, 主题, 供应商, 类别, 附件哈希, 处理时间, 统计)。
+    内存中的布隆过滤器挡在数据库前面，绝大多数新邮件不需要查询数据库即可判定未处理；
+    过滤器判定可能存在时再查数据库确认，误判只多一次查询，不会跳过新邮件。
+    """
+
+    # 进程内共享的台账：数据库文件的绝对路径 -> 台账
+    _shared: Dict[str, 'MessageLedger'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_file: Union[str, Path], retention_days: int = 180,
+                 capacity: int = 100000, error_rate: float = 0.001):
+        """
+        初始化台账
+        Args:
+            db_file: SQLite台账文件路径
+            retention_days: 记录保留天数，0表示不清理
+            capacity: 布隆过滤器预计条目数，超出后自动扩容重建
+            error_rate: 布隆过滤器误判率
+        """
+        self.logger = Logger(__name__)
+        self.db_file = Path(db_file)
+        self.retention_days = retention_days
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._filter = BloomFilter(capacity, error_rate)
+        # 查询统计：过滤器直接排除 / 查询数据库 / 过滤器误判
+        self.stats = {'filtered': 0, 'lookups': 0, 'false_positives': 0}
+
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        # 流水线的入库线程也会写入，由 _lock 串行化
+        self._conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " key TEXT PRIMARY KEY,"
+            " message_id TEXT,"
+            " subject TEXT,"
+            " supplier TEXT,"
+            " category TEXT,"
+            " attachment_hashes TEXT,"
+            " processed_at REAL NOT NULL,"
+            " stats TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_processed_at ON messages(processed_at)")
+        self._conn.commit()
+
+        with self._lock:
+            self._prune()
+            self._rebuild_filter()
+        self.logger.debug(f"已处理邮件台账已加载: {self._filter.count} 条")
+
+    @classmethod
+    def get_shared(cls, db_file: Union[str, Path], retention_days: int = 180,
+                   capacity: int = 100000, error_rate: float = 0.001) -> 'MessageLedger':
+        """
+        获取进程内共享的台账
+
+        布隆过滤器只在首次打开时扫描全表构建，之后各次调度运行都使用同一个过滤器；其余参数以首次创建时为准
+        Args:
+            db_file: SQLite台账文件路径
+            retention_days: 记录保留天数，0表示不清理
+            capacity: 布隆过滤器预计条目数
+            error_rate: 布隆过滤器误判率
+        Returns:
+            该台账文件对应的台账
+        """
+        key = str(Path(db_file).resolve())
+        with cls._shared_lock:
+            ledger = cls._shared.get(key)
+            if ledger is None:
+                ledger = cls._shared[key] = cls(db_file, retention_days, capacity, error_rate)
+            return ledger
+
+    @classmethod
+    def close_all(cls) -> None:
+        """关闭所有共享的台账"""
+        with cls._shared_lock:
+            ledgers = list(cls._shared.values())
+            cls._shared.clear()
+        for ledger in ledgers:
+            ledger.close()
+
+    @staticmethod
+    def message_key(email_data: Dict[str, Any]) -> Optional[str]:
+        """
+        计算邮件在台账中的键
+        优先使用Message-ID；没有时用 发件人+主题+发送时间 的哈希，三者不全时无法识别，返回None
+        Args:
+            email_data: 邮件数据（parse_email_data的结果）
+        Returns:
+            邮件键
+        """
+        message_id = (email_data.get('message_id') or '').strip()
+        if message_id:
+            return f"mid:{message_id}"
+        parts = [email_data.get('from') or '', email_data.get('subject') or '', email_data.get('date') or '']
+        if not all(parts):
+            return None
+        return 'sha256:' + hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def contains(self, key: Optional[str]) -> bool:
+        """
+        判断邮件是否已处理过
+        Args:
+            key: 邮件键
+        Returns:
+            bool: 是否已处理
+        """
+        if not key:
+            return False
+        if key not in self._filter:
+            self.stats['filtered'] += 1
+            return False
+        with self._lock:
+            self.stats['lookups'] += 1
+            row = self._conn.execute("SELECT 1 FROM messages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['false_positives'] += 1
+        return row is not None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查询邮件的处理记录
+        Args:
+            key: 邮件键
+        Returns:
+            处理记录，不存在时返回None
+        """
+        rows = self._select("WHERE key = ?", (key,))
+        return rows[0] if rows else None
+
+    def record(self, key: str, email_data: Dict[str, Any], supplier: Optional[str], category: Optional[str],
+               attachment_hashes: Optional[List[str]] = None, stats: Optional[Dict[str, Any]] = None) -> None:
+        """
+        记录处理成功的邮件
+        Args:
+            key: 邮件键
+            email_data: 邮件数据
+            supplier: 供应商
+            category: 类别
+            attachment_hashes: 附件内容哈希
+            stats: 处理结果统计
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO messages "
+                "(key, message_id, subject, supplier, category, attachment_hashes, processed_at, stats) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, email_data.get('message_id'), email_data.get('subject'), supplier, category,
+                 json.dumps(attachment_hashes or []), time.time(),
+                 json.dumps(stats or {}, ensure_ascii=False, default=str))
+            )
+            self._conn.commit()
+            self._filter.add(key)
+            self._inserts += 1
+            # 超出过滤器容量后误判率上升，按当前条目数扩容重建
+            if self._filter.count > self._filter.capacity:
+                self._rebuild_filter()
+            # 每写入一批清理一次，避免每次写入都扫描
+            elif self._inserts % 100 == 0:
+                self._prune()
+
+    def entries(self, since: Optional[float] = None, supplier: Optional[str] = None,
+                category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        列出处理记录，用于挑选需要重放的邮件
+        Args:
+            since: 只返回该时间戳之后处理的记录
+            supplier: 按供应商过滤
+            category: 按类别过滤
+        Returns:
+            处理记录列表，按处理时间排序
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("processed_at >= ?")
+            params.append(since)
+        if supplier:
+            conditions.append("supplier = ?")
+            params.append(supplier)
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return self._select(where + "ORDER BY processed_at", tuple(params))
+
+    def forget(self, keys: Iterable[str]) -> int:
+        """
+        删除处理记录，下次收到这些邮件（或重新标记为未读）时会重新处理
+        Args:
+            keys: 邮件键列表
+        Returns:
+            删除的条数
+        """
+        keys = list(keys)
+        if not keys:
+            return 0
+        with self._lock:
+            removed = self._conn.executemany("DELETE FROM messages WHERE key = ?", [(k,) for k in keys]).rowcount
+            self._conn.commit()
+            # 布隆过滤器不支持删除，重建
+            self._rebuild_filter()
+        self.logger.info(f"已从台账删除 {removed} 条记录，对应邮件将被重新处理")
+        return removed
+
+    def _select(self, clause: str, params: tuple) -> List[Dict[str, Any]]:
+        """查询记录"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, message_id, subject, supplier, category, attachment_hashes, processed_at, stats "
+                f"FROM messages {clause}",
+                params
+            ).fetchall()
+        return [
+            {
+                'key': row[0],
+                'message_id': row[1],
+                'subject': row[2],
+                'supplier': row[3],
+                'category': row[4],
+                'attachment_hashes': json.loads(row[5]) if row[5] else [],
+                'processed_at': row[6],
+                'stats': json.loads(row[7]) if row[7] else {}
+            }
+            for row in rows
+        ]
+
+    def _prune(self) -> None:
+        """清理过期记录（调用方持有锁）"""
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        removed = self._conn.execute("DELETE FROM messages WHERE processed_at < ?", (cutoff,)).rowcount
+        if removed:
+            self._conn.commit()
+            self._rebuild_filter()
+            self.logger.info(f"已处理邮件台账清理过期记录 {removed} 条")
+
+    def _rebuild_filter(self) -> None:
+        """从数据库重建布隆过滤器（调用方持有锁）"""
+        keys = [row[0] for row in self._conn.execute("SELECT key FROM messages")]
+        capacity = self._filter.capacity
+        while len(keys) > capacity:
+            capacity *= 2
+        self._filter = BloomFilter(capacity, self.error_rate)
+        self._filter.update(keys)
+
+    def close(self) -> None:
+        """关闭台账"""
+        with self._lock:
+            self._conn.close()
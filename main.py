@@ -7,10 +7,13 @@ import os
 import sys
 import signal
 import time
+import argparse
+from datetime import datetime, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 from utils.logger import Logger
 from core.scheduler import Scheduler
+from core.email_processor import EmailProcessor
 
 class HuaxinAgent:
     """华芯自动化代理系统主类"""
@@ -88,8 +91,42 @@ class HuaxinAgent:
             self.logger.error(f"系统停止失败: {str(e)}", exc_info=True)
             sys.exit(1)
 
+def reprocess(args: argparse.Namespace) -> None:
+    """从本地邮件缓存离线重新处理邮件"""
+    env_path = Path('.env')
+    if env_path.exists():
+        load_dotenv(env_path)
+    since = datetime.strptime(args.since, '%Y-%m-%d').timestamp() if args.since else None
+    # 截止日期包含当天
+    until = (datetime.strptime(args.until, '%Y-%m-%d') + timedelta(days=1)).timestamp() if args.until else None
+    processor = EmailProcessor()
+    stats = processor.reprocess_cached(
+        supplier=args.supplier,
+        category=args.category,
+        since=since,
+        until=until,
+        message_id=args.message_id,
+        include_delivery=args.include_delivery
+    )
+    if stats['failed']:
+        sys.exit(1)
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='华芯自动化代理系统')
+    subparsers = parser.add_subparsers(dest='command')
+    reprocess_parser = subparsers.add_parser('reprocess', help='从本地邮件缓存重新处理邮件，不连接邮箱')
+    reprocess_parser.add_argument('--supplier', help='供应商')
+    reprocess_parser.add_argument('--category', help='类别，如 晶圆进度表/封装进度表')
+    reprocess_parser.add_argument('--since', help='邮件日期起（YYYY-MM-DD）')
+    reprocess_parser.add_argument('--until', help='邮件日期止（YYYY-MM-DD，含当天）')
+    reprocess_parser.add_argument('--message-id', help='只处理指定Message-ID的邮件')
+    reprocess_parser.add_argument('--include-delivery', action='store_true', help='包含送货单（会重复录入ERP）')
+    args = parser.parse_args()
+    if args.command == 'reprocess':
+        reprocess(args)
+        return
+
     agent = HuaxinAgent()
     try:
         agent.start()
@@ -0,0 +1,303 @@
+"""
+规则编译模块
+规则加载时一次性编译：通配符模式合并为每个字段一个正则，subject_regex预编译，
+按发件人地址/域名建立索引，每封邮件只需检查少数候选规则；所有规则的主题关键词合并为一个
+Aho-Corasick自动机，主题只扫描一遍。匹配语义与逐条检查相同
+"""
+
+import re
+import time
+from bisect import insort
+from dataclasses import dataclass, field
+from fnmatch import translate
+from typing import AbstractSet, Any, Dict, List, Optional, Pattern, Tuple
+
+from modules.email_processor.rules.keyword_matcher import KeywordMatcher
+
+# 判断模式中是否含通配符
+_WILDCARD_RE = re.compile(r'[*?\[\]]')
+# 规则每被检查多少次按统计重新排列一次条件
+REORDER_INTERVAL = 256
+
+
+def compile_patterns(patterns: Optional[List[str]]) -> Optional[Pattern]:
+    """
+    把通配符模式列表合并为一个正则（匹配小写后的值）
+    Args:
+        patterns: 通配符模式列表，如 ["*@psmc.com.tw", "wip@csmc.com"]
+    Returns:
+        合并后的正则；没有模式（条件不限制）时返回None
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{translate(pattern.lower())})' for pattern in patterns))
+
+
+@dataclass
+class ConditionStats:
+    """单个条件的检查统计"""
+    name: str
+    evaluated: int = 0
+    rejected: int = 0
+    seconds: float = 0.0
+
+    def rank(self) -> float:
+        """排序键：平均耗时除以否决率，越小越应先检查；没有数据时保持原顺序"""
+        if not self.evaluated:
+            return 0.0
+        return (self.seconds / self.evaluated) / max(self.rejected / self.evaluated, 1e-6)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """统计字典：检查次数、否决次数、否决率和平均耗时（微秒）"""
+        return {
+            'evaluated': self.evaluated,
+            'rejected': self.rejected,
+            'reject_rate': round(self.rejected / self.evaluated, 4) if self.evaluated else 0.0,
+            'avg_us': round(self.seconds / self.evaluated * 1e6, 3) if self.evaluated else 0.0,
+        }
+
+
+@dataclass
+class CompiledRule:
+    """编译后的规则"""
+    # 在启用规则中的序号
+    index: int
+    rule: Dict[str, Any]
+    # 在规则文件 rules 列表中的位置（含未启用的规则）
+    position: int = 0
+    from_re: Optional[Pattern] = None
+    to_re: Optional[Pattern] = None
+    cc_re: Optional[Pattern] = None
+    # 主题关键词（已小写）；None表示不限制，空元组表示永远不匹配
+    keywords: Optional[Tuple[str, ...]] = None
+    subject_re: Optional[Pattern] = None
+
+    @classmethod
+    def from_dict(cls, index: int, rule: Dict[str, Any], position: int = 0) -> 'CompiledRule':
+        """编译单条规则，只编译引擎实际检查的条件（from/to/cc_contains、subject_contains、subject_regex）"""
+        conditions = rule.get('conditions') or {}
+        keywords = None
+        if 'subject_contains' in conditions:
+            keywords = tuple(keyword.lower() for keyword in conditions['subject_contains'] or [])
+        subject_regex = conditions.get('subject_regex')
+        return cls(
+            index=index,
+            rule=rule,
+            position=position,
+            from_re=compile_patterns(conditions.get('from_contains')),
+            to_re=compile_patterns(conditions.get('to_contains')),
+            cc_re=compile_patterns(conditions.get('cc_contains')),
+            keywords=keywords,
+            subject_re=re.compile(subject_regex) if subject_regex else None,
+        )
+
+    def __post_init__(self):
+        # 本规则实际需要检查的条件，按观察到的选择性和耗时排序
+        self.checks: List[ConditionStats] = [
+            ConditionStats(name) for name, present in (
+                ('from_contains', self.from_re is not None),
+                ('to_contains', self.to_re is not None),
+                ('cc_contains', self.cc_re is not None),
+                ('subject_contains', self.keywords is not None),
+                ('subject_regex', self.subject_re is not None),
+            ) if present
+        ]
+        # 作为候选被检查的次数和匹配次数
+        self.evaluated = 0
+        self.hits = 0
+
+    @staticmethod
+    def _match_value(pattern: Optional[Pattern], value: Any) -> bool:
+        """地址（或地址列表中的任意一个）是否匹配"""
+        if pattern is None:
+            return True
+        if isinstance(value, list):
+            return any(pattern.match(address.lower()) for address in value)
+        return pattern.match(value.lower()) is not None
+
+    def check(self, name: str, email_data: Dict[str, Any], subject_lower: str,
+              keyword_hits: Optional[AbstractSet[int]] = None) -> bool:
+        """
+        检查单个条件
+        Args:
+            name: 条件名（规则配置中的键）
+            email_data: 邮件数据
+            subject_lower: 小写的主题
+            keyword_hits: 关键词自动机的扫描结果，为None时逐个检查关键词
+        Returns:
+            bool: 条件是否满足
+        """
+        if name == 'from_contains':
+            return self._match_value(self.from_re, email_data.get('from', ''))
+        if name == 'to_contains':
+            return self._match_value(self.to_re, email_data.get('to', []))
+        if name == 'cc_contains':
+            return self._match_value(self.cc_re, email_data.get('cc', []))
+        if name == 'subject_contains':
+            if keyword_hits is not None:
+                return self.index in keyword_hits
+            return any(keyword in subject_lower for keyword in self.keywords)
+        return self.subject_re.search(email_data.get('subject', '')) is not None
+
+    def matches(self, email_data: Dict[str, Any], subject_lower: str,
+                keyword_hits: Optional[AbstractSet[int]] = None) -> bool:
+        """
+        检查邮件是否满足本规则的全部条件
+
+        条件之间是“与”的关系，检查顺序不影响结果：先检查最可能否决且耗时少的条件，
+        每检查 REORDER_INTERVAL 次按统计重新排序一次
+
+        Args:
+            email_data: 邮件数据
+            subject_lower: 小写的主题（同一封邮件只转换一次）
+            keyword_hits: 关键词自动机的扫描结果，为None时逐个检查关键词
+        Returns:
+            bool: 是否匹配
+        """
+        self.evaluated += 1
+        if self.evaluated % REORDER_INTERVAL == 0:
+            self.reorder()
+        for stats in self.checks:
+            started = time.perf_counter()
+            passed = self.check(stats.name, email_data, subject_lower, keyword_hits)
+            stats.seconds += time.perf_counter() - started
+            stats.evaluated += 1
+            if not passed:
+                stats.rejected += 1
+                return False
+        self.hits += 1
+        return True
+
+    def reorder(self) -> None:
+        """按 平均耗时 / 否决率 从小到大重新排列条件（整体替换列表，不影响正在进行的检查）"""
+        self.checks = sorted(self.checks, key=ConditionStats.rank)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """规则的命中统计"""
+        return {
+            'name': self.rule.get('name', 'unnamed_rule'),
+            'position': self.position,
+            'evaluated': self.evaluated,
+            'hits': self.hits,
+            'rejected': self.evaluated - self.hits,
+            'order': [stats.name for stats in self.checks],
+            'conditions': {stats.name: stats.as_dict() for stats in self.checks},
+        }
+
+
+@dataclass
+class RuleSet:
+    """
+    编译后的规则集
+
+    发件人条件全部是精确地址或 "*@域名" 的规则登记到地址/域名索引，其余规则每封邮件都要检查；
+    候选规则按文件中的顺序检查，第一条匹配的规则生效
+    """
+    rules: List[CompiledRule] = field(default_factory=list)
+    # 每封邮件都要检查的规则序号
+    always: List[int] = field(default_factory=list)
+    # 小写的发件人地址 -> 规则序号
+    by_address: Dict[str, List[int]] = field(default_factory=dict)
+    # 小写的发件人域名 -> 规则序号
+    by_domain: Dict[str, List[int]] = field(default_factory=dict)
+    # 所有规则的主题关键词
+    keyword_matcher: KeywordMatcher = field(default_factory=KeywordMatcher)
+    # 匹配过的邮件数
+    messages: int = 0
+
+    @classmethod
+    def compile(cls, rules: List[Dict[str, Any]]) -> 'RuleSet':
+        """
+        编译规则列表（跳过未启用的规则）
+        Args:
+            rules: 规则配置中的 rules 列表
+        Returns:
+            编译后的规则集
+        Raises:
+            re.error: subject_regex 不是合法的正则表达式
+        """
+        rule_set = cls()
+        for position, rule in enumerate(rules):
+            if not rule.get('enabled', True):
+                continue
+            compiled = CompiledRule.from_dict(len(rule_set.rules), rule, position)
+            rule_set.rules.append(compiled)
+            rule_set._index(compiled)
+            if compiled.keywords:
+                rule_set.keyword_matcher.add_rule(compiled.keywords, compiled.index)
+        rule_set.keyword_matcher.build()
+        return rule_set
+
+    def _index(self, compiled: CompiledRule) -> None:
+        """按发件人条件登记规则"""
+        patterns = (compiled.rule.get('conditions') or {}).get('from_contains')
+        keys = []
+        for pattern in patterns or []:
+            pattern = pattern.lower()
+            if not _WILDCARD_RE.search(pattern):
+                keys.append((self.by_address, pattern))
+            elif pattern.startswith('*@') and not _WILDCARD_RE.search(pattern[2:]):
+                keys.append((self.by_domain, pattern[2:]))
+            else:
+                keys = None
+                break
+        if not keys:
+            # 不限制发件人或含有无法索引的模式
+            self.always.append(compiled.index)
+            return
+        for table, key in keys:
+            indexes = table.setdefault(key, [])
+            if compiled.index not in indexes:
+                indexes.append(compiled.index)
+
+    def candidates(self, sender: str) -> List[int]:
+        """
+        可能匹配该发件人的规则序号（按文件顺序）
+        Args:
+            sender: 发件人地址
+        Returns:
+            规则序号列表
+        """
+        sender = (sender or '').lower()
+        extra = self.by_address.get(sender, []) + self.by_domain.get(sender.rsplit('@', 1)[-1], []) \
+            if '@' in sender else self.by_address.get(sender, [])
+        if not extra:
+            return self.always
+        indexes = list(self.always)
+        for index in extra:
+            if index not in indexes:
+                insort(indexes, index)
+        return indexes
+
+    def match(self, email_data: Dict[str, Any]) -> Optional[CompiledRule]:
+        """
+        查找第一条匹配的规则
+        Args:
+            email_data: 邮件数据
+        Returns:
+            匹配的规则，没有时返回None
+        """
+        self.messages += 1
+        subject_lower = email_data.get('subject', '').lower()
+        # 主题只扫描一遍，关键词条件不满足的规则不再检查其他条件
+        keyword_hits = None
+        for index in self.candidates(email_data.get('from', '')):
+            compiled = self.rules[index]
+            if compiled.keywords is not None and keyword_hits is None:
+                keyword_hits = self.keyword_matcher.scan(subject_lower)
+            if compiled.matches(email_data, subject_lower, keyword_hits):
+                return compiled
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        规则集的匹配统计
+        Returns:
+            邮件数、各规则的检查/命中次数与条件统计、从未命中的规则
+        """
+        rules = [compiled.get_stats() for compiled in self.rules]
+        return {
+            'messages': self.messages,
+            'rules': rules,
+            'dead_rules': [stats['name'] for stats in rules if not stats['hits']],
+        }
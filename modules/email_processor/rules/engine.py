@@ -1,10 +1,22 @@
 from typing import Dict, Any, List, Optional, Union, Tuple
+from array import array
+from collections import Counter
 from fnmatch import fnmatch
 from dataclasses import dataclass
+from pathlib import Path
+import hashlib
 import re
+import threading
+import time
 
 from utils.logger import Logger
 from utils.helpers import load_yaml
+from modules.email_processor.rules.compiler import CompiledRule, RuleSet
+
+# 可下推到IMAP SEARCH的地址条件：规则条件键 -> SEARCH键
+SEARCH_ADDRESS_KEYS = {'from_contains': b'FROM', 'to_contains': b'TO', 'cc_contains': b'CC'}
+# 通配符，拆分模式时用于提取字面片段
+_WILDCARD_RE = re.compile(r'[*?\[\]]')
 
 
 @dataclass
@@ -58,6 +70,11 @@ class EmailRule:
         )
 class RuleEngine:
     """邮件规则引擎"""
+
+    # 进程内按规则文件共享的引擎，同一规则文件只有一个规则集和一个监视线程
+    _shared: Dict[str, 'RuleEngine'] = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self, rules_file: str):
         """
         初始化规则引擎
@@ -65,8 +82,196 @@ class RuleEngine:
             rules_file: 规则配置文件路径
         """
         self.logger = Logger(__name__)
+        self.rules_file = Path(rules_file)
+        # 规则文件的 (修改时间, 大小) 和内容哈希，用于判断是否需要重新加载
+        self._fingerprint = self._stat()
+        self._digest = self._file_digest()
         self.rules = self._load_rules(rules_file)
-        
+        # 规则加载时一次性编译，apply_rules 只检查发件人索引给出的候选规则
+        self._rule_set = RuleSet.compile(self.rules.get('rules', []))
+        # 规则版本，每次重新加载成功加一
+        self.version = 1
+        self.reload_stats: Dict[str, Any] = {
+            'version': self.version,
+            'reloads': 0,
+            'failures': 0,
+            'last_reload_seconds': 0.0,
+            'last_error': None,
+        }
+        self._reload_lock = threading.Lock()
+        self._watch_stop: Optional[threading.Event] = None
+        self._watcher: Optional[threading.Thread] = None
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        """规则文件的修改时间和大小，文件不存在时返回None"""
+        try:
+            stat = self.rules_file.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _file_digest(self) -> Optional[str]:
+        """规则文件内容的哈希，文件不可读时返回None"""
+        try:
+            return hashlib.sha256(self.rules_file.read_bytes()).hexdigest()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _validate_rules(email_rules: Any) -> RuleSet:
+        """
+        校验规则配置并编译
+        Args:
+            email_rules: 规则文件内容
+        Returns:
+            编译后的规则集
+        Raises:
+            ValueError: 规则配置不合法（缺少字段、条件格式错误、正则表达式错误）
+        """
+        if not isinstance(email_rules, dict) or not isinstance(email_rules.get('rules'), list):
+            raise ValueError("规则文件缺少 rules 列表")
+        for index, rule in enumerate(email_rules['rules']):
+            if not isinstance(rule, dict):
+                raise ValueError(f"第{index + 1}条规则格式错误")
+            missing = [key for key in ('name', 'category', 'supplier') if not rule.get(key)]
+            if missing:
+                raise ValueError(f"规则 {rule.get('name', index + 1)} 缺少字段: {', '.join(missing)}")
+            if not isinstance(rule.get('conditions'), dict):
+                raise ValueError(f"规则 {rule['name']} 的 conditions 格式错误")
+            for key in ('from_contains', 'to_contains', 'cc_contains', 'subject_contains'):
+                value = rule['conditions'].get(key)
+                if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                    raise ValueError(f"规则 {rule['name']} 的 {key} 必须是字符串列表")
+        try:
+            return RuleSet.compile(email_rules['rules'])
+        except re.error as e:
+            raise ValueError(f"subject_regex 不是合法的正则表达式: {str(e)}") from e
+
+    def check_reload(self) -> bool:
+        """
+        检查规则文件是否变化，变化时校验、编译并替换当前规则
+
+        先比较修改时间和大小，变化时再比较内容哈希；新规则在调用线程中编译完成后一次性替换，
+        apply_rules 每封邮件只读取一次规则集，替换只会发生在两封邮件之间。
+        校验失败时继续使用当前版本，文件再次修改后重试
+
+        Returns:
+            bool: 是否加载了新版本
+        """
+        # 已有重新加载在进行时跳过
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            fingerprint = self._stat()
+            if fingerprint is None or fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+            digest = self._file_digest()
+            if digest is None or digest == self._digest:
+                return False
+            self._digest = digest
+
+            started = time.perf_counter()
+            try:
+                email_rules = load_yaml(self.rules_file)
+                rule_set = self._validate_rules(email_rules)
+            except Exception as e:
+                self.reload_stats['failures'] += 1
+                self.reload_stats['last_error'] = str(e)
+                self.logger.error(f"规则文件重新加载失败，继续使用版本 {self.version}: {str(e)}")
+                return False
+            elapsed = time.perf_counter() - started
+
+            self.rules, self._rule_set = email_rules, rule_set
+            self.version += 1
+            self.reload_stats.update({
+                'version': self.version,
+                'reloads': self.reload_stats['reloads'] + 1,
+                'last_reload_seconds': round(elapsed, 4),
+                'last_error': None,
+            })
+            self.logger.info(
+                f"规则已重新加载: 版本 {self.version}, 启用规则 {len(rule_set.rules)} 条, "
+                f"耗时 {elapsed * 1000:.1f}ms"
+            )
+            return True
+        finally:
+            self._reload_lock.release()
+
+    @classmethod
+    def get_shared(cls, rules_file: str) -> 'RuleEngine':
+        """
+        获取进程内共享的规则引擎
+
+        调度器每次运行都会创建新的邮箱客户端，共享引擎避免每个客户端各自加载规则、各自启动监视线程；
+        取用已有引擎时先检查规则文件，未开启热加载时修改的规则也在下次运行时生效
+        Args:
+            rules_file: 规则配置文件路径
+        Returns:
+            该规则文件对应的规则引擎
+        """
+        key = str(Path(rules_file).resolve())
+        with cls._shared_lock:
+            engine = cls._shared.get(key)
+            if engine is None:
+                engine = cls._shared[key] = cls(rules_file)
+                return engine
+        engine.check_reload()
+        return engine
+
+    @classmethod
+    def close_all(cls) -> None:
+        """停止所有共享引擎的监视线程并清空共享引擎"""
+        with cls._shared_lock:
+            engines = list(cls._shared.values())
+            cls._shared.clear()
+        for engine in engines:
+            engine.stop_watching()
+
+    def start_watching(self, interval: float = 30.0) -> None:
+        """
+        启动后台线程定期检查规则文件，修改规则后不需要重启程序；已在监视时不再启动
+        Args:
+            interval: 检查间隔（秒）
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._watch_stop = threading.Event()
+        stop = self._watch_stop
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.check_reload()
+                except Exception as e:
+                    self.logger.error(f"检查规则文件失败: {str(e)}")
+
+        self._watcher = threading.Thread(target=watch, name='rules-watcher', daemon=True)
+        self._watcher.start()
+        self.logger.debug(f"开始监视规则文件: {self.rules_file}，间隔 {interval}s")
+
+    def stop_watching(self) -> None:
+        """停止监视规则文件"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self._watcher = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        规则匹配统计
+
+        统计属于当前版本的规则集，重新加载后从零开始；dead_rules 为当前版本中从未命中的规则，
+        运行足够长时间后仍在其中的规则可以考虑删除
+
+        Returns:
+            {'version': 规则版本, 'reload': 重新加载统计, 'messages': 邮件数,
+             'rules': [{'name', 'position', 'evaluated', 'hits', 'rejected', 'order', 'conditions'}],
+             'dead_rules': [规则名称]}
+        """
+        stats = self._rule_set.get_stats()
+        return dict(stats, version=self.version, reload=dict(self.reload_stats))
 
     def _load_rules(self, rules_file: str) -> Dict[str, List[EmailRule]]:
         """加载规则配置"""
@@ -168,11 +373,86 @@ class RuleEngine:
                 
         return True
     
+    @staticmethod
+    def _search_string(value: str) -> bytes:
+        """IMAP字符串：ASCII用带引号字符串，含中文等非ASCII字符时用字面量（UTF-8）"""
+        data = value.encode('utf-8')
+        if not data.isascii():
+            # 带引号字符串只允许7位字符
+            return b'{%d}\r\n' % len(data) + data
+        return b'"' + data.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+    @staticmethod
+    def _search_or(keys: List[bytes]) -> bytes:
+        """把多个搜索键组合为 OR 表达式（IMAP的OR只接受两个参数，需要嵌套）"""
+        expression = keys[-1]
+        for key in reversed(keys[:-1]):
+            expression = b'OR ' + key + b' ' + expression
+        return expression
+
+    def _rule_search_criteria(self, rule: Dict) -> Optional[bytes]:
+        """
+        把单条规则编译为SEARCH条件
+
+        主题关键词原样下推；地址模式取最长的字面片段做子串匹配（服务器结果是规则匹配结果的超集）
+
+        参数:
+            rule: 规则字典
+
+        返回:
+            bytes: 括号包围的搜索条件；规则没有可下推的条件时返回None
+        """
+        conditions = rule.get('conditions', {})
+        parts = []
+
+        keywords = [k for k in conditions.get('subject_contains') or [] if k]
+        if keywords:
+            parts.append(self._search_or([b'SUBJECT ' + self._search_string(k) for k in keywords]))
+
+        for condition, search_key in SEARCH_ADDRESS_KEYS.items():
+            patterns = conditions.get(condition)
+            if not patterns:
+                continue
+            fragments = [max(_WILDCARD_RE.split(pattern), key=len) for pattern in patterns]
+            # 某个模式没有字面片段（如 "*"）时该条件无法缩小范围
+            if not all(fragments):
+                continue
+            parts.append(self._search_or([search_key + b' ' + self._search_string(f) for f in fragments]))
+
+        if not parts:
+            return None
+        return b'(' + b' '.join(parts) + b')'
+
+    def build_search_criteria(self) -> Optional[bytes]:
+        """
+        把所有启用规则的条件编译为一个IMAP SEARCH条件（各规则之间为OR）
+
+        只下推本引擎实际检查的条件（subject_contains 与 from/to/cc_contains），
+        服务器返回的是候选邮件，最终仍由 apply_rules 精确匹配。
+        非ASCII的关键词编码为字面量（{n}\\r\\n 后跟UTF-8内容），需要用 CHARSET UTF-8 发送
+
+        返回:
+            bytes: 搜索条件；存在无法下推的规则时返回None，此时需要搜索全部未读邮件
+        """
+        rule_criteria = []
+        for rule in self.rules.get('rules', []):
+            if not rule.get('enabled', True):
+                continue
+            criteria = self._rule_search_criteria(rule)
+            if criteria is None:
+                self.logger.debug(f"规则 {rule.get('name')} 没有可下推的条件，搜索全部未读邮件")
+                return None
+            rule_criteria.append(criteria)
+        if not rule_criteria:
+            return None
+        return self._search_or(rule_criteria)
+
     def apply_rules(self, email_data: Dict) -> Dict[str, Any]:
         """
         应用邮件规则
         
-        遍历所有启用的规则，返回第一个匹配的规则的动作和相关信息
+        按文件顺序返回第一个匹配的启用规则的动作和相关信息（使用编译后的规则集，
+        结果与逐条调用 check_rule_conditions 相同）
         
         参数:
             email_data: 邮件数据字典
@@ -188,18 +468,70 @@ class RuleEngine:
         """
         self.logger.debug(f"开始匹配规则，邮件主题: {email_data.get('subject', '')}")
 
-        # 检查每个规则
-        for rule in self.rules.get('rules', []):
-            if rule.get('enabled', True) and self.check_rule_conditions(email_data, rule):
-                self.logger.info(f"邮件匹配规则: {rule.get('name', 'unnamed_rule')}")
-                return {
-                    'actions': rule.get('actions', {}),
-                    'name': rule.get('name', 'unnamed_rule'),
-                    'category': rule.get('category', '未分类'),
-                    'supplier': rule.get('supplier', '未知'),
-                    'allowed_extensions': rule.get('allowed_extensions', [])
-                }
+        compiled = self._rule_set.match(email_data)
+        if compiled is not None:
+            self.logger.info(f"邮件匹配规则: {compiled.rule.get('name', 'unnamed_rule')}")
+            return self._match_result(compiled.rule)
         
         # 如果没有匹配的规则，返回空结果
         self.logger.debug("邮件不匹配任何规则")
-        return {}
\ No newline at end of file
+        return {}
+
+    @staticmethod
+    def _match_result(rule: Dict) -> Dict[str, Any]:
+        """规则的匹配结果（格式见 apply_rules）"""
+        return {
+            'actions': rule.get('actions', {}),
+            'name': rule.get('name', 'unnamed_rule'),
+            'category': rule.get('category', '未分类'),
+            'supplier': rule.get('supplier', '未知'),
+            'allowed_extensions': rule.get('allowed_extensions', [])
+        }
+
+    def _match_batch(self, emails: List[Dict]) -> List[Optional[CompiledRule]]:
+        """
+        用同一版本的规则集匹配一批邮件，只输出一行汇总日志
+
+        参数:
+            emails: 邮件数据字典列表（只需要邮件头字段）
+
+        返回:
+            list: 每封邮件匹配的规则，未匹配为None
+        """
+        started = time.perf_counter()
+        # 整批使用同一版本，期间的热加载从下一批开始生效
+        rule_set = self._rule_set
+        matches = [rule_set.match(email_data) for email_data in emails]
+        elapsed = time.perf_counter() - started
+        hits = Counter(compiled.rule.get('name', 'unnamed_rule') for compiled in matches if compiled is not None)
+        self.logger.info(
+            f"批量匹配规则: {len(emails)} 封, 命中 {sum(hits.values())} 封, 耗时 {elapsed * 1000:.1f}ms"
+            + (f" ({', '.join(f'{name} {count}' for name, count in hits.most_common())})" if hits else "")
+        )
+        return matches
+
+    def apply_rules_batch(self, emails: List[Dict]) -> array:
+        """
+        批量应用邮件规则，用于回填历史邮件或按邮件头对整段UID分类
+
+        与逐封调用 apply_rules 的匹配结果相同，但不逐封记录日志
+
+        参数:
+            emails: 邮件数据字典列表
+
+        返回:
+            array: 每封邮件匹配的规则在规则文件 rules 列表中的位置，未匹配为-1
+        """
+        return array('i', (-1 if compiled is None else compiled.position for compiled in self._match_batch(emails)))
+
+    def match_batch(self, emails: List[Dict]) -> List[Dict[str, Any]]:
+        """
+        批量应用邮件规则，返回与 apply_rules 相同格式的匹配结果
+
+        参数:
+            emails: 邮件数据字典列表
+
+        返回:
+            list: 每封邮件的匹配结果，未匹配为空字典
+        """
+        return [{} if compiled is None else self._match_result(compiled.rule) for compiled in self._match_batch(emails)]
@@ -0,0 +1,102 @@
+"""
+主题关键词匹配模块
+用所有启用规则的 subject_contains 关键词构建一个Aho-Corasick自动机，主题只扫描一遍，
+得到关键词条件已满足的规则集合
+"""
+
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Set
+
+
+class KeywordMatcher:
+    """
+    多关键词匹配自动机（Aho-Corasick）
+
+    关键词和主题都按小写匹配，与 keyword.lower() in subject.lower() 的结果相同。
+    每个关键词关联若干规则序号，扫描结果为至少命中一个关键词的规则序号集合
+    """
+
+    def __init__(self):
+        # 状态转移表：状态 -> {字符: 下一状态}，状态0为根
+        self._goto: List[Dict[str, int]] = [{}]
+        # 失配指针
+        self._fail: List[int] = [0]
+        # 到达该状态时命中的规则序号（含失配链上的输出）
+        self._output: List[Set[int]] = [set()]
+        # 空关键词在任何主题中都命中
+        self._always: Set[int] = set()
+        self._built = True
+
+    def add(self, keyword: str, rule_index: int) -> None:
+        """
+        添加关键词
+        Args:
+            keyword: 关键词
+            rule_index: 关键词所属规则的序号
+        """
+        keyword = keyword.lower()
+        if not keyword:
+            self._always.add(rule_index)
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].add(rule_index)
+        self._built = False
+
+    def add_rule(self, keywords: Iterable[str], rule_index: int) -> None:
+        """添加一条规则的全部关键词"""
+        for keyword in keywords:
+            self.add(keyword, rule_index)
+
+    def build(self) -> 'KeywordMatcher':
+        """按广度优先计算失配指针并合并输出，添加完关键词后调用一次"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] |= self._output[fail]
+        self._built = True
+        return self
+
+    def scan(self, text: str) -> FrozenSet[int]:
+        """
+        扫描文本
+        Args:
+            text: 小写的主题
+        Returns:
+            至少命中一个关键词的规则序号集合
+        """
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        hits = set(self._always)
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                hits |= output[state]
+        return frozenset(hits)
+
+    @property
+    def size(self) -> int:
+        """自动机的状态数"""
+        return len(self._goto)
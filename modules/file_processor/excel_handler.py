@@ -1,6 +1,7 @@
 from typing import Dict, List, Any
 
 from utils.logger import Logger
+from utils.archive_extractor import expand_archives
 from .supplier.hisemi_delivery_handler import HisemiDeliveryHandler
 from .supplier.hanqi_delivery_handler import HanQiDeliveryHandler
 from .supplier.xinfeng_delivery_handler import XinFengDeliveryHandler
@@ -65,6 +66,10 @@ class ExcelHandler:
                 return None
                 
             if merge_supplier not in self.SUPPLIER_HANDLERS:
+                if category == '测试报告':
+                    # 测试报告暂无解析处理器，返回解压后的文件供归档
+                    self.logger.debug(f"供应商[{supplier}]的测试报告暂无处理器，返回附件列表")
+                    return {'files': match_result.get('attachments', [])}
                 self.logger.error(f"未找到[{merge_supplier}]的处理器")
                 return None
                 
@@ -95,4 +100,19 @@ class ExcelHandler:
                 
         except Exception as e:
             self.logger.error(f"处理送货单Excel文件时出错: {str(e)}")
-            return {}
\ No newline at end of file
+            return {}
+
+
+def parse_attachments(match_result: Dict) -> Any:
+    """
+    解析匹配结果中的附件
+
+    模块级函数，可直接提交到进程池执行（pandas解析属于CPU密集型操作）。
+    压缩包附件先在同一进程中解压，解出的表格再交给对应的处理器
+
+    Args:
+        match_result: 规则引擎匹配结果（含attachments）
+    Returns:
+        处理器的解析结果
+    """
+    return ExcelHandler().process_excel(expand_archives(match_result))
\ No newline at end of file
@@ -2,6 +2,7 @@ import pandas as pd
 from typing import Dict, List, Optional, Any
 
 from .base_delivery_handler import BaseDeliveryExcelHandler
+from . import wip_transforms
 from utils.helpers import load_yaml
 from utils.logger import Logger
 
@@ -70,27 +71,14 @@ class CsmcFAB1Handler(BaseDeliveryExcelHandler):
             # 重命名列
             df.rename(columns=reverse_names, inplace=True)
 
-            # 将layerCount列按"/"拆分，并创建新的currentPosition和layerCount列
-            df[["currentPosition", "layerCount"]] = df["layerCount"].str.split("/", expand=True)
-            
-            # 将拆分后的列转换为数值类型,处理错误值为NaN
-            df["currentPosition"] = pd.to_numeric(df["currentPosition"], errors='coerce')
-            df["layerCount"] = pd.to_numeric(df["layerCount"], errors='coerce')
+            # 将layerCount列按"/"拆分为currentPosition和layerCount两列数值，错误值为NaN
+            df["currentPosition"], df["layerCount"] = wip_transforms.split_ratio(df["layerCount"])
 
-            # 安全计算remainLayer
-            df["remainLayer"] = df.apply(
-                lambda row: row["layerCount"] - row["currentPosition"]
-                if pd.notna(row["layerCount"]) and pd.notna(row["currentPosition"])
-                else None,
-                axis=1
-            )
+            # 计算remainLayer，任一层数为空时为NaN
+            df["remainLayer"] = wip_transforms.layer_difference(df["layerCount"], df["currentPosition"])
 
-            # 安全处理日期转换
-            df["forecastDate"] = pd.to_datetime(df["forecastDate"], errors='coerce')
-            # 只对非空日期进行偏移计算
-            df["forecastDate"] = df["forecastDate"].apply(
-                lambda x: (x + pd.Timedelta(days=7)).date() if pd.notna(x) else pd.NaT
-            )
+            # 日期转换并顺延7天，空值保持为空
+            df["forecastDate"] = wip_transforms.offset_dates(df["forecastDate"], 7)
 
             df["supplier"] = "上华FAB1"
             df["finished_at"] = pd.NaT
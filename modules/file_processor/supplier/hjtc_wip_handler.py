@@ -3,6 +3,7 @@ from typing import Dict, List, Optional, Any
 
 from utils.logger import Logger
 from utils.helpers import load_yaml
+from . import wip_transforms
 
 def process_hjtc_excel(file_path: str) -> Optional[str]:
     """
@@ -48,30 +49,20 @@ def process_hjtc_excel(file_path: str) -> Optional[str]:
         df.rename(columns=reverse_names, inplace=True)
 
         # 处理数值型字段，将非数值转换为NaN
-        df["layerCount"] = pd.to_numeric(df["layerCount"], errors='coerce')
-        df["currentPosition"] = pd.to_numeric(df["currentPosition"], errors='coerce')
+        wip_transforms.to_numeric(df, ["layerCount", "currentPosition"])
 
-        # 安全处理日期转换
-        df["forecastDate"] = pd.to_datetime(df["forecastDate"], errors='coerce')
-        # 只对非空日期进行偏移计算
-        df["forecastDate"] = df["forecastDate"].apply(
-            lambda x: (x + pd.Timedelta(days=7)).date() if pd.notna(x) else pd.NaT
-        )
+        # 日期转换并顺延7天，空值保持为空
+        df["forecastDate"] = wip_transforms.offset_dates(df["forecastDate"], 7)
 
         df["supplier"] = "和舰科技"
         df["finished_at"] = pd.NaT
 
         # 处理STOCK状态
-        stock_mask = df["status"].str.contains("STOCK", na=False)
-        df.loc[stock_mask, ["layerCount", "remainLayer", "currentPosition"]] = pd.NaT
+        stock_mask = wip_transforms.contains_mask(df["status"], "STOCK")
+        wip_transforms.clear_layers(df, stock_mask)
 
-        # 安全计算remainLayer
-        df["remainLayer"] = df.apply(
-            lambda row: row["layerCount"] - row["currentPosition"]
-            if pd.notna(row["layerCount"]) and pd.notna(row["currentPosition"])
-            else None,
-            axis=1
-        )
+        # 计算remainLayer，任一层数为空时为NaN
+        df["remainLayer"] = wip_transforms.layer_difference(df["layerCount"], df["currentPosition"])
         df = df[data_format]
         logger.debug(f"成功处理和舰科技Excel文件")
         return df
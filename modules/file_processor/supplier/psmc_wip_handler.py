@@ -2,6 +2,7 @@ import pandas as pd
 from typing import Dict, List, Optional, Any
 
 from .base_delivery_handler import BaseDeliveryExcelHandler
+from . import wip_transforms
 from utils.helpers import load_yaml
 from utils.logger import Logger
 
@@ -75,38 +76,30 @@ class PsmcHandler(BaseDeliveryExcelHandler):
             df.rename(columns=reverse_names, inplace=True)
 
             # 处理非数值型错误
-            df["layerCount"] = pd.to_numeric(df["layerCount"], errors='coerce')
-            df["remainLayer"] = pd.to_numeric(df["remainLayer"], errors='coerce')
-            # 计算currentPosition，处理NaN情况
-            df["currentPosition"] = df.apply(
-                lambda row: row["layerCount"] - row["remainLayer"] 
-                if pd.notna(row["layerCount"]) and pd.notna(row["remainLayer"]) 
-                else pd.NaT, 
-                axis=1
-            )
+            wip_transforms.to_numeric(df, ["layerCount", "remainLayer"])
+            # 计算currentPosition，任一层数为空时为NaN
+            df["currentPosition"] = wip_transforms.layer_difference(df["layerCount"], df["remainLayer"])
             df["supplier"] = "力积电"
             df["finished_at"] = pd.NaT
-            hold_mask = df["forecastDate"].str.contains("HOLD", na=False)
-            wh_mask = df["forecastDate"].str.contains("WH", na=False)
+            hold_mask = wip_transforms.contains_mask(df["forecastDate"], "HOLD")
+            wh_mask = wip_transforms.contains_mask(df["forecastDate"], "WH")
 
             # 保存原始的forecastDate值到status字段
-            df.loc[hold_mask, "status"] = df.loc[hold_mask, "forecastDate"]
-            df.loc[wh_mask, "status"] = "STOCK"
+            wip_transforms.rewrite_masked(df, hold_mask, {"status": df["forecastDate"]})
+            wip_transforms.rewrite_masked(df, wh_mask, {"status": "STOCK"})
 
             self.logger.debug(df[["purchaseOrder","status","forecastDate"]])
 
-            # 将forecastDate列转换为日期类型,格式为%Y-%m-%d，处理错误值
-            df["forecastDate"] = pd.to_datetime(df["forecastDate"], errors='coerce')
-            # 将forecastDate列转换为日期类型,格式为%Y-%m-%d，处理错误值
-            df["forecastDate"] = df["forecastDate"].apply(
-                lambda x: (x + pd.Timedelta(days=7)).date() if pd.notna(x) else pd.NaT
-            )
+            # 将forecastDate列转换为日期并顺延7天，处理错误值
+            df["forecastDate"] = wip_transforms.offset_dates(df["forecastDate"], 7)
 
             self.logger.debug(df[["purchaseOrder","status","forecastDate"]])
 
             # 清除特殊状态的forecastDate
-            df.loc[hold_mask, "forecastDate"] = pd.NaT
-            df.loc[wh_mask, "forecastDate"] = (pd.Timestamp.today() + pd.Timedelta(days=3)).date()
+            wip_transforms.rewrite_masked(df, hold_mask, {"forecastDate": pd.NaT})
+            wip_transforms.rewrite_masked(
+                df, wh_mask, {"forecastDate": (pd.Timestamp.today() + pd.Timedelta(days=3)).date()}
+            )
 
             self.logger.debug(df[["purchaseOrder","status","forecastDate"]])
 
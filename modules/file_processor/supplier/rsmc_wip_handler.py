@@ -2,6 +2,7 @@ import pandas as pd
 from typing import Dict, List, Optional, Any
 
 from .base_delivery_handler import BaseDeliveryExcelHandler
+from . import wip_transforms
 from utils.helpers import load_yaml
 from utils.logger import Logger
 
@@ -96,36 +97,25 @@ class RsmcHandler(BaseDeliveryExcelHandler):
 
             # 处理数值型字段，将非数值转换为NaN
             try:
-                df["remainLayer"] = pd.to_numeric(df["remainLayer"], errors='coerce')
-                df["layerCount"] = pd.to_numeric(df["layerCount"], errors='coerce')
+                wip_transforms.to_numeric(df, ["remainLayer", "layerCount"])
             except Exception as e:
                 self.logger.error(f"转换数值字段时出错: {str(e)}")
                 return None
 
             # 将purchaseOrder为空的数据改为Trail
             trail_mask = df["purchaseOrder"].isna() | (df["purchaseOrder"].str.strip() == "")
-            df.loc[trail_mask, "purchaseOrder"] = "Trail"
-            df.loc[trail_mask, "itemName"] = "Trail"
+            wip_transforms.rewrite_masked(df, trail_mask, {"purchaseOrder": "Trail", "itemName": "Trail"})
 
-            # 安全计算currentPosition
-            df["currentPosition"] = df.apply(
-                lambda row: row["layerCount"] - row["remainLayer"]
-                if pd.notna(row["layerCount"]) and pd.notna(row["remainLayer"])
-                else None,
-                axis=1
-            )
+            # 计算currentPosition，任一层数为空时为NaN
+            df["currentPosition"] = wip_transforms.layer_difference(df["layerCount"], df["remainLayer"])
 
             # 若Stock表不为空，则处理Stock表
             field_dict = {"Customer\nDevice":"itemName","Lot ID":"lot","Qty":"qty","Date":"forecastDate"}
             df_stock.rename(columns=field_dict, inplace=True)
             df_stock = df_stock[["itemName","lot","qty","forecastDate"]]
             df_stock["supplier"] = "荣芯"
-            # 先将forecastDate转换为datetime
-            df_stock["forecastDate"] = pd.to_datetime(df_stock["forecastDate"], errors='coerce')
-            # 然后再进行日期偏移
-            df_stock["forecastDate"] = df_stock["forecastDate"].apply(
-                lambda x: (x + pd.Timedelta(days=3)).date() if pd.notna(x) else pd.NaT
-            )
+            # 转换为日期并顺延3天
+            df_stock["forecastDate"] = wip_transforms.offset_dates(df_stock["forecastDate"], 3)
             df_stock["status"] = "STOCK"
             
             # 确保df_stock包含所有必要的列，缺失的列填充空值
@@ -150,11 +140,8 @@ class RsmcHandler(BaseDeliveryExcelHandler):
 
             # 安全转换日期
             try:
-                df["forecastDate"] = pd.to_datetime(df["forecastDate"], errors='coerce')
                 # 只对非空日期进行偏移计算
-                df["forecastDate"] = df["forecastDate"].apply(
-                    lambda x: (x + pd.Timedelta(days=7)).date() if pd.notna(x) else pd.NaT
-                )
+                df["forecastDate"] = wip_transforms.offset_dates(df["forecastDate"], 7)
             except Exception as e:
                 self.logger.error(f"转换日期字段时出错: {str(e)}")
                 return None
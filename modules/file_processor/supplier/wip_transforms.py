@@ -0,0 +1,105 @@
+"""
+晶圆厂WIP数据列运算
+各晶圆厂处理器共用的向量化列操作：层数计算、日期偏移、按状态改写和 "a/b" 拆分，
+整列一次运算，不再对每一行调用Python函数
+"""
+
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def to_numeric(df: pd.DataFrame, columns: Iterable[str]) -> None:
+    """
+    把列转换为数值类型，非数值转换为NaN（原地修改）
+    Args:
+        df: 数据
+        columns: 列名
+    """
+    for column in columns:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+
+
+def layer_difference(minuend: pd.Series, subtrahend: pd.Series) -> pd.Series:
+    """
+    层数相减，任一侧为空或非数值时结果为NaN
+    Args:
+        minuend: 被减数（如总层数）
+        subtrahend: 减数（如剩余层数或当前层数）
+    Returns:
+        float列
+    """
+    return pd.to_numeric(minuend, errors='coerce') - pd.to_numeric(subtrahend, errors='coerce')
+
+
+def split_ratio(series: pd.Series, sep: str = "/") -> Tuple[pd.Series, pd.Series]:
+    """
+    把 "a/b" 格式的字符串拆分为两列数值
+    Args:
+        series: 字符串列，如 "12/30"
+        sep: 分隔符
+    Returns:
+        (a, b)，不是字符串、缺少分隔符或非数值时对应位置为NaN
+    """
+    try:
+        # 非字符串的值（如数字）拆分结果为NaN
+        parts = series.str.split(sep, n=1, expand=True).reindex(columns=[0, 1])
+    except AttributeError:
+        # 整列都不是字符串
+        parts = pd.DataFrame(np.nan, index=series.index, columns=[0, 1])
+    return pd.to_numeric(parts[0], errors='coerce'), pd.to_numeric(parts[1], errors='coerce')
+
+
+def offset_dates(series: pd.Series, days: int) -> pd.Series:
+    """
+    把日期列解析后整体偏移若干天
+    Args:
+        series: 日期列（字符串或日期），无法解析的值视为空
+        days: 偏移天数
+    Returns:
+        datetime.date 列，空值为NaT
+    """
+    return (pd.to_datetime(series, errors='coerce') + pd.Timedelta(days=days)).dt.date
+
+
+def contains_mask(series: pd.Series, pattern: str) -> pd.Series:
+    """
+    字符串列是否包含指定内容，空值和非字符串视为不包含
+    Args:
+        series: 字符串列
+        pattern: 要查找的内容（正则表达式）
+    Returns:
+        bool列
+    """
+    try:
+        return series.str.contains(pattern, na=False).astype(bool)
+    except AttributeError:
+        # 整列都不是字符串（如已解析为日期）
+        return pd.Series(False, index=series.index)
+
+
+def rewrite_masked(df: pd.DataFrame, mask: pd.Series, values: Dict[str, Any]) -> None:
+    """
+    改写满足条件的行（原地修改）
+    Args:
+        df: 数据
+        mask: 要改写的行
+        values: 列名 -> 新值，值为Series时按行取对应的值，np.nan 表示清空数值列
+    """
+    for column, value in values.items():
+        if isinstance(value, pd.Series):
+            value = value[mask]
+        df.loc[mask, column] = value
+
+
+def clear_layers(df: pd.DataFrame, mask: pd.Series,
+                 columns: Iterable[str] = ("layerCount", "remainLayer", "currentPosition")) -> None:
+    """
+    清空满足条件的行的层数（如已入库的批次），保持列为数值类型
+    Args:
+        df: 数据
+        mask: 要清空的行
+        columns: 层数相关的列
+    """
+    rewrite_masked(df, mask, {column: np.nan for column in columns})
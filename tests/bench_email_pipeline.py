@@ -0,0 +1,210 @@
+"""
+邮件处理端到端压测
+启动本地IMAP替身服务器，用合成或录制的供应商邮件跑完整的
+邮件 -> 规则 -> Excel解析 -> 入库 流程，输出吞吐量、下载字节数和各阶段耗时
+
+用法（在项目根目录执行）:
+    python tests/bench_email_pipeline.py --count 200
+    python tests/bench_email_pipeline.py --samples D:/wip_samples --count 100
+    python tests/bench_email_pipeline.py --mbox recorded.mbox --db
+    python tests/bench_email_pipeline.py --no-pipeline --json result.json
+    python tests/bench_email_pipeline.py --cache --dedup
+    python tests/bench_email_pipeline.py --count 60 --coalesce
+    python tests/bench_email_pipeline.py --latency 0.05 --no-compress --pipeline-depth 1
+    python tests/bench_email_pipeline.py --latency 0.05 --attachment-size 4000000 --fetch-connections 1
+
+默认不写数据库（入库阶段只统计行数），--db 时使用真实的BLL写入数据库。
+送货单涉及ERP界面操作，压测中只计数不录入。
+有邮件处理失败、或合成的供应商邮件没有全部处理时以非零状态退出。
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.email_processor import EmailProcessor
+from infrastructure.attachment_store import AttachmentStore
+from infrastructure.message_ledger import MessageLedger
+from infrastructure.mail_cache import MailCache
+from imap_stub_server import NOISE_SENDER, ImapStubServer, build_synthetic_mailbox, load_mbox
+from test_email_client_stub import make_mailbox
+
+
+class RowCounter:
+    """代替BLL的入库阶段，只统计行数"""
+
+    def __init__(self):
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def update_supplier_progress(self, records: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.rows += len(records)
+
+
+def build_processor(mailbox: Dict[str, Any], args: argparse.Namespace, folder: str) -> EmailProcessor:
+    """创建连接替身服务器的邮件处理器"""
+    processor = EmailProcessor(mailboxes=[mailbox])
+    email_settings = processor.settings['features']['email_processor']
+    pipeline_settings = email_settings.setdefault('pipeline', {})
+    pipeline_settings['enabled'] = not args.no_pipeline
+    pipeline_settings['fetch_connections'] = args.fetch_connections
+    # 合成邮箱中同一供应商有多封进度表，默认全部处理以测量吞吐量
+    processor.coalesce_wip = args.coalesce
+    processor.attachment_store = AttachmentStore(Path(folder) / 'attachment_store.db') if args.dedup else None
+    processor.message_ledger = MessageLedger(Path(folder) / 'message_ledger.db') if args.dedup else None
+    processor.mail_cache = MailCache(Path(folder) / 'mail_cache') if args.cache else None
+    for client in processor.email_clients:
+        client.mail_cache = processor.mail_cache
+    if not args.db:
+        processor.wip_fab_bll = RowCounter()
+        processor.wip_assy_bll = RowCounter()
+        # 送货单只计数，不做解析和ERP录入
+        processor.delivery_notes = 0
+
+        def skip_delivery(match_result):
+            processor.delivery_notes += 1
+            return True
+
+        processor._process_delivery = skip_delivery
+    return processor
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """执行一次压测"""
+    if args.mbox:
+        messages = load_mbox(args.mbox)
+        # 录制的邮件不知道哪些应被处理，只检查失败数
+        expected = None
+    else:
+        messages = build_synthetic_mailbox(
+            args.count, args.attachment_size, args.noise_ratio, args.samples, args.seed
+        )
+        expected = sum(1 for raw in messages if NOISE_SENDER.encode() not in raw.split(b'\r\n\r\n', 1)[0])
+    mail_bytes = sum(len(raw) for raw in messages)
+
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages, latency=args.latency) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox.update({
+            'use_connection_pool': True,
+            'compress': not args.no_compress,
+            'pipeline_depth': args.pipeline_depth,
+        })
+        processor = build_processor(mailbox, args, folder)
+
+        started = time.perf_counter()
+        stats = processor.process_unread_emails()
+        wall = time.perf_counter() - started
+
+    mailbox_stats = next(iter(stats['mailboxes'].values()))
+    report = {
+        'messages': len(messages),
+        'mailbox_bytes': mail_bytes,
+        'wall_seconds': round(wall, 3),
+        'messages_per_second': round(len(messages) / wall, 2) if wall else None,
+        'bytes_fetched': server.stats['bytes_sent'],
+        'body_bytes_fetched': server.stats['body_bytes'],
+        'bytes_sent': server.stats['bytes_received'],
+        'connections': server.stats['connections'],
+        'commands': {
+            key[len('command_'):]: value for key, value in sorted(server.stats.items()) if key.startswith('command_')
+        },
+        'processed': stats['processed'],
+        'failed': stats['failed'],
+        'duplicates': stats['duplicates'],
+        'superseded': stats['superseded'],
+        'attachments': stats['attachments'],
+        # 应处理但没有处理的合成邮件数（成功数已包含重复和被取代的邮件）
+        'unprocessed': max(expected - stats['processed'], 0) if expected is not None else None,
+        'sync_seconds': mailbox_stats.get('sync_seconds'),
+        'transfer': mailbox_stats.get('transfer', {}),
+        'stages': {
+            stage: {
+                'count': data['count'],
+                'mean_ms': round(data['seconds'] / data['count'] * 1000, 2) if data['count'] else 0.0,
+                'max_ms': round(data['max_seconds'] * 1000, 2),
+                'total_seconds': round(data['seconds'], 3),
+            }
+            for stage, data in mailbox_stats.get('stages', {}).items()
+        },
+    }
+    if not args.db:
+        report['rows_stored'] = processor.wip_fab_bll.rows + processor.wip_assy_bll.rows
+        report['delivery_notes'] = processor.delivery_notes
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """打印压测结果"""
+    print(f"邮件数: {report['messages']}  邮箱大小: {report['mailbox_bytes'] / 1024 / 1024:.2f}MB")
+    print(f"总耗时: {report['wall_seconds']:.3f}s  吞吐量: {report['messages_per_second']} 封/秒")
+    print(f"同步(搜索+邮件头匹配): {report['sync_seconds']}s")
+    print(
+        f"下载字节: {report['bytes_fetched']} (正文 {report['body_bytes_fetched']})  "
+        f"上行字节: {report['bytes_sent']}  连接数: {report['connections']}"
+    )
+    print("命令次数: " + ", ".join(f"{name} {count}" for name, count in report['commands'].items()))
+    transfer = report['transfer']
+    if transfer:
+        print(
+            f"解压后接收: {transfer['bytes_in']}  线上接收: {transfer['wire_in']}  "
+            f"压缩节省: {transfer['compression_saved_bytes']} 字节  "
+            f"流水线节省往返: {transfer['round_trips_saved']} 次(约 {transfer['pipeline_saved_seconds']}s)"
+        )
+    print(
+        f"成功 {report['processed']}  失败 {report['failed']}  重复 {report['duplicates']}  "
+        f"取代 {report['superseded']}  附件 {report['attachments']}"
+    )
+    if report['unprocessed']:
+        print(f"未处理的供应商邮件: {report['unprocessed']}")
+    if 'rows_stored' in report:
+        print(f"入库行数(未写数据库): {report['rows_stored']}  送货单(未录入): {report['delivery_notes']}")
+    if report['stages']:
+        print(f"{'阶段':<8}{'次数':>8}{'平均(ms)':>12}{'最大(ms)':>12}{'合计(s)':>10}")
+        for stage, data in report['stages'].items():
+            print(f"{stage:<8}{data['count']:>8}{data['mean_ms']:>12}{data['max_ms']:>12}{data['total_seconds']:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='邮件处理端到端压测（本地IMAP替身服务器）')
+    parser.add_argument('--count', type=int, default=100, help='合成邮件数量')
+    parser.add_argument('--attachment-size', type=int, default=200 * 1024, help='没有样本时的附件大小（字节）')
+    parser.add_argument('--noise-ratio', type=float, default=0.3, help='不匹配规则的干扰邮件比例')
+    parser.add_argument('--samples', help='录制的附件样本目录，文件名为规则名或供应商名')
+    parser.add_argument('--mbox', help='回放录制的mbox文件，代替合成邮件')
+    parser.add_argument('--seed', type=int, default=0, help='合成邮件的随机种子')
+    parser.add_argument('--db', action='store_true', help='入库阶段写入真实数据库')
+    parser.add_argument('--dedup', action='store_true', help='启用附件去重索引和已处理邮件台账')
+    parser.add_argument('--cache', action='store_true', help='启用本地邮件缓存（压缩保存，按部件下载的邮件只缓存邮件头和附件）')
+    parser.add_argument('--coalesce', action='store_true', help='同一供应商积压的进度表只处理最新一封')
+    parser.add_argument('--no-pipeline', action='store_true', help='关闭分阶段流水线，顺序处理')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟的网络往返延迟（秒）')
+    parser.add_argument('--no-compress', action='store_true', help='不协商COMPRESS=DEFLATE')
+    parser.add_argument('--pipeline-depth', type=int, default=4, help='按部件下载时的FETCH流水线深度，1为关闭')
+    parser.add_argument('--fetch-connections', type=int, default=3, help='每个邮箱并行下载的IMAP连接数')
+    parser.add_argument('--json', help='把结果写入JSON文件，便于对比回归')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report['failed'] or report['unprocessed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+规则引擎微基准
+用合成的邮件头语料（中英文主题、多收件人/抄送、通配符域名）对比逐条检查规则的原始匹配方式
+与编译后的规则集，输出吞吐量和单封邮件延迟的p99，并检查每条 subject_regex 的最坏耗时，
+发现可能灾难性回溯的正则
+
+用法（在项目根目录执行）:
+    python tests/bench_rule_engine.py
+    python tests/bench_rule_engine.py --synthetic-rules 500 --count 20000
+    python tests/bench_rule_engine.py --rules config/email_rules.yaml --synthetic-rules 0
+    python tests/bench_rule_engine.py --redos-threshold 0.05 --json result.json
+
+编译后的匹配结果与原始方式不一致时以非零状态退出；存在超过阈值的正则时同样以非零状态退出，
+可以在修改 email_rules.yaml 后作为检查运行
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from modules.email_processor.rules.engine import RuleEngine
+from utils.helpers import load_yaml, save_yaml
+
+# 合成语料用的主题片段
+SUBJECT_WORDS_ZH = ['晶圆', '进度表', '出货单', '测试报告', '封装', '月份', '华芯微', '日报', '周报', '回复', '转发']
+SUBJECT_WORDS_EN = ['WIP', 'Lot Status', 'Delivery Order', 'Daily Report', 'Wafer', 'FAB', 'RE:', 'FW:', 'HUAXIN']
+NOISE_DOMAINS = ['qq.com', '163.com', 'gmail.com', 'outlook.com', 'h-sun.com', 'sina.com.cn']
+OUR_DOMAIN = 'h-sun.com'
+# 检查正则时假设的主题最大长度（邮件头单行不超过998字符）
+SUBJECT_MAX_LENGTH = 1000
+
+
+def synthetic_rules(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """
+    生成合成规则：精确地址、*@域名和不能建索引的通配符发件人，中英文关键词，部分带主题正则
+    Args:
+        count: 规则数
+        rng: 随机数生成器
+    Returns:
+        规则列表（格式同 email_rules.yaml）
+    """
+    rules = []
+    for index in range(count):
+        domain = f"supplier{index}.com.cn"
+        kind = rng.random()
+        if kind < 0.5:
+            senders = [f"*@{domain}"]
+        elif kind < 0.8:
+            senders = [f"wip@{domain}", f"report@{domain}"]
+        else:
+            senders = [f"report?@*.supplier{index}.cn"]
+        conditions: Dict[str, Any] = {
+            'from_contains': senders,
+            'subject_contains': [f"供应商{index}进度表", f"Lot Status {index}"],
+        }
+        if rng.random() < 0.3:
+            conditions['to_contains'] = [f"*@{OUR_DOMAIN}"]
+        if rng.random() < 0.3:
+            conditions['subject_regex'] = rf"WIP{index}-\d{{8}}"
+        rules.append({
+            'name': f"合成规则-{index}",
+            'category': '晶圆进度表',
+            'supplier': f"供应商{index}",
+            'conditions': conditions,
+            'actions': {'save_attachment': True, 'mark_as_read': True,
+                        'attachment_folder': f"attachments/temp/晶圆进度表/供应商{index}"},
+            'enabled': rng.random() > 0.05,
+        })
+    return rules
+
+
+def _address(rng: random.Random, domain: str) -> str:
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) + '@' + domain
+
+
+def _sender_for(rule: Dict[str, Any], rng: random.Random) -> str:
+    """按规则的发件人条件构造一个能匹配的地址"""
+    patterns = rule['conditions'].get('from_contains') or [_address(rng, rng.choice(NOISE_DOMAINS))]
+    pattern = rng.choice(patterns)
+    return pattern.replace('*', 'mail').replace('?', str(rng.randint(0, 9)))
+
+
+def _noise_subject(rng: random.Random) -> str:
+    words = rng.choices(SUBJECT_WORDS_ZH, k=rng.randint(1, 4)) + rng.choices(SUBJECT_WORDS_EN, k=rng.randint(0, 3))
+    rng.shuffle(words)
+    return ' '.join(words) + f" {rng.randint(1, 99999)}"
+
+
+def synthetic_corpus(rules: List[Dict[str, Any]], count: int, match_ratio: float,
+                     rng: random.Random) -> List[Dict[str, Any]]:
+    """
+    生成合成邮件头语料
+    Args:
+        rules: 规则列表，部分邮件按某条规则构造以保证命中
+        count: 邮件数
+        match_ratio: 按规则构造的邮件比例，其余为干扰邮件（也可能偶然命中宽松的规则）
+        rng: 随机数生成器
+    Returns:
+        邮件数据字典列表（from/to/cc/subject）
+    """
+    targets = [rule for rule in rules if rule.get('conditions')]
+    emails = []
+    for uid in range(1, count + 1):
+        to = [_address(rng, OUR_DOMAIN) for _ in range(rng.randint(1, 4))]
+        cc = [_address(rng, rng.choice(NOISE_DOMAINS + [OUR_DOMAIN])) for _ in range(rng.randint(0, 5))]
+        if targets and rng.random() < match_ratio:
+            rule = rng.choice(targets)
+            conditions = rule['conditions']
+            subject = _noise_subject(rng)
+            if conditions.get('subject_contains'):
+                subject = f"{rng.choice(conditions['subject_contains'])} {subject}"
+            regex = conditions.get('subject_regex')
+            if regex and regex.startswith('WIP'):
+                subject += ' ' + regex.split('-')[0] + f"-{rng.randint(10 ** 7, 10 ** 8 - 1)}"
+            sender = _sender_for(rule, rng)
+        else:
+            subject = _noise_subject(rng)
+            sender = _address(rng, rng.choice(NOISE_DOMAINS))
+        emails.append({'id': str(uid), 'from': sender, 'to': to, 'cc': cc, 'subject': subject})
+    return emails
+
+
+def legacy_match(engine: RuleEngine, email_data: Dict[str, Any]) -> Optional[str]:
+    """原始匹配方式：按文件顺序逐条调用 check_rule_conditions"""
+    for rule in engine.rules.get('rules', []):
+        if rule.get('enabled', True) and engine.check_rule_conditions(email_data, rule):
+            return rule.get('name', 'unnamed_rule')
+    return None
+
+
+def compiled_match(engine: RuleEngine, email_data: Dict[str, Any]) -> Optional[str]:
+    """编译后的规则集"""
+    return engine.apply_rules(email_data).get('name')
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def time_matcher(matcher, engine: RuleEngine, emails: List[Dict[str, Any]], rules: int) -> Dict[str, Any]:
+    """
+    逐封计时
+    Returns:
+        吞吐量、规则检查速度（邮件数 x 启用规则数 / 秒）、p50/p99延迟和匹配结果
+    """
+    latencies = []
+    results = []
+    started = time.perf_counter()
+    for email_data in emails:
+        begin = time.perf_counter()
+        results.append(matcher(engine, email_data))
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 4),
+        'messages_per_second': round(len(emails) / elapsed) if elapsed else 0,
+        'rules_per_second': round(len(emails) * rules / elapsed) if elapsed else 0,
+        'p50_us': round(_percentile(latencies, 50) * 1e6, 2),
+        'p99_us': round(_percentile(latencies, 99) * 1e6, 2),
+        'results': results,
+    }
+
+
+def _adversarial_inputs(pattern: str) -> List[str]:
+    """
+    构造容易触发回溯的输入：正则中出现的字符（及数字、空格、字母）重复多次后接一个不匹配的字符。
+    短输入用于发现指数级回溯，长输入（按主题长度上限 SUBJECT_MAX_LENGTH）用于发现多项式级回溯
+    """
+    chars = {char for char in re.sub(r'\\[dDwWsS]', '', pattern) if char.isalnum() or char in ' -_.:@'}
+    chars.update('0a ')
+    inputs = []
+    for char in sorted(chars):
+        for length in (16, 24, 28, SUBJECT_MAX_LENGTH):
+            inputs.append(char * length + '\0!')
+    return inputs
+
+
+def _redos_worker(pattern: str, queue) -> None:
+    """子进程中计算正则在对抗输入上的最坏耗时"""
+    compiled = re.compile(pattern)
+    worst, worst_input = 0.0, ''
+    for text in _adversarial_inputs(pattern):
+        current = f"{text[0]!r} x {len(text) - 2}"
+        # 先报告正在检查的输入，超时时父进程据此给出触发回溯的输入
+        queue.put((worst, current))
+        started = time.perf_counter()
+        compiled.search(text)
+        elapsed = time.perf_counter() - started
+        if elapsed > worst:
+            worst, worst_input = elapsed, current
+    queue.put((worst, worst_input))
+
+
+def check_redos(pattern: str, threshold: float) -> Dict[str, Any]:
+    """
+    检查正则的最坏耗时，在子进程中运行，超时即判定为灾难性回溯
+    Args:
+        pattern: subject_regex
+        threshold: 单次匹配的耗时阈值（秒）
+    Returns:
+        {'pattern', 'worst_seconds', 'worst_input', 'flagged'}
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_redos_worker, args=(pattern, queue), daemon=True)
+    process.start()
+    process.join(max(threshold * 20, 2.0))
+    timed_out = process.is_alive()
+    if timed_out:
+        process.kill()
+        process.join()
+    worst, worst_input = 0.0, ''
+    while not queue.empty():
+        worst, worst_input = queue.get()
+    return {
+        'pattern': pattern,
+        'worst_seconds': None if timed_out else round(worst, 6),
+        'worst_input': worst_input,
+        'flagged': timed_out or worst > threshold,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """生成语料并对比两种匹配方式"""
+    rng = random.Random(args.seed)
+    rules = list((load_yaml(args.rules) or {}).get('rules', [])) if args.rules else []
+    rules += synthetic_rules(args.synthetic_rules, rng)
+    emails = synthetic_corpus(rules, args.count, args.match_ratio, rng)
+
+    with tempfile.TemporaryDirectory() as folder:
+        rules_file = Path(folder) / 'rules.yaml'
+        save_yaml({'rules': rules}, rules_file)
+        started = time.perf_counter()
+        engine = RuleEngine(str(rules_file))
+        load_seconds = time.perf_counter() - started
+
+    enabled = sum(1 for rule in rules if rule.get('enabled', True))
+    # 逐封的匹配日志会掩盖匹配本身的耗时
+    logging.disable(logging.INFO)
+    try:
+        legacy = time_matcher(legacy_match, engine, emails, enabled)
+        compiled = time_matcher(compiled_match, engine, emails, enabled)
+        started = time.perf_counter()
+        batch = engine.apply_rules_batch(emails)
+        batch_seconds = time.perf_counter() - started
+    finally:
+        logging.disable(logging.NOTSET)
+
+    mismatches = [
+        email_data['id'] for email_data, old, new in zip(emails, legacy.pop('results'), compiled['results'])
+        if old != new
+    ]
+    matched = sum(1 for name in compiled.pop('results') if name)
+    stats = engine.get_stats()
+    patterns = sorted({rule['conditions']['subject_regex'] for rule in rules
+                       if (rule.get('conditions') or {}).get('subject_regex')})
+    redos = [check_redos(pattern, args.redos_threshold) for pattern in patterns]
+    return {
+        'rules': len(rules),
+        'enabled_rules': enabled,
+        'unindexed_rules': len(engine._rule_set.always),
+        'keyword_states': engine._rule_set.keyword_matcher.size,
+        'messages': len(emails),
+        'matched': matched,
+        'load_seconds': round(load_seconds, 4),
+        'legacy': legacy,
+        'compiled': compiled,
+        'batch_seconds': round(batch_seconds, 4),
+        'speedup': round(legacy['seconds'] / compiled['seconds'], 2) if compiled['seconds'] else None,
+        'mismatches': mismatches,
+        'dead_rules': len(stats['dead_rules']),
+        'redos_threshold': args.redos_threshold,
+        'redos': redos,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """打印基准结果"""
+    print(
+        f"规则: {report['rules']} (启用 {report['enabled_rules']}, 无发件人索引 {report['unindexed_rules']}, "
+        f"关键词自动机状态 {report['keyword_states']})  编译耗时: {report['load_seconds']}s"
+    )
+    print(f"邮件: {report['messages']}  命中: {report['matched']}  当前版本未命中的规则: {report['dead_rules']}")
+    print(f"{'方式':<8}{'耗时(s)':>10}{'封/秒':>10}{'规则/秒':>14}{'p50(us)':>10}{'p99(us)':>10}")
+    for name in ('legacy', 'compiled'):
+        data = report[name]
+        print(
+            f"{name:<8}{data['seconds']:>10}{data['messages_per_second']:>10}{data['rules_per_second']:>14}"
+            f"{data['p50_us']:>10}{data['p99_us']:>10}"
+        )
+    print(f"批量匹配: {report['batch_seconds']}s  编译后加速: {report['speedup']}x")
+    if report['mismatches']:
+        print(f"匹配结果不一致: {len(report['mismatches'])} 封, UID {report['mismatches'][:10]}")
+    flagged = [item for item in report['redos'] if item['flagged']]
+    print(f"主题正则: {len(report['redos'])} 条, 超过 {report['redos_threshold']}s 的: {len(flagged)} 条")
+    for item in flagged:
+        worst = '超时' if item['worst_seconds'] is None else f"{item['worst_seconds']}s"
+        print(f"  可能灾难性回溯: {item['pattern']}  最坏 {worst}  输入 {item['worst_input']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='规则引擎微基准（原始匹配方式 vs 编译后的规则集）')
+    parser.add_argument('--rules', default='config/email_rules.yaml', help='真实规则文件，空字符串表示只用合成规则')
+    parser.add_argument('--synthetic-rules', type=int, default=200, help='追加的合成规则数')
+    parser.add_argument('--count', type=int, default=5000, help='合成邮件数')
+    parser.add_argument('--match-ratio', type=float, default=0.3, help='按规则构造的邮件比例')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--redos-threshold', type=float, default=0.1, help='单次正则匹配的最坏耗时阈值（秒）')
+    parser.add_argument('--json', help='把结果写入JSON文件，便于对比回归')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report['mismatches'] or any(item['flagged'] for item in report['redos']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
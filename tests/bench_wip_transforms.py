@@ -0,0 +1,200 @@
+"""
+晶圆厂WIP列运算基准
+用合成的WIP数据对比逐行 apply 的原实现与 wip_transforms 的向量化实现，
+输出每种运算的每行耗时并检查两者结果一致
+
+用法（在项目根目录执行）:
+    python tests/bench_wip_transforms.py
+    python tests/bench_wip_transforms.py --rows 200000 --repeat 5
+    python tests/bench_wip_transforms.py --json result.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from modules.file_processor.supplier import wip_transforms
+
+
+def synthetic_wip(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    生成合成WIP数据：约5%的层数缺失或为非数值，约10%的预计日期为HOLD/WH或无法解析
+    Args:
+        rows: 行数
+        seed: 随机种子
+    Returns:
+        原始格式的WIP数据（层数为字符串，layerRatio为 "当前/总数"）
+    """
+    rng = np.random.default_rng(seed)
+    layer_count = rng.integers(20, 40, rows)
+    remain = rng.integers(0, 20, rows)
+    current = layer_count - remain
+    layer_text = layer_count.astype(str).astype(object)
+    remain_text = remain.astype(str).astype(object)
+    missing = rng.random(rows) < 0.05
+    layer_text[missing] = None
+    remain_text[rng.random(rows) < 0.05] = "N/A"
+
+    ratio = np.char.add(np.char.add(current.astype(str), "/"), layer_count.astype(str)).astype(object)
+    ratio[missing] = None
+
+    dates = (pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")).strftime("%Y-%m-%d")
+    forecast = np.asarray(dates, dtype=object)
+    special = rng.random(rows)
+    forecast[special < 0.04] = "HOLD"
+    forecast[(special >= 0.04) & (special < 0.08)] = "WH"
+    forecast[(special >= 0.08) & (special < 0.10)] = "TBD"
+
+    status = np.where(rng.random(rows) < 0.1, "STOCK", "RUN").astype(object)
+    return pd.DataFrame({
+        "layerCount": layer_text,
+        "remainLayer": remain_text,
+        "layerRatio": ratio,
+        "forecastDate": forecast,
+        "status": status,
+    })
+
+
+# 原实现（各处理器中逐行 apply 的写法）；层数运算前各处理器已用 to_numeric 转换过
+def legacy_layer_difference(df: pd.DataFrame) -> pd.Series:
+    return df.apply(
+        lambda row: row["layerCount"] - row["remainLayer"]
+        if pd.notna(row["layerCount"]) and pd.notna(row["remainLayer"])
+        else None,
+        axis=1
+    )
+
+
+def legacy_offset_dates(df: pd.DataFrame) -> pd.Series:
+    dates = pd.to_datetime(df["forecastDate"], errors='coerce')
+    return dates.apply(lambda x: (x + pd.Timedelta(days=7)).date() if pd.notna(x) else pd.NaT)
+
+
+def legacy_split_ratio(df: pd.DataFrame) -> pd.DataFrame:
+    parts = df["layerRatio"].str.split("/", expand=True)
+    return pd.DataFrame({
+        "currentPosition": pd.to_numeric(parts[0], errors='coerce'),
+        "layerCount": pd.to_numeric(parts[1], errors='coerce'),
+    })
+
+
+def legacy_status_masks(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    hold_mask = df["forecastDate"].str.contains("HOLD", na=False)
+    wh_mask = df["forecastDate"].str.contains("WH", na=False)
+    df.loc[hold_mask, "status"] = df.loc[hold_mask, "forecastDate"]
+    df.loc[wh_mask, "status"] = "STOCK"
+    return df
+
+
+# 向量化实现
+def vector_layer_difference(df: pd.DataFrame) -> pd.Series:
+    return wip_transforms.layer_difference(df["layerCount"], df["remainLayer"])
+
+
+def vector_offset_dates(df: pd.DataFrame) -> pd.Series:
+    return wip_transforms.offset_dates(df["forecastDate"], 7)
+
+
+def vector_split_ratio(df: pd.DataFrame) -> pd.DataFrame:
+    current, total = wip_transforms.split_ratio(df["layerRatio"])
+    return pd.DataFrame({"currentPosition": current, "layerCount": total})
+
+
+def vector_status_masks(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    hold_mask = wip_transforms.contains_mask(df["forecastDate"], "HOLD")
+    wh_mask = wip_transforms.contains_mask(df["forecastDate"], "WH")
+    wip_transforms.rewrite_masked(df, hold_mask, {"status": df["forecastDate"]})
+    wip_transforms.rewrite_masked(df, wh_mask, {"status": "STOCK"})
+    return df
+
+
+OPERATIONS = {
+    "layer_difference": (legacy_layer_difference, vector_layer_difference),
+    "offset_dates": (legacy_offset_dates, vector_offset_dates),
+    "split_ratio": (legacy_split_ratio, vector_split_ratio),
+    "status_masks": (legacy_status_masks, vector_status_masks),
+}
+
+
+def _best_time(func: Callable[[pd.DataFrame], Any], df: pd.DataFrame, repeat: int):
+    """多次运行取最短耗时"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(df)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _same(legacy: Any, vector: Any) -> bool:
+    """比较结果，空值（None/NaN/NaT）视为相同"""
+    if isinstance(legacy, pd.DataFrame):
+        return all(_same(legacy[column], vector[column]) for column in legacy.columns)
+    legacy_null, vector_null = pd.isna(legacy), pd.isna(vector)
+    if not (legacy_null == vector_null).all():
+        return False
+    return bool((legacy[~legacy_null].astype(object) == vector[~vector_null].astype(object)).all())
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """逐项对比原实现与向量化实现"""
+    df = synthetic_wip(args.rows, args.seed)
+    numeric = df.copy()
+    wip_transforms.to_numeric(numeric, ["layerCount", "remainLayer"])
+    report: Dict[str, Any] = {"rows": args.rows, "operations": {}}
+    for name, (legacy_func, vector_func) in OPERATIONS.items():
+        data = numeric if name == "layer_difference" else df
+        legacy_seconds, legacy_result = _best_time(legacy_func, data, args.repeat)
+        vector_seconds, vector_result = _best_time(vector_func, data, args.repeat)
+        report["operations"][name] = {
+            "legacy_ns_per_row": round(legacy_seconds / args.rows * 1e9, 1),
+            "vector_ns_per_row": round(vector_seconds / args.rows * 1e9, 1),
+            "speedup": round(legacy_seconds / vector_seconds, 1) if vector_seconds else None,
+            "same_result": _same(legacy_result, vector_result),
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """打印基准结果"""
+    print(f"行数: {report['rows']}")
+    print(f"{'运算':<18}{'原实现(ns/行)':>16}{'向量化(ns/行)':>16}{'加速':>8}{'结果一致':>10}")
+    for name, data in report["operations"].items():
+        print(
+            f"{name:<18}{data['legacy_ns_per_row']:>16}{data['vector_ns_per_row']:>16}"
+            f"{data['speedup']:>8}{str(data['same_result']):>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='晶圆厂WIP列运算基准（逐行apply vs 向量化）')
+    parser.add_argument('--rows', type=int, default=50000, help='合成数据行数')
+    parser.add_argument('--repeat', type=int, default=3, help='每项运算的重复次数（取最短耗时）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--json', help='把结果写入JSON文件，便于对比回归')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not all(data["same_result"] for data in report["operations"].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
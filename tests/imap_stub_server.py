@@ -0,0 +1,851 @@
+"""
+本地IMAP替身服务器
+在本机端口上提供IMAP4rev1的一个子集，数据来自录制的mbox或合成的供应商邮件，
+用于在不连接真实邮箱的情况下测试和压测 EmailClient / EmailProcessor
+
+支持的命令: CAPABILITY LOGIN SELECT EXAMINE NOOP IDLE CLOSE LOGOUT COMPRESS
+           UID SEARCH / UID FETCH / UID STORE（及对应的非UID形式）
+可以模拟网络往返延迟：每条命令的响应在收到命令 latency 秒后才发出，
+连续发出的多条命令（流水线）的延迟相互重叠
+"""
+
+import email
+import email.header
+import email.utils
+import io
+import mailbox
+import queue
+import random
+import re
+import socketserver
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from email.message import EmailMessage, Message
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+# FETCH数据项
+_FETCH_ITEM_RE = re.compile(
+    rb'(BODY(?:\.PEEK)?)\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|(UID|FLAGS|BODYSTRUCTURE|RFC822\.SIZE|INTERNALDATE)',
+    re.I
+)
+# SEARCH条件的记号
+_SEARCH_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+# 合成邮件使用的主题，与 config/email_rules.yaml 中启用且有解析处理器的规则对应
+SAMPLE_SUBJECTS = {
+    '封装进度表-池州华宇': '苏州华芯微电子股份有限公司的封装产品进展表',
+    '封装进度表-山东汉旗': '华芯微WIP {date:%m%d}',
+    '晶圆进度表-力积电': '[PSMC Lot Status - 8"] HUAXIN {date:%Y%m%d}',
+    '晶圆进度表-上华FAB1': 'Your wafer report FAB1 {date:%Y-%m-%d}',
+    '晶圆进度表-上华FAB2': 'Your wafer report FAB2 {date:%Y-%m-%d}',
+    '晶圆进度表-荣芯': 'Rongsemi WIP&Stock {date:%Y%m%d}',
+}
+# 不匹配任何规则的干扰邮件主题和发件人
+NOISE_SUBJECTS = ['周报', 'Meeting notes', '系统通知', 'Newsletter', '报价单确认']
+NOISE_SENDER = 'noreply@example.com'
+# 进度表的列定义
+WIP_FIELDS_FILE = Path(__file__).resolve().parent.parent / 'config' / 'wip_fields.yaml'
+# 合成进度表每行在xlsx中大约占用的字节数，用于按附件大小估算行数
+WORKBOOK_ROW_BYTES = 60
+
+
+def _crlf(raw: bytes) -> bytes:
+    """统一为CRLF换行"""
+    return re.sub(rb'\r?\n', b'\r\n', raw)
+
+
+def _quote(value: Union[str, bytes, None]) -> bytes:
+    """IMAP字符串：可打印ASCII用双引号，其它使用字面量"""
+    if value is None:
+        return b'NIL'
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if re.fullmatch(rb'[\x20-\x7e]*', value) and b'"' not in value and b'\\' not in value:
+        return b'"' + value + b'"'
+    return b'{%d}\r\n' % len(value) + value
+
+
+def _split_message(raw: bytes) -> Tuple[bytes, bytes]:
+    """拆分为邮件头（含空行）和正文"""
+    index = raw.find(b'\r\n\r\n')
+    if index < 0:
+        return raw, b''
+    return raw[:index + 4], raw[index + 4:]
+
+
+def _header_fields(header: bytes, fields: List[bytes], exclude: bool = False) -> bytes:
+    """取出指定的邮件头字段（保留折行）"""
+    wanted = {field.lower() for field in fields}
+    lines = []
+    keep = False
+    for line in header.split(b'\r\n'):
+        if not line:
+            continue
+        if line[:1] in (b' ', b'\t'):
+            if keep:
+                lines.append(line)
+            continue
+        name = line.split(b':', 1)[0].strip().lower()
+        keep = (name in wanted) != exclude
+        if keep:
+            lines.append(line)
+    return b''.join(line + b'\r\n' for line in lines) + b'\r\n'
+
+
+def _encoded_body(part: Message) -> bytes:
+    """部件的传输编码后正文，即 BODY[n] 返回的内容"""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return part.as_bytes().split(b'\n\n', 1)[-1]
+    return _crlf(payload.encode('ascii', errors='surrogateescape'))
+
+
+def _params(part: Message, header: str) -> bytes:
+    """参数列表 ("NAME" "VALUE" ...)，RFC2231编码的值解码后以字面量发送"""
+    params = part.get_params(header=header) or []
+    items = []
+    for name, value in params[1:]:
+        if isinstance(value, tuple):
+            value = email.utils.collapse_rfc2231_value(value)
+        items.append(_quote(name.upper()) + b' ' + _quote(value))
+    return b'(' + b' '.join(items) + b')' if items else b'NIL'
+
+
+def _bodystructure(part: Message) -> bytes:
+    """根据邮件结构生成BODYSTRUCTURE"""
+    if part.is_multipart():
+        children = b''.join(_bodystructure(child) for child in part.get_payload())
+        boundary = part.get_boundary() or ''
+        return (b'(' + children + b' ' + _quote(part.get_content_subtype().upper())
+                + b' ("BOUNDARY" ' + _quote(boundary) + b') NIL NIL NIL)')
+
+    body = _encoded_body(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _params(part, 'content-type'),
+        _quote(part.get('Content-ID')),
+        b'NIL',
+        _quote((part.get('Content-Transfer-Encoding') or '7BIT').upper()),
+        str(len(body)).encode(),
+    ]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(body.count(b'\r\n')).encode())
+    disposition = part.get_content_disposition()
+    if disposition:
+        disposition_value = b'(' + _quote(disposition.upper()) + b' ' + _params(part, 'content-disposition') + b')'
+    else:
+        disposition_value = b'NIL'
+    fields.extend([b'NIL', disposition_value, b'NIL', b'NIL'])
+    return b'(' + b' '.join(fields) + b')'
+
+
+def _find_part(msg: Message, path: str) -> Optional[Message]:
+    """按部件编号(如 "2" / "1.2")查找部件"""
+    part = msg
+    for number in path.split('.'):
+        index = int(number) - 1
+        if part.is_multipart():
+            children = part.get_payload()
+            if index >= len(children):
+                return None
+            part = children[index]
+        elif index != 0:
+            return None
+    return part
+
+
+class StubMessage:
+    """服务器中的一封邮件"""
+
+    def __init__(self, uid: int, raw: bytes, flags: Optional[Set[bytes]] = None):
+        self.uid = uid
+        self.raw = _crlf(raw)
+        self.flags: Set[bytes] = set(flags or ())
+        self._parsed: Optional[Message] = None
+
+    @property
+    def parsed(self) -> Message:
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.raw)
+        return self._parsed
+
+    def section(self, spec: bytes) -> bytes:
+        """
+        取出 BODY[spec] 的内容
+        Args:
+            spec: 段说明，如 b'' / b'HEADER' / b'HEADER.FIELDS (FROM SUBJECT)' / b'TEXT' / b'2'
+        Returns:
+            段内容
+        """
+        header, text = _split_message(self.raw)
+        upper = spec.upper()
+        if not spec:
+            return self.raw
+        if upper == b'HEADER':
+            return header
+        if upper == b'TEXT':
+            return text
+        match = re.match(rb'HEADER\.FIELDS(\.NOT)?\s*\(([^)]*)\)', spec, re.I)
+        if match:
+            return _header_fields(header, match.group(2).split(), exclude=bool(match.group(1)))
+        if re.fullmatch(rb'[\d.]+', spec):
+            part = _find_part(self.parsed, spec.decode())
+            return _encoded_body(part) if part is not None else b''
+        return b''
+
+
+class _InflatingReader:
+    """COMPRESS=DEFLATE之后读取客户端数据"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.inflater = zlib.decompressobj(-15)
+        self.buffer = bytearray()
+
+    def _fill(self) -> bool:
+        chunk = self.raw.read1(65536)
+        if not chunk:
+            return False
+        self.buffer += self.inflater.decompress(chunk)
+        return True
+
+    def readline(self) -> bytes:
+        while b'\n' not in self.buffer and self._fill():
+            pass
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line
+
+    def read(self, size: int) -> bytes:
+        while len(self.buffer) < size and self._fill():
+            pass
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self) -> None:
+        self.raw.close()
+
+
+class _ImapHandler(socketserver.StreamRequestHandler):
+    """单个客户端连接"""
+
+    server: 'ImapStubServer'
+
+    def setup(self) -> None:
+        super().setup()
+        self.selected = False
+        self.readonly = False
+        self._write_lock = threading.Lock()
+        self._deflater = None
+        # 当前命令在字面量之外是否有8位字符
+        self.eight_bit = False
+        # 收到当前命令的时间，模拟延迟时响应在此之后 latency 秒发出
+        self._received_at = time.monotonic()
+        self._outbox: Optional[queue.Queue] = None
+        if self.server.latency:
+            self._outbox = queue.Queue()
+            threading.Thread(target=self._deliver, daemon=True).start()
+
+    def finish(self) -> None:
+        if self._outbox is not None:
+            self._outbox.put(None)
+            self._outbox.join()
+        super().finish()
+
+    def send(self, data: bytes) -> None:
+        with self._write_lock:
+            self.server.count('bytes_sent_uncompressed', len(data))
+            if self._deflater is not None:
+                data = self._deflater.compress(data) + self._deflater.flush(zlib.Z_SYNC_FLUSH)
+            self.server.count('bytes_sent', len(data))
+            if self._outbox is not None:
+                self._outbox.put((self._received_at + self.server.latency, data))
+                return
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def _deliver(self) -> None:
+        """按模拟延迟依次发出响应"""
+        while True:
+            item = self._outbox.get()
+            try:
+                if item is None:
+                    return
+                deliver_at, data = item
+                delay = deliver_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                pass
+            finally:
+                self._outbox.task_done()
+
+    def read_command(self) -> Optional[bytes]:
+        """
+        读取一条命令，处理客户端发送的字面量（{n} 及 LITERAL+ 的 {n+}）
+
+        字面量内容转为带引号字符串交给命令处理；字面量之外是否出现8位字符记录在 eight_bit 中
+        """
+        line = self.rfile.readline()
+        if not line:
+            return None
+        self._received_at = time.monotonic()
+        self.server.count('bytes_received', len(line))
+        line = line.rstrip(b'\r\n')
+        command = b''
+        self.eight_bit = False
+        while True:
+            self.eight_bit = self.eight_bit or not line.isascii()
+            match = re.search(rb'\{(\d+)(\+?)\}$', line)
+            if not match:
+                return command + line
+            if not match.group(2):
+                self.send(b'+ Ready for literal\r\n')
+            literal = self.rfile.read(int(match.group(1)))
+            rest = self.rfile.readline()
+            self.server.count('bytes_received', len(literal) + len(rest))
+            command += line[:match.start()] + b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+            line = rest.rstrip(b'\r\n')
+
+    def handle(self) -> None:
+        self.server.count('connections')
+        self.send(b'* OK [CAPABILITY ' + self.server.capability_line() + b'] IMAP stub ready\r\n')
+        while True:
+            try:
+                command = self.read_command()
+            except (OSError, ValueError):
+                return
+            if command is None:
+                return
+            parts = command.split(b' ', 2)
+            if len(parts) < 2:
+                self.send(b'* BAD invalid command\r\n')
+                continue
+            tag, name = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else b''
+            use_uid = False
+            if name == b'UID':
+                use_uid = True
+                sub = args.split(b' ', 1)
+                name = sub[0].upper()
+                args = sub[1] if len(sub) > 1 else b''
+            self.server.count(f"command_{'UID ' if use_uid else ''}{name.decode(errors='replace')}")
+            if self.eight_bit:
+                # 带引号字符串和原子只允许7位字符，8位内容必须用字面量发送
+                self.send(tag + b' BAD 8-bit data outside of a literal\r\n')
+                continue
+            try:
+                if self.dispatch(tag, name, args, use_uid) is False:
+                    return
+            except Exception as e:
+                self.send(tag + b' BAD ' + str(e).encode('utf-8', errors='replace') + b'\r\n')
+
+    def dispatch(self, tag: bytes, name: bytes, args: bytes, use_uid: bool) -> Optional[bool]:
+        """执行命令，返回False时关闭连接"""
+        if name == b'CAPABILITY':
+            self.send(b'* CAPABILITY ' + self.server.capability_line() + b'\r\n')
+        elif name == b'LOGIN':
+            pass
+        elif name in (b'SELECT', b'EXAMINE'):
+            self.selected = True
+            self.readonly = name == b'EXAMINE'
+            messages = self.server.snapshot()
+            self.send(
+                b'* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n'
+                + b'* %d EXISTS\r\n' % len(messages)
+                + b'* 0 RECENT\r\n'
+                + b'* OK [UIDVALIDITY %d] UIDs valid\r\n' % self.server.uidvalidity
+                + b'* OK [UIDNEXT %d] Predicted next UID\r\n' % self.server.next_uid
+            )
+            access = b'READ-ONLY' if self.readonly else b'READ-WRITE'
+            self.send(tag + b' OK [' + access + b'] ' + name + b' completed\r\n')
+            return None
+        elif name == b'NOOP':
+            pass
+        elif name == b'COMPRESS':
+            if 'COMPRESS=DEFLATE' not in self.server.capabilities or args.upper() != b'DEFLATE':
+                self.send(tag + b' NO compression not supported\r\n')
+                return None
+            # 确认响应不压缩，之后双向都经过raw deflate
+            self.send(tag + b' OK DEFLATE active\r\n')
+            self._deflater = zlib.compressobj(6, zlib.DEFLATED, -15)
+            self.rfile = _InflatingReader(self.rfile)
+            return None
+        elif name == b'CLOSE':
+            self.selected = False
+        elif name == b'LOGOUT':
+            self.send(b'* BYE logging out\r\n' + tag + b' OK LOGOUT completed\r\n')
+            return False
+        elif name == b'IDLE':
+            self.idle(tag)
+            return None
+        elif name == b'SEARCH':
+            self.search(args, use_uid)
+        elif name == b'FETCH':
+            self.fetch(args, use_uid)
+        elif name == b'STORE':
+            self.store(args, use_uid)
+        else:
+            self.send(tag + b' BAD unsupported command\r\n')
+            return None
+        self.send(tag + b' OK ' + name + b' completed\r\n')
+        return None
+
+    def idle(self, tag: bytes) -> None:
+        """IDLE：新邮件追加时推送EXISTS，收到DONE后结束"""
+        self.send(b'+ idling\r\n')
+        self.server.add_idler(self)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line or line.strip().upper() == b'DONE':
+                    break
+        finally:
+            self.server.remove_idler(self)
+        self.send(tag + b' OK IDLE terminated\r\n')
+
+    def _resolve(self, sequence: bytes, use_uid: bool) -> List[Tuple[int, StubMessage]]:
+        """把序列集合解析为 [(序号, 邮件)]"""
+        messages = self.server.snapshot()
+        if not messages:
+            return []
+        keys = [m.uid for m in messages] if use_uid else list(range(1, len(messages) + 1))
+        maximum = keys[-1]
+        wanted: Set[int] = set()
+        for item in sequence.split(b','):
+            if b':' in item:
+                start, end = item.split(b':', 1)
+                low = maximum if start == b'*' else int(start)
+                high = maximum if end == b'*' else int(end)
+                low, high = min(low, high), max(low, high)
+                wanted.update(k for k in keys if low <= k <= high)
+            else:
+                value = maximum if item == b'*' else int(item)
+                if value in keys:
+                    wanted.add(value)
+        return [(seq, m) for seq, (key, m) in enumerate(zip(keys, messages), 1) if key in wanted]
+
+    def search(self, args: bytes, use_uid: bool) -> None:
+        """SEARCH：支持 ALL/SEEN/UNSEEN/UID/SUBJECT/FROM/TO/CC/OR/NOT 及序列集合"""
+        tokens = list(self._search_tokens(args))
+        if len(tokens) >= 2 and tokens[0][0] == 'ATOM' and tokens[0][1].upper() == b'CHARSET':
+            if self.server.reject_charset:
+                raise ValueError('[BADCHARSET (US-ASCII)] charset not supported')
+            tokens = tokens[2:]
+        messages = self.server.snapshot()
+        result = []
+        for seq, message in enumerate(messages, 1):
+            # 多个搜索键之间为AND关系，每个键都要计算以推进位置
+            position = [0]
+            matched = True
+            while position[0] < len(tokens):
+                matched = self._evaluate(tokens, position, seq, message) and matched
+            if matched:
+                result.append(message.uid if use_uid else seq)
+        self.send(b'* SEARCH' + b''.join(b' %d' % value for value in result) + b'\r\n')
+
+    @staticmethod
+    def _search_tokens(args: bytes):
+        pos = 0
+        while pos < len(args):
+            match = _SEARCH_TOKEN_RE.match(args, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            lparen, rparen, quoted, atom = match.groups()
+            if lparen:
+                yield ('(', None)
+            elif rparen:
+                yield (')', None)
+            elif quoted is not None:
+                yield ('STR', re.sub(rb'\\(.)', rb'\1', quoted))
+            elif atom is not None:
+                yield ('ATOM', atom)
+
+    def _evaluate(self, tokens, position: List[int], seq: int, message: StubMessage) -> bool:
+        """计算一个搜索键"""
+        kind, value = tokens[position[0]]
+        position[0] += 1
+        if kind == '(':
+            matched = True
+            while position[0] < len(tokens) and tokens[position[0]][0] != ')':
+                matched = self._evaluate(tokens, position, seq, message) and matched
+            position[0] += 1
+            return matched
+        key = value.upper() if kind == 'ATOM' else value
+        if key == b'ALL':
+            return True
+        if key == b'SEEN':
+            return b'\\Seen' in message.flags
+        if key == b'UNSEEN':
+            return b'\\Seen' not in message.flags
+        if key == b'NOT':
+            return not self._evaluate(tokens, position, seq, message)
+        if key == b'OR':
+            left = self._evaluate(tokens, position, seq, message)
+            right = self._evaluate(tokens, position, seq, message)
+            return left or right
+        if key == b'UID':
+            sequence = tokens[position[0]][1]
+            position[0] += 1
+            return any(m is message for _, m in self._resolve(sequence, True))
+        if key in (b'SUBJECT', b'FROM', b'TO', b'CC'):
+            needle = tokens[position[0]][1]
+            position[0] += 1
+            header, _ = _split_message(message.raw)
+            field = email.message_from_bytes(_header_fields(header, [key])).get(key.decode(), '')
+            text = str(email.header.make_header(email.header.decode_header(field))) if field else ''
+            return needle.decode('utf-8', errors='ignore').lower() in text.lower()
+        if re.fullmatch(rb'[\d:*,]+', value or b''):
+            return any(s == seq for s, _ in self._resolve(value, False))
+        raise ValueError(f"unsupported search key {value!r}")
+
+    def fetch(self, args: bytes, use_uid: bool) -> None:
+        """FETCH：支持 UID/FLAGS/RFC822.SIZE/INTERNALDATE/BODYSTRUCTURE/BODY[section]<partial>"""
+        sequence, _, items = args.partition(b' ')
+        for seq, message in self._resolve(sequence, use_uid):
+            pieces = [b'UID %d' % message.uid]
+            for match in _FETCH_ITEM_RE.finditer(items):
+                body, section, offset, length, simple = match.groups()
+                if simple:
+                    simple = simple.upper()
+                    if simple == b'FLAGS':
+                        pieces.append(b'FLAGS (' + b' '.join(sorted(message.flags)) + b')')
+                    elif simple == b'RFC822.SIZE':
+                        pieces.append(b'RFC822.SIZE %d' % len(message.raw))
+                    elif simple == b'INTERNALDATE':
+                        pieces.append(b'INTERNALDATE "01-Jan-2024 00:00:00 +0800"')
+                    elif simple == b'BODYSTRUCTURE':
+                        pieces.append(b'BODYSTRUCTURE ' + _bodystructure(message.parsed))
+                    continue
+                if message.uid in self.server.fail_fetch and not section.upper().startswith(b'HEADER'):
+                    raise RuntimeError(f"simulated fetch failure for UID {message.uid}")
+                data = message.section(section)
+                name = b'BODY[' + section + b']'
+                if offset is not None:
+                    data = data[int(offset):int(offset) + int(length)]
+                    name += b'<' + offset + b'>'
+                pieces.append(name + b' {%d}\r\n' % len(data) + data)
+                self.server.count('body_bytes', len(data))
+                if body.upper() == b'BODY' and not self.readonly:
+                    message.flags.add(b'\\Seen')
+            self.send(b'* %d FETCH (' % seq + b' '.join(pieces) + b')\r\n')
+
+    def store(self, args: bytes, use_uid: bool) -> None:
+        """STORE：支持 FLAGS/+FLAGS/-FLAGS 及 .SILENT"""
+        sequence, operation, flags = args.split(b' ', 2)
+        flags = set(flags.strip(b'()').split())
+        operation = operation.upper()
+        for seq, message in self._resolve(sequence, use_uid):
+            with self.server.lock:
+                if operation.startswith(b'+'):
+                    message.flags |= flags
+                elif operation.startswith(b'-'):
+                    message.flags -= flags
+                else:
+                    message.flags = set(flags)
+            if not operation.endswith(b'.SILENT'):
+                self.send(b'* %d FETCH (UID %d FLAGS (%s))\r\n' % (seq, message.uid, b' '.join(sorted(message.flags))))
+
+
+class ImapStubServer(socketserver.ThreadingTCPServer):
+    """
+    本地IMAP替身服务器
+
+    用法:
+        with ImapStubServer(messages) as server:
+            config = server.client_config()  # 可直接用于 EmailClient 的配置项
+            ...
+            server.stats  # 收发字节数、各命令次数
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages: List[bytes], host: str = '127.0.0.1', port: int = 0,
+                 uidvalidity: int = 1,
+                 capabilities: Tuple[str, ...] = ('IMAP4rev1', 'IDLE', 'UIDPLUS', 'COMPRESS=DEFLATE'),
+                 latency: float = 0.0):
+        """
+        初始化服务器
+        Args:
+            messages: 原始邮件列表，UID从1开始依次分配
+            host: 监听地址
+            port: 监听端口，0为自动分配
+            uidvalidity: 文件夹的UIDVALIDITY
+            capabilities: 声明的服务器能力
+            latency: 模拟的网络往返延迟（秒）
+        """
+        super().__init__((host, port), _ImapHandler)
+        self.uidvalidity = uidvalidity
+        self.capabilities = capabilities
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.messages: List[StubMessage] = []
+        self.next_uid = 1
+        self.stats: Counter = Counter()
+        # 下载正文或附件部件时返回错误的UID（模拟服务器故障），邮件头仍可正常获取
+        self.fail_fetch: Set[int] = set()
+        # 为True时拒绝带CHARSET的SEARCH（模拟不支持UTF-8搜索的服务器）
+        self.reject_charset = False
+        self._idlers: List[_ImapHandler] = []
+        self._thread: Optional[threading.Thread] = None
+        for raw in messages:
+            self.append(raw)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def capability_line(self) -> bytes:
+        return ' '.join(self.capabilities).encode()
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+    def snapshot(self) -> List[StubMessage]:
+        with self.lock:
+            return list(self.messages)
+
+    def append(self, raw: bytes, flags: Optional[Set[bytes]] = None) -> int:
+        """
+        追加一封邮件，正在IDLE的连接会收到EXISTS通知
+        Returns:
+            新邮件的UID
+        """
+        with self.lock:
+            message = StubMessage(self.next_uid, raw, flags)
+            self.messages.append(message)
+            self.next_uid += 1
+            exists = len(self.messages)
+            idlers = list(self._idlers)
+        for handler in idlers:
+            try:
+                handler.send(b'* %d EXISTS\r\n' % exists)
+            except OSError:
+                pass
+        return message.uid
+
+    def add_idler(self, handler: _ImapHandler) -> None:
+        with self.lock:
+            self._idlers.append(handler)
+
+    def remove_idler(self, handler: _ImapHandler) -> None:
+        with self.lock:
+            if handler in self._idlers:
+                self._idlers.remove(handler)
+
+    def unseen_uids(self) -> List[int]:
+        return [m.uid for m in self.snapshot() if b'\\Seen' not in m.flags]
+
+    def client_config(self) -> Dict[str, Any]:
+        """EmailClient连接本服务器所需的配置项"""
+        return {
+            'imap_server': self.server_address[0],
+            'imap_port': self.port,
+            'use_ssl': False,
+            'email': 'stub@localhost',
+            'password': 'stub',
+        }
+
+    def start(self) -> 'ImapStubServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='imap_stub_server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'ImapStubServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.stop()
+        return False
+
+
+def load_mbox(path: Union[str, Path]) -> List[bytes]:
+    """
+    读取录制的mbox文件
+    Args:
+        path: mbox文件路径
+    Returns:
+        原始邮件列表
+    """
+    return [message.as_bytes() for message in mailbox.mbox(str(path))]
+
+
+def build_supplier_mail(subject: str, attachment: bytes, filename: str,
+                        sender: str = 'wip-report@supplier.example.com', date: Optional[datetime] = None) -> bytes:
+    """
+    构造一封带附件的供应商邮件
+    Args:
+        subject: 主题
+        attachment: 附件内容
+        filename: 附件文件名
+        sender: 发件人
+        date: 发送时间
+    Returns:
+        原始邮件
+    """
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = 'wxb1@h-sun.com'
+    msg['Subject'] = subject
+    msg['Date'] = email.utils.format_datetime(date or datetime.now())
+    msg['Message-ID'] = email.utils.make_msgid(domain='supplier.example.com')
+    msg.set_content('Dear Huaxin,\n\nPlease find the attached report.\n')
+    maintype, subtype = ('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    if filename.lower().endswith('.csv'):
+        maintype, subtype = 'text', 'csv'
+    msg.add_attachment(attachment, maintype=maintype, subtype=subtype, filename=filename)
+    return _crlf(msg.as_bytes())
+
+
+def _fab_rows(supplier: str, names: Dict[str, str], rows: int, rng: random.Random, start: datetime) -> List[Dict[str, Any]]:
+    """晶圆厂进度表的数据行（列名取自 wip_fields.yaml），少量行的预计日期为HOLD"""
+    data = []
+    for index in range(rows):
+        total = rng.randint(20, 40)
+        current = rng.randint(0, total)
+        values = {
+            'purchaseOrder': f"PO{rng.randint(100000, 999999)}",
+            'itemName': f"HX{rng.randint(1000, 9999)}",
+            'lot': f"{supplier[:2].upper()}{index:07d}",
+            'qty': rng.choice([12, 24, 25]),
+            'status': 'RUN',
+            'stage': f"M{rng.randint(1, 9)}",
+            # 上华的层数为 "当前/总数"
+            'layerCount': f"{current}/{total}" if supplier.startswith('上华') else total,
+            'remainLayer': total - current,
+            'forecastDate': 'HOLD' if rng.random() < 0.05
+            else (start + timedelta(days=rng.randint(1, 60))).strftime('%Y-%m-%d'),
+        }
+        data.append({column: values[field] for field, column in names.items()})
+    return data
+
+
+def _assy_rows(columns: Dict[str, str], rows: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """封装厂进度表的数据行：订单号加各工序数量，每行只有一个工序有数量"""
+    order_column, *stage_columns = columns
+    data = []
+    for _ in range(rows):
+        row: Dict[str, Any] = {column: 0 for column in stage_columns}
+        row[order_column] = f"PO{rng.randint(100000, 999999)}"
+        row[rng.choice(stage_columns)] = rng.randint(1000, 50000)
+        if '扣留信息(Hold)' in row:
+            row['扣留信息(Hold)'] = ''
+        data.append(row)
+    return data
+
+
+def build_wip_workbook(rule_name: str, rows: int = 20, seed: int = 0,
+                       date: Optional[datetime] = None) -> bytes:
+    """
+    生成可被对应供应商处理器解析的进度表（xlsx）
+
+    工作表名、表头所在行和列名与各处理器读取的格式一致（列名取自 config/wip_fields.yaml），
+    需要pandas和openpyxl
+
+    Args:
+        rule_name: SAMPLE_SUBJECTS 中的规则名，如 "晶圆进度表-上华FAB1"
+        rows: 数据行数
+        seed: 随机种子
+        date: 报表日期，预计日期在其后
+    Returns:
+        xlsx文件内容
+    """
+    import pandas as pd
+    from utils.helpers import load_yaml
+
+    rng = random.Random(f"{rule_name}:{seed}")
+    start = date or datetime(2024, 1, 1)
+    category, supplier = rule_name.split('-', 1)
+    fields = load_yaml(str(WIP_FIELDS_FILE))['wip_fields']
+    rows = max(rows, 1)
+    # 工作表名 -> (表头前的空行数, 数据)
+    sheets: Dict[str, Tuple[int, Any]] = {}
+    if category == '晶圆进度表':
+        config = fields['晶圆厂'][supplier]
+        data = pd.DataFrame(_fab_rows(supplier, config['names'], rows, rng, start))
+        sheet = {'上华FAB1': 'wip', '上华FAB2': 'wip', '荣芯': 'WIP Report'}.get(supplier, 'Sheet1')
+        sheets[sheet] = (config['header'], data)
+        if supplier == '荣芯':
+            sheets['Stock'] = (0, pd.DataFrame([{
+                'Customer\nDevice': f"HX{rng.randint(1000, 9999)}",
+                'Lot ID': f"RS{index:07d}",
+                'Qty': 25,
+                'Date': (start + timedelta(days=rng.randint(0, 10))).strftime('%Y-%m-%d'),
+            } for index in range(max(rows // 10, 1))]))
+    else:
+        columns = fields['封装厂'][supplier]['关键字段映射']
+        sheets['Sheet1'] = (0, pd.DataFrame(_assy_rows(columns, rows, rng)))
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for sheet, (header, data) in sheets.items():
+            data.to_excel(writer, sheet_name=sheet, startrow=header, index=False)
+    return buffer.getvalue()
+
+
+def build_synthetic_mailbox(count: int, attachment_size: int = 200 * 1024, noise_ratio: float = 0.3,
+                            samples_dir: Optional[Union[str, Path]] = None, seed: int = 0,
+                            workbooks: bool = True) -> List[bytes]:
+    """
+    生成合成的供应商邮件
+
+    进度表邮件的主题取自 SAMPLE_SUBJECTS，附件优先使用 samples_dir 中以规则名或供应商命名的
+    录制样本（如 "晶圆进度表-力积电.xlsx" / "力积电.csv"）；没有样本时生成可被处理器解析的进度表
+    （行数按附件大小估算），只测试传输时可以改用指定大小的随机内容
+
+    Args:
+        count: 邮件数量
+        attachment_size: 没有样本时的附件大小（字节，生成进度表时为近似值）
+        noise_ratio: 不匹配任何规则的干扰邮件比例
+        samples_dir: 录制的附件样本目录
+        seed: 随机种子
+        workbooks: 没有样本时是否生成真实的进度表（需要pandas和openpyxl），False时使用随机内容
+    Returns:
+        原始邮件列表
+    """
+    rng = random.Random(seed)
+    samples: Dict[str, Path] = {}
+    if samples_dir:
+        for path in Path(samples_dir).iterdir():
+            if path.is_file():
+                samples[path.stem] = path
+
+    rule_names = list(SAMPLE_SUBJECTS)
+    start = datetime(2024, 1, 1, 8, 0)
+    messages = []
+    for index in range(count):
+        date = start + timedelta(hours=index)
+        if rng.random() < noise_ratio:
+            payload = rng.randbytes(max(attachment_size // 10, 16))
+            messages.append(build_supplier_mail(
+                rng.choice(NOISE_SUBJECTS), payload, f"notice_{index}.pdf", sender=NOISE_SENDER, date=date
+            ))
+            continue
+        rule_name = rule_names[index % len(rule_names)]
+        supplier = rule_name.split('-', 1)[1]
+        sample = samples.get(rule_name) or samples.get(supplier)
+        if sample is not None:
+            payload, filename = sample.read_bytes(), sample.name
+        elif workbooks:
+            payload = build_wip_workbook(rule_name, attachment_size // WORKBOOK_ROW_BYTES, seed + index, date)
+            filename = f"{supplier}_{index}.xlsx"
+        else:
+            payload, filename = rng.randbytes(attachment_size), f"{supplier}_{index}.xlsx"
+        messages.append(build_supplier_mail(SAMPLE_SUBJECTS[rule_name].format(date=date), payload, filename, date=date))
+    return messages
@@ -0,0 +1,86 @@
+import sys
+import os
+import logging
+import tempfile
+import zipfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.archive_extractor import ArchiveLimitError, expand_archives, extract_archive
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _make_zip(path: Path, members: dict) -> Path:
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return path
+
+def test_extract_matching_members():
+    """测试只解出符合模式的成员，目录被去掉，同名成员加序号"""
+    with tempfile.TemporaryDirectory() as folder:
+        archive = _make_zip(Path(folder) / 'map.zip', {
+            'lot1/A0003.xlsx': b'first',
+            'lot2/A0003.xlsx': b'second',
+            '../evil.csv': b'evil',
+            'lot1/wafer.map': b'map',
+            'lot1/': b'',
+        })
+        files = extract_archive(archive)
+        names = sorted(Path(file).name for file in files)
+        assert names == ['A0003.xlsx', 'A0003_1.xlsx', 'evil.csv']
+        assert all(Path(file).parent == Path(folder) / 'map' for file in files)
+        assert {Path(file).read_bytes() for file in files} == {b'first', b'second', b'evil'}
+
+def test_gbk_member_name():
+    """测试未设置UTF-8标志的GBK中文文件名"""
+    with tempfile.TemporaryDirectory() as folder:
+        path = _make_zip(Path(folder) / 'report.zip', {'XXXXXXXX.xlsx': b'data'})
+        # 模拟Windows压缩软件：文件名直接写GBK字节，不设置UTF-8标志
+        path.write_bytes(path.read_bytes().replace(b'XXXXXXXX', '测试报告'.encode('gbk')))
+        files = extract_archive(path)
+        assert [Path(file).name for file in files] == ['测试报告.xlsx']
+
+def test_limits():
+    """测试压缩比和大小限制，超过时已解出的文件被删除"""
+    with tempfile.TemporaryDirectory() as folder:
+        archive = _make_zip(Path(folder) / 'bomb.zip', {'a.csv': b'ok', 'b.csv': b'\0' * 1000000})
+        try:
+            extract_archive(archive, max_ratio=100)
+            assert False, "应当超过压缩比限制"
+        except ArchiveLimitError:
+            pass
+        assert not (Path(folder) / 'bomb' / 'a.csv').exists()
+
+        try:
+            extract_archive(archive, max_member_size=1000, max_ratio=10000)
+            assert False, "应当超过大小限制"
+        except ArchiveLimitError:
+            pass
+
+def test_expand_archives():
+    """测试匹配结果中的压缩包替换为解出的文件，失败的压缩包被丢弃"""
+    with tempfile.TemporaryDirectory() as folder:
+        good = _make_zip(Path(folder) / 'good.zip', {'r.xlsx': b'x', 'readme.txt': b'y'})
+        bad = _make_zip(Path(folder) / 'bad.zip', {'b.xlsx': b'\0' * 1000000})
+        plain = Path(folder) / 'plain.xls'
+        plain.write_bytes(b'z')
+        match_result = {
+            'category': '测试报告',
+            'actions': {'archive_members': ['*.xlsx']},
+            'attachments': [str(good), str(bad), str(plain)],
+        }
+        expanded = expand_archives(match_result)
+        assert expanded['attachments'] == [str(Path(folder) / 'good' / 'r.xlsx'), str(plain)]
+        assert match_result['attachments'][0] == str(good)
+    logger.info("压缩包解压测试通过")
+
+if __name__ == "__main__":
+    test_extract_matching_members()
+    test_gbk_member_name()
+    test_limits()
+    test_expand_archives()
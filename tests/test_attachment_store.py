@@ -0,0 +1,74 @@
+import sys
+import os
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infrastructure.attachment_store import AttachmentStore
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_dedup_lookup():
+    """测试记录与查询，重新打开后索引仍然有效"""
+    with tempfile.TemporaryDirectory() as folder:
+        attachment = Path(folder) / 'wip.xlsx'
+        attachment.write_bytes(b'wip data')
+        file_hash = AttachmentStore.file_hash(attachment)
+
+        store = AttachmentStore(Path(folder) / 'store.db')
+        assert not store.contains_all([file_hash])
+        assert not store.contains_all([])
+        store.add(file_hash, 'PSMC', '晶圆进度表', 'wip.xlsx', {'rows': 12})
+        store.close()
+
+        store = AttachmentStore(Path(folder) / 'store.db')
+        assert store.contains_all([file_hash])
+        record = store.get(file_hash)
+        assert record['supplier'] == 'PSMC'
+        assert record['stats'] == {'rows': 12}
+        # 下载时已计算的哈希优先
+        assert AttachmentStore.file_hash(attachment, {str(attachment): 'cached'}) == 'cached'
+        store.close()
+    logger.info("附件去重索引测试通过")
+
+def test_retention():
+    """测试按保留天数和条数清理"""
+    with tempfile.TemporaryDirectory() as folder:
+        store = AttachmentStore(Path(folder) / 'store.db', retention_days=1, max_entries=2)
+        for index in range(3):
+            store.add(f"hash{index}", 'RSMC', '晶圆进度表')
+        store._conn.execute("UPDATE attachments SET processed_at = ? WHERE hash = 'hash2'", (time.time() - 3 * 86400,))
+        store._conn.commit()
+        store.close()
+
+        store = AttachmentStore(Path(folder) / 'store.db', retention_days=1, max_entries=1)
+        assert store.contains('hash1') or store.contains('hash0')
+        assert not store.contains('hash2')
+        assert len(store._hashes) == 1
+        store.close()
+
+def test_shared_store():
+    """测试同一索引文件共用一个实例，close_all 后重新打开"""
+    with tempfile.TemporaryDirectory() as folder:
+        db_file = Path(folder) / 'store.db'
+        store = AttachmentStore.get_shared(db_file)
+        store.add('abc', 'PSMC', '晶圆进度表')
+        assert AttachmentStore.get_shared(str(db_file)) is store
+        assert AttachmentStore.get_shared(Path(folder) / '.' / 'store.db').contains('abc')
+
+        AttachmentStore.close_all()
+        reopened = AttachmentStore.get_shared(db_file)
+        assert reopened is not store and reopened.contains('abc')
+        AttachmentStore.close_all()
+    logger.info("共享附件索引测试通过")
+
+if __name__ == "__main__":
+    test_dedup_lookup()
+    test_retention()
+    test_shared_store()
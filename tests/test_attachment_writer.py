@@ -0,0 +1,61 @@
+import sys
+import os
+import base64
+import hashlib
+import logging
+import quopri
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.attachment_writer import AttachmentSizeError, StreamingAttachmentWriter
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _write_chunks(target: Path, encoded: bytes, encoding: str, chunk: int, max_size=None) -> StreamingAttachmentWriter:
+    with StreamingAttachmentWriter(target, encoding, max_size) as writer:
+        for start in range(0, len(encoded), chunk):
+            writer.write(encoded[start:start + chunk])
+    return writer
+
+def test_base64_stream():
+    """测试base64按块解码，块边界不对齐"""
+    data = os.urandom(100003)
+    with tempfile.TemporaryDirectory() as folder:
+        target = Path(folder) / 'a.xlsx'
+        writer = _write_chunks(target, base64.encodebytes(data), 'base64', 777)
+        assert target.read_bytes() == data
+        assert writer.size == len(data)
+        assert writer.hexdigest == hashlib.sha256(data).hexdigest()
+        assert os.listdir(folder) == ['a.xlsx']
+    logger.info("base64流式解码测试通过")
+
+def test_quoted_printable_stream():
+    """测试quoted-printable按块解码"""
+    data = '晶圆进度表=WIP '.encode('utf-8') * 3000
+    with tempfile.TemporaryDirectory() as folder:
+        target = Path(folder) / 'q.csv'
+        _write_chunks(target, quopri.encodestring(data), 'quoted-printable', 333)
+        assert target.read_bytes() == data
+
+def test_size_limit():
+    """测试超过大小限制时放弃写入并删除临时文件"""
+    data = os.urandom(5000)
+    with tempfile.TemporaryDirectory() as folder:
+        target = Path(folder) / 'big.xlsx'
+        try:
+            _write_chunks(target, base64.encodebytes(data), 'base64', 1000, max_size=4096)
+            assert False, "应抛出AttachmentSizeError"
+        except AttachmentSizeError:
+            pass
+        assert os.listdir(folder) == []
+    logger.info("大小限制测试通过")
+
+if __name__ == "__main__":
+    test_base64_stream()
+    test_quoted_printable_stream()
+    test_size_limit()
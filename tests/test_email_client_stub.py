@@ -0,0 +1,273 @@
+import sys
+import os
+import email
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from infrastructure.email_client import EmailClient, ImapConnectionPool
+from infrastructure.mail_cache import MailCache
+from modules.email_processor.rules.engine import RuleEngine
+from utils.helpers import load_yaml, save_yaml
+from imap_stub_server import ImapStubServer, build_supplier_mail, build_synthetic_mailbox
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def make_mailbox(server: ImapStubServer, folder: str) -> dict:
+    """连接替身服务器的邮箱配置，附件和检查点都写到临时目录"""
+    rules = load_yaml(os.path.join(ROOT, 'config/email_rules.yaml'))
+    for rule in rules['rules']:
+        rule['actions']['attachment_folder'] = str(Path(folder) / rule['actions']['attachment_folder'])
+    rules_file = Path(folder) / 'email_rules.yaml'
+    save_yaml(rules, rules_file)
+    mailbox = server.client_config()
+    mailbox.update({
+        'rules_file': str(rules_file),
+        'sync_state_file': str(Path(folder) / 'sync_state.json'),
+        'use_connection_pool': False,
+    })
+    return mailbox
+
+def test_sync_and_fetch():
+    """测试增量同步、邮件头匹配、按部件下载附件和批量标记已读"""
+    attachment = os.urandom(300000)
+    messages = build_synthetic_mailbox(6, attachment_size=1000, noise_ratio=0, workbooks=False)
+    messages.append(build_supplier_mail('Your wafer report FAB1 2024-05-01', attachment, '上华FAB1.xlsx'))
+    messages.append(build_supplier_mail('周报', b'noise', 'a.pdf'))
+
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), make_mailbox(server, folder))
+        client.connect()
+        try:
+            # 规则条件下推到SEARCH，干扰邮件不会出现在结果中
+            unread = client.get_unread_emails()
+            assert unread == [str(uid).encode() for uid in range(1, 8)]
+
+            matched = client.match_emails(unread)
+            assert [uid for uid, _ in matched] == unread
+            # 首轮匹配只下载邮件头
+            assert server.stats['body_bytes'] < 5000
+
+            uid, match_result = matched[-1]
+            result = client.process_email(uid, match_result)
+            assert result['supplier'] == '上华FAB1'
+            saved = Path(result['attachments'][0])
+            assert saved.read_bytes() == attachment
+
+            for uid, _ in matched:
+                client.queue_mark_as_read(uid)
+            assert client.commit_flags()
+            assert server.unseen_uids() == [8]
+            assert server.stats['command_UID STORE'] == 1
+
+            client.commit_sync(max(int(uid) for uid in unread))
+            server.append(build_supplier_mail('Rongsemi WIP&Stock 20240502', b'x' * 100, 'rsmc.xlsx'))
+            assert client.get_unread_emails() == [b'9']
+        finally:
+            client.disconnect()
+    logger.info("替身服务器端到端测试通过")
+
+def test_search_without_pushdown():
+    """测试关闭条件下推时搜索全部未读邮件"""
+    messages = build_synthetic_mailbox(4, attachment_size=100, noise_ratio=0, workbooks=False)
+    messages.append(build_supplier_mail('周报', b'noise', 'a.pdf'))
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox['search_pushdown'] = False
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), mailbox)
+        client.connect()
+        try:
+            assert client.get_unread_emails() == [b'1', b'2', b'3', b'4', b'5']
+        finally:
+            client.disconnect()
+
+def test_search_utf8_literals():
+    """测试中文关键词以字面量和 CHARSET UTF-8 下推，服务器支持 LITERAL+ 时一次发出"""
+    messages = [
+        build_supplier_mail('苏州华芯微电子股份有限公司的封装产品进展表', b'x' * 100, 'a.xlsx'),
+        build_supplier_mail('周报', b'noise', 'b.pdf'),
+        build_supplier_mail('Your wafer report FAB1 2024-05-01', b'x' * 100, 'c.xlsx'),
+    ]
+    for capabilities in (('IMAP4rev1',), ('IMAP4rev1', 'LITERAL+')):
+        with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages, capabilities=capabilities) as server:
+            client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), make_mailbox(server, folder))
+            client.connect()
+            try:
+                # 替身服务器拒绝字面量之外的8位字符，下推成功说明中文关键词以字面量发送
+                assert client.get_unread_emails() == [b'1', b'3']
+                assert not client._pushdown_unsupported
+                assert server.stats['command_UID SEARCH'] == 1
+            finally:
+                client.disconnect()
+    logger.info("UTF-8字面量搜索测试通过")
+
+def test_search_charset_fallback():
+    """测试服务器拒绝 CHARSET UTF-8 时退回只按UNSEEN搜索"""
+    messages = [
+        build_supplier_mail('苏州华芯微电子股份有限公司的封装产品进展表', b'x' * 100, 'a.xlsx'),
+        build_supplier_mail('周报', b'noise', 'b.pdf'),
+    ]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        server.reject_charset = True
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), make_mailbox(server, folder))
+        client.connect()
+        try:
+            assert client.get_unread_emails() == [b'1', b'2']
+            assert client._pushdown_unsupported
+            # 连接仍可用，之后直接按UNSEEN搜索
+            assert client.get_unread_emails() == [b'1', b'2']
+            assert server.stats['command_UID SEARCH'] == 3
+        finally:
+            client.disconnect()
+    logger.info("不支持UTF-8搜索时的回退测试通过")
+
+def test_compress_and_pipeline():
+    """测试压缩传输和流水线分段下载"""
+    # 可压缩的附件内容（实际的进度表是zip格式，base64编码本身也能压缩约四分之一）
+    attachment = b''.join(b'LOT%06d,WAFER,25,FAB1\n' % i for i in range(20000))
+    messages = [build_supplier_mail('Your wafer report FAB1 2024-05-01', attachment, '上华FAB1.xlsx')]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages, latency=0.01) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox.update({'fetch_chunk_size': 65536, 'pipeline_depth': 4})
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), mailbox)
+        client.connect()
+        try:
+            assert client.imap.compressed
+            matched = client.match_emails(client.get_unread_emails())
+            result = client.process_email(*matched[0])
+            assert Path(result['attachments'][0]).read_bytes() == attachment
+
+            transfer = client.transfer_stats()
+            assert transfer['compression_saved_bytes'] > 0
+            assert transfer['wire_in'] < transfer['bytes_in']
+            assert transfer['round_trips_saved'] > 0
+            assert server.stats['bytes_sent'] < server.stats['bytes_sent_uncompressed']
+        finally:
+            client.disconnect()
+    logger.info("压缩传输和流水线下载测试通过")
+
+def test_parallel_sessions():
+    """测试附加会话使用独立连接并行下载，连接池满时不再打开"""
+    messages = build_synthetic_mailbox(4, attachment_size=50000, noise_ratio=0, workbooks=False)
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages, latency=0.01) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox.update({'use_connection_pool': True, 'pool_size': 2})
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), mailbox)
+        client.connect()
+        session = client.open_session()
+        try:
+            assert session is not None and session.imap is not client.imap
+            # 连接池只有两个名额，第三个会话打不开
+            assert client.open_session() is None
+
+            matched = client.match_emails(client.get_unread_emails())
+            # 每个会话在自己的线程中下载一半邮件（同一连接不能被两个线程同时使用）
+            def download(email_client, items):
+                return [email_client.process_email(*item) for item in items]
+
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(download, client, matched[0::2]),
+                           executor.submit(download, session, matched[1::2])]
+                results = [result for future in futures for result in future.result()]
+            paths = {path for result in results for path in result['attachments']}
+            assert len(paths) == 4 and all(Path(path).stat().st_size > 0 for path in paths)
+        finally:
+            client.close_session(session)
+            client.disconnect()
+            ImapConnectionPool.close_all()
+        assert server.stats['connections'] == 2
+    logger.info("附加会话并行下载测试通过")
+
+def test_same_filename_attachments():
+    """测试两封邮件的同名附件并行下载时分别保存，互不覆盖"""
+    first, second = os.urandom(200000), os.urandom(200000)
+    messages = [build_supplier_mail('Your wafer report FAB1 2024-05-01', first, 'WIP.xlsx'),
+                build_supplier_mail('Your wafer report FAB1 2024-05-02', second, 'WIP.xlsx')]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages, latency=0.01) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox.update({'use_connection_pool': True, 'pool_size': 2, 'fetch_chunk_size': 16384})
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), mailbox)
+        client.connect()
+        session = client.open_session()
+        try:
+            matched = client.match_emails(client.get_unread_emails())
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(client.process_email, *matched[0]),
+                           executor.submit(session.process_email, *matched[1])]
+                results = [future.result() for future in futures]
+            paths = [Path(result['attachments'][0]) for result in results]
+            assert paths[0] != paths[1] and paths[0].name == paths[1].name == 'WIP.xlsx'
+            assert paths[0].read_bytes() == first and paths[1].read_bytes() == second
+            # 送货单处理器按 attachment_folder 读取附件，每封邮件的目录中只有自己的附件
+            for result, path in zip(results, paths):
+                assert Path(result['actions']['attachment_folder']) == path.parent
+            # 规则配置中的目录不变
+            rule = next(r for r in client.rule_engine.rules['rules'] if r['name'] == results[0]['name'])
+            assert Path(rule['actions']['attachment_folder']) == paths[0].parent.parent
+        finally:
+            client.close_session(session)
+            client.disconnect()
+            ImapConnectionPool.close_all()
+    logger.info("同名附件分目录保存测试通过")
+
+def test_cache_keeps_partial_fetch():
+    """测试开启邮件缓存时仍按部件下载，缓存中的附件与原附件一致"""
+    attachment = os.urandom(500000)
+    messages = [build_supplier_mail('Your wafer report FAB1 2024-05-01', attachment, '上华FAB1.xlsx')]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        client = EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), make_mailbox(server, folder))
+        client.mail_cache = MailCache(Path(folder) / 'mail_cache')
+        client.connect()
+        try:
+            matched = client.match_emails(client.get_unread_emails())
+            client.process_email(*matched[0])
+            # 附件只下载一次，没有为缓存整封下载
+            assert server.stats['body_bytes'] < len(messages[0]) * 1.2
+
+            cached = email.message_from_bytes(client.mail_cache.read(client.mail_cache.find()[0]))
+            parts = [part for part in cached.walk() if part.get('Content-Disposition')]
+            assert parts[0].get_payload(decode=True) == attachment
+        finally:
+            client.disconnect()
+            client.mail_cache.close()
+    logger.info("缓存不影响按部件下载测试通过")
+
+def test_rules_watcher_shared():
+    """测试同一规则文件的多个客户端共用一个监视线程，关闭后线程退出"""
+    def watchers():
+        return [thread for thread in threading.enumerate() if thread.name == 'rules-watcher']
+
+    # 先停止前面测试的客户端启动的监视线程
+    RuleEngine.close_all()
+    assert not watchers()
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer([]) as server:
+        mailbox = make_mailbox(server, folder)
+        mailbox.update({'rules_hot_reload': True, 'rules_reload_interval': 0.05})
+        # 调度器每次运行都会创建新的客户端
+        clients = [EmailClient(os.path.join(ROOT, 'config/email_config.yaml'), mailbox) for _ in range(5)]
+        assert all(client.rule_engine is clients[0].rule_engine for client in clients)
+        assert len(watchers()) == 1
+
+        RuleEngine.close_all()
+        assert not watchers()
+    logger.info("规则监视线程共享测试通过")
+
+if __name__ == "__main__":
+    test_sync_and_fetch()
+    test_search_without_pushdown()
+    test_search_utf8_literals()
+    test_search_charset_fallback()
+    test_compress_and_pipeline()
+    test_parallel_sessions()
+    test_same_filename_attachments()
+    test_cache_keeps_partial_fetch()
+    test_rules_watcher_shared()
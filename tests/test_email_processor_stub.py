@@ -0,0 +1,266 @@
+import sys
+import os
+import logging
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.email_pipeline import EmailPipeline
+from core.email_processor import EmailProcessor
+from infrastructure.attachment_store import AttachmentStore
+from utils.helpers import load_yaml, save_yaml
+from imap_stub_server import ImapStubServer, build_supplier_mail, build_wip_workbook
+from test_email_client_stub import make_mailbox
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def build_processor(server: ImapStubServer, folder: str, **mailbox_options) -> EmailProcessor:
+    """连接替身服务器的邮件处理器：不写数据库、不录入ERP、不使用缓存和台账"""
+    mailbox = make_mailbox(server, folder)
+    mailbox.update(mailbox_options)
+    processor = EmailProcessor(mailboxes=[mailbox])
+    processor.mail_cache = None
+    processor.attachment_store = None
+    processor.message_ledger = None
+    processor.coalesce_wip = False
+    for client in processor.email_clients:
+        client.mail_cache = None
+    return processor
+
+def enable_delivery_rule(processor: EmailProcessor, name: str = '封装送货单-池州华宇') -> None:
+    """启用临时规则文件中的送货单规则（默认配置中未启用）"""
+    client = processor.email_client
+    rules = load_yaml(client.config['rules_file'])
+    for rule in rules['rules']:
+        if rule['name'] == name:
+            rule['enabled'] = True
+    save_yaml(rules, client.config['rules_file'])
+    client.rule_engine.check_reload()
+
+def delivery_mail(number: int, attachment: bytes) -> bytes:
+    """池州华宇的送货单邮件"""
+    return build_supplier_mail(f'008 Delivery Order 202405010800{number:02d}', attachment, f'DO{number}.xlsx')
+
+def record_erp(processor: EmailProcessor, fail_ids=()) -> list:
+    """
+    用记录调用顺序的函数代替送货单的解析和E10录入
+    Returns:
+        按录入顺序排列的邮件UID，同时录入的数量超过1时记为 'overlap'
+    """
+    submitted = []
+    running = [0]
+    lock = threading.Lock()
+
+    def process_delivery(match_result):
+        with lock:
+            running[0] += 1
+            if running[0] > 1:
+                submitted.append('overlap')
+        time.sleep(0.02)
+        email_id = match_result['email_data']['id']
+        with lock:
+            running[0] -= 1
+            submitted.append(email_id)
+        if email_id in fail_ids:
+            return False
+        processor.remember_processed(match_result, {'dates': 1})
+        return True
+
+    processor._process_delivery = process_delivery
+    return submitted
+
+def run_pipeline(processor: EmailProcessor, fetch_connections: int = 1) -> dict:
+    """用分阶段流水线处理主邮箱（解析阶段使用线程池）"""
+    with EmailPipeline(processor, use_processes=False, fetch_connections=fetch_connections) as pipeline:
+        return processor.process_mailbox(processor.email_client, pipeline)
+
+def test_fetch_failure_keeps_checkpoint():
+    """测试下载失败的邮件记为失败：保持未读，检查点停在它之前"""
+    messages = [build_supplier_mail('周报', b'noise', 'a.pdf') for _ in range(3)]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        server.fail_fetch.add(2)
+        # 不做条件下推和邮件头首轮匹配，每封未读邮件都整封下载
+        processor = build_processor(server, folder, search_pushdown=False, header_first_pass=False)
+        client = processor.email_client
+        stats = processor.process_mailbox(client)
+        assert stats['failed'] == 1
+
+        checkpoint = client.sync_state.load(client.sync_key)
+        assert checkpoint['last_uid'] == 1
+        assert 2 in server.unseen_uids()
+
+        # 服务器恢复后下次运行重新处理该邮件
+        server.fail_fetch.clear()
+        stats = processor.process_mailbox(client)
+        assert stats['total'] == 2 and stats['failed'] == 0
+        assert client.sync_state.load(client.sync_key)['last_uid'] == 3
+    logger.info("下载失败不推进检查点测试通过")
+
+def test_attachment_failure_keeps_unread():
+    """测试附件部件下载失败时邮件不登记已读，检查点不越过它"""
+    messages = [build_supplier_mail('Your wafer report FAB1 2024-05-01', b'x' * 1000, '上华FAB1.xlsx')]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        # 邮件头和BODYSTRUCTURE正常，附件部件下载失败
+        server.fail_fetch.add(1)
+        processor = build_processor(server, folder)
+        client = processor.email_client
+        stats = processor.process_mailbox(client)
+        assert stats['failed'] == 1 and stats['processed'] == 0
+        assert server.unseen_uids() == [1]
+        assert server.stats['command_UID STORE'] == 0
+        checkpoint = client.sync_state.load(client.sync_key)
+        assert checkpoint is None or checkpoint['last_uid'] == 0
+    logger.info("附件下载失败保持未读测试通过")
+
+def test_superseded_wait_for_newest():
+    """测试被取代的进度表在最新一封处理成功后才登记已读，失败时保持未读"""
+    sent = datetime(2024, 5, 1, 8, 0)
+    messages = [build_supplier_mail(f'Your wafer report FAB1 2024-05-0{day}', b'x' * 100, 'WIP.xlsx',
+                                    date=sent + timedelta(days=day)) for day in range(1, 4)]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        processor = build_processor(server, folder)
+        processor.coalesce_wip = True
+        # 只验证登记顺序，下载后的解析入库视为成功
+        handled = []
+        processor.handle_match = lambda match_result, skip_duplicates=True: handled.append(match_result) or 'processed'
+        client = processor.email_client
+
+        # 最新一封下载失败，较早的两封不登记已读，检查点停在最早一封之前
+        server.fail_fetch.add(3)
+        stats = processor.process_mailbox(client)
+        assert stats['failed'] == 1 and stats['superseded'] == 0
+        assert server.unseen_uids() == [1, 2, 3]
+        checkpoint = client.sync_state.load(client.sync_key)
+        assert checkpoint is None or checkpoint['last_uid'] == 0
+
+        # 恢复后最新一封处理完成，较早的两封一并登记已读
+        server.fail_fetch.clear()
+        stats = processor.process_mailbox(client)
+        assert stats['failed'] == 0 and stats['superseded'] == 2
+        assert [result['email_data']['id'] for result in handled] == ['3']
+        assert server.unseen_uids() == []
+        assert client.sync_state.load(client.sync_key)['last_uid'] == 3
+    logger.info("被取代的进度表延后登记测试通过")
+
+class RowCounter:
+    """代替BLL的入库阶段，记录每次入库的行数"""
+
+    def __init__(self):
+        self.batches = []
+
+    def update_supplier_progress(self, records):
+        self.batches.append(len(records))
+
+def test_superseded_wait_for_stored():
+    """测试最新一封进度表没有可入库的附件时，较早的进度表不被丢弃，下次运行由其中最新的一封入库"""
+    sent = datetime(2024, 5, 1, 8, 0)
+    for use_pipeline in (False, True):
+        messages = [
+            build_supplier_mail(f'Your wafer report FAB1 2024-05-0{day}', build_wip_workbook('晶圆进度表-上华FAB1', day),
+                                f'FAB1_{day}.xlsx', date=sent + timedelta(days=day))
+            for day in (1, 2)
+        ]
+        # 最新一封只有不允许的附件类型，下载后没有附件
+        messages.append(build_supplier_mail('Your wafer report FAB1 2024-05-03', b'%PDF', 'FAB1.pdf',
+                                            date=sent + timedelta(days=3)))
+        # 另一个供应商的进度表，使候选邮件多于一封以走流水线
+        messages.append(build_supplier_mail('Your wafer report FAB2 2024-05-03', build_wip_workbook('晶圆进度表-上华FAB2', 3),
+                                            'FAB2.xlsx', date=sent + timedelta(days=3)))
+        with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+            processor = build_processor(server, folder)
+            processor.coalesce_wip = True
+            processor.wip_fab_bll = RowCounter()
+            client = processor.email_client
+            process = (lambda: run_pipeline(processor)) if use_pipeline else (lambda: processor.process_mailbox(client))
+
+            stats = process()
+            assert stats['superseded'] == 0 and stats['failed'] == 0
+            assert processor.wip_fab_bll.batches == [3]
+            # 最新一封已读，被它取代的两封保持未读，检查点停在它们之前
+            assert server.unseen_uids() == [1, 2]
+            checkpoint = client.sync_state.load(client.sync_key)
+            assert checkpoint is None or checkpoint['last_uid'] == 0
+
+            stats = process()
+            assert stats['superseded'] == 1 and stats['failed'] == 0
+            assert processor.wip_fab_bll.batches == [3, 2]
+            assert server.unseen_uids() == []
+            assert client.sync_state.load(client.sync_key)['last_uid'] == 2
+    logger.info("最新进度表未入库时保留较早进度表测试通过")
+
+def test_pipeline_erp_order():
+    """测试并行下载乱序完成时，同一供应商的送货单仍按UID顺序逐封录入ERP"""
+    messages = [delivery_mail(number, os.urandom(5000)) for number in range(1, 6)]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        processor = build_processor(server, folder, use_connection_pool=True)
+        enable_delivery_rule(processor)
+        submitted = record_erp(processor)
+        # 越靠前的邮件下载越慢，下载完成的顺序与UID顺序相反
+        fetch_candidate = processor.fetch_candidate
+
+        def slow_fetch(email_id, header_match, client):
+            time.sleep(0.05 * (6 - int(email_id)))
+            return fetch_candidate(email_id, header_match, client)
+
+        processor.fetch_candidate = slow_fetch
+        stats = run_pipeline(processor, fetch_connections=3)
+        assert stats['processed'] == 5 and stats['failed'] == 0
+        assert stats['fetch_connections'] > 1
+        assert submitted == ['1', '2', '3', '4', '5']
+        assert server.unseen_uids() == []
+    logger.info("流水线ERP录入顺序测试通过")
+
+def test_pipeline_skips_duplicates():
+    """测试附件内容已处理过的送货单不再录入ERP，并登记已读"""
+    attachment = os.urandom(5000)
+    messages = [delivery_mail(1, attachment), delivery_mail(2, os.urandom(5000))]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        processor = build_processor(server, folder)
+        processor.attachment_store = AttachmentStore(Path(folder) / 'attachment_store.db')
+        enable_delivery_rule(processor)
+        submitted = record_erp(processor)
+        stats = run_pipeline(processor)
+        assert stats['processed'] == 2 and stats['duplicates'] == 0
+        assert submitted == ['1', '2']
+
+        # 重发的送货单（附件相同）跳过，新的送货单正常录入
+        server.append(delivery_mail(3, attachment))
+        server.append(delivery_mail(4, os.urandom(5000)))
+        stats = run_pipeline(processor)
+        assert stats['processed'] == 2 and stats['duplicates'] == 1
+        assert submitted == ['1', '2', '4']
+        assert server.unseen_uids() == []
+    logger.info("流水线跳过重复附件测试通过")
+
+def test_pipeline_failure_keeps_unread():
+    """测试录入失败的送货单保持未读、检查点停在它之前，其后的送货单照常录入"""
+    messages = [delivery_mail(number, os.urandom(5000)) for number in range(1, 4)]
+    with tempfile.TemporaryDirectory() as folder, ImapStubServer(messages) as server:
+        processor = build_processor(server, folder)
+        enable_delivery_rule(processor)
+        submitted = record_erp(processor, fail_ids={'2'})
+        client = processor.email_client
+        stats = run_pipeline(processor)
+        assert stats['processed'] == 2 and stats['failed'] == 1
+        assert submitted == ['1', '2', '3']
+        assert server.unseen_uids() == [2]
+        assert client.sync_state.load(client.sync_key)['last_uid'] == 1
+    logger.info("流水线录入失败保持未读测试通过")
+
+if __name__ == "__main__":
+    test_fetch_failure_keeps_checkpoint()
+    test_attachment_failure_keeps_unread()
+    test_superseded_wait_for_newest()
+    test_superseded_wait_for_stored()
+    test_pipeline_erp_order()
+    test_pipeline_skips_duplicates()
+    test_pipeline_failure_keeps_unread()
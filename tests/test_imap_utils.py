@@ -0,0 +1,126 @@
+import sys
+import os
+import base64
+import logging
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.imap_utils import (
+    BodyPart, build_uid_set, chunk_uids, encode_folder_name, parse_bodystructure, parse_fetch_response, parse_fetch_section
+)
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_build_uid_set():
+    """测试UID集合压缩"""
+    assert build_uid_set([]) == ''
+    assert build_uid_set([b'7']) == '7'
+    assert build_uid_set([b'105', b'101', b'102', b'103', b'110']) == '101:103,105,110'
+    assert build_uid_set(['3', 3, b'4']) == '3:4'
+    logger.info("UID集合压缩测试通过")
+
+def test_chunk_uids():
+    """测试UID分批"""
+    uids = [str(i).encode() for i in range(5)]
+    assert chunk_uids(uids, 2) == [[b'0', b'1'], [b'2', b'3'], [b'4']]
+
+def test_encode_folder_name():
+    """测试文件夹名modified UTF-7编码"""
+    assert encode_folder_name('INBOX') == 'INBOX'
+    assert encode_folder_name('~peter/mail/台北/日本語') == '~peter/mail/&U,BTFw-/&ZeVnLIqe-'
+    assert encode_folder_name('A&B') == 'A&-B'
+    assert encode_folder_name('供应商 进度表') == '"&T5telFVG- &j9tepoho-"'
+
+def test_parse_fetch_response():
+    """测试UID FETCH响应解析"""
+    data = [
+        (b'1 (UID 101 BODY[HEADER.FIELDS (SUBJECT)] {14}', b'Subject: a\r\n\r\n'),
+        b')',
+        # UID出现在字面量之后
+        (b'2 (BODY[HEADER.FIELDS (SUBJECT)] {14}', b'Subject: b\r\n\r\n'),
+        b' UID 102)',
+    ]
+    result = parse_fetch_response(data)
+    assert [uid for uid, _, _ in result] == [b'101', b'102']
+    assert result[1][2] == b'Subject: b\r\n\r\n'
+    logger.info("FETCH响应解析测试通过")
+
+def test_parse_fetch_section():
+    """测试FETCH响应段说明解析"""
+    assert parse_fetch_section(b'1 (UID 101 BODY[2]<1048576> {1048576}') == (b'2', 1048576)
+    assert parse_fetch_section(b'1 (UID 101 BODY[1.2] {10}') == (b'1.2', 0)
+    assert parse_fetch_section(b'1 (UID 101 BODYSTRUCTURE (...))') is None
+
+def test_parse_bodystructure():
+    """测试BODYSTRUCTURE解析，包括字面量文件名和RFC2231编码文件名"""
+    data = [
+        (b'12 (UID 101 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64" 120 4 NIL NIL NIL)'
+         b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 300 5 NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "x") NIL NIL)'
+         b'("APPLICATION" "VND.MS-EXCEL" NIL NIL NIL "BASE64" 40000 NIL ("ATTACHMENT" ("FILENAME" {19}',
+         '进度表.xlsx'.encode('utf-8')),
+        b')) NIL NIL)("IMAGE" "PNG" NIL "<x>" NIL "BASE64" 5000 NIL ("INLINE" ("FILENAME*" "utf-8\'\'%E5%9B%BE.png")) NIL NIL)'
+        b' "MIXED" ("BOUNDARY" "y") NIL NIL))',
+        b'13 (UID 102 BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 100 NIL NIL NIL NIL))',
+    ]
+    result = parse_bodystructure(data)
+    parts = {part.part: part for part in result[b'101']}
+    assert set(parts) == {'1.1', '1.2', '2', '3'}
+    assert parts['2'].filename == '进度表.xlsx'
+    assert parts['2'].disposition == 'attachment'
+    assert parts['2'].decoded_size == 29228
+    assert parts['3'].filename == '图.png'
+    assert parts['1.1'].filename is None
+    assert result[b'102'][0].part == '1'
+    assert result[b'102'][0].filename == 'a.pdf'
+    logger.info("BODYSTRUCTURE解析测试通过")
+
+def test_decoded_size():
+    """测试base64部件解码后大小的估算不超过实际大小，最多少算几个字节"""
+    for length in (0, 1, 2, 57, 58, 1000, 30000, 1048576):
+        encoded = base64.encodebytes(os.urandom(length)).replace(b'\n', b'\r\n')
+        for size in (len(encoded), len(encoded) - 2):  # 最后一行有无CRLF
+            part = BodyPart(part='2', content_type='application/octet-stream', encoding='base64', size=size)
+            assert length - 4 <= part.decoded_size <= length, (length, size, part.decoded_size)
+
+def test_parse_forwarded_bodystructure():
+    """测试转发邮件(message/rfc822)中的附件按 N.M 编号收集"""
+    envelope = b'("Wed, 1 May 2024 08:00:00 +0800" "FW: WIP" NIL NIL NIL NIL NIL NIL NIL "<a@b>")'
+    forwarded = (
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 60000 ' + envelope +
+        b' (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 20 1 NIL NIL NIL)'
+        b'("APPLICATION" "VND.OPENXMLFORMATS-OFFICEDOCUMENT.SPREADSHEETML.SHEET" ("NAME" "wip.xlsx") NIL NIL "BASE64"'
+        b' 40000 NIL ("ATTACHMENT" ("FILENAME" "wip.xlsx")) NIL NIL) "MIXED" ("BOUNDARY" "z") NIL NIL)'
+        b' 800 NIL ("ATTACHMENT" ("FILENAME" "FW.eml")) NIL NIL)'
+    )
+    single = (
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 2000 ' + envelope +
+        b' ("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 1000 NIL NIL NIL NIL) 20 NIL NIL NIL NIL)'
+    )
+    data = [
+        b'1 (UID 201 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        + forwarded + b' "MIXED" ("BOUNDARY" "y") NIL NIL))',
+        b'2 (UID 202 BODYSTRUCTURE (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        + single + b' "MIXED" ("BOUNDARY" "w") NIL NIL))',
+    ]
+    result = parse_bodystructure(data)
+    parts = {part.part: part for part in result[b'201']}
+    assert set(parts) == {'1', '2.1', '2.2'}
+    assert parts['2.2'].filename == 'wip.xlsx'
+    assert parts['2.2'].disposition == 'attachment'
+    assert parts['2.1'].content_type == 'text/plain'
+    # 转发邮件的正文不是multipart时编号为 N.1
+    assert [(part.part, part.filename) for part in result[b'202']] == [('1', None), ('2.1', 'a.pdf')]
+    logger.info("转发邮件BODYSTRUCTURE解析测试通过")
+
+if __name__ == "__main__":
+    test_build_uid_set()
+    test_chunk_uids()
+    test_encode_folder_name()
+    test_parse_fetch_response()
+    test_parse_fetch_section()
+    test_parse_bodystructure()
+    test_decoded_size()
+    test_parse_forwarded_bodystructure()
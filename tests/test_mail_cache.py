@@ -0,0 +1,107 @@
+import sys
+import os
+import email
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from infrastructure.mail_cache import MailCache
+from imap_stub_server import build_supplier_mail
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def email_data_of(raw: bytes, uid: int) -> dict:
+    msg = email.message_from_bytes(raw)
+    return {
+        'id': str(uid),
+        'message_id': msg['Message-ID'],
+        'subject': msg['Subject'],
+        'date': msg['Date'],
+    }
+
+def test_store_and_find():
+    """测试缓存写入、去重、按供应商和日期查询以及读取原文"""
+    raw = build_supplier_mail('Your wafer report FAB1 2024-05-01', os.urandom(2000), '上华FAB1.xlsx')
+    other = build_supplier_mail('Rongsemi WIP&Stock 20240502', b'x' * 100, 'rsmc.xlsx')
+    with tempfile.TemporaryDirectory() as folder:
+        cache = MailCache(Path(folder) / 'cache')
+        match_result = {'supplier': '上华FAB1', 'category': '晶圆进度表'}
+        path = cache.store(raw, email_data_of(raw, 7), match_result, 'default')
+        assert path is not None and path.parent.name == 'cur'
+        # 同一封邮件只缓存一次
+        assert cache.store(raw, email_data_of(raw, 7), match_result, 'default') is None
+        cache.store(other, email_data_of(other, 8), {'supplier': '荣芯', 'category': '晶圆进度表'}, 'default')
+
+        entries = cache.find(supplier='上华FAB1')
+        assert [entry['uid'] for entry in entries] == [7]
+        assert cache.read(entries[0]) == raw
+        assert len(cache.find(category='晶圆进度表', since=time.time() - 3600)) == 2
+        assert cache.find(until=time.time() - 86400) == []
+        assert list((Path(folder) / 'cache' / 'tmp').iterdir()) == []
+        cache.close()
+    logger.info("本地邮件缓存测试通过")
+
+def test_store_parts():
+    """测试按部件缓存：邮件头加已保存的附件组成可重新解析的邮件"""
+    attachment = os.urandom(300000)
+    raw = build_supplier_mail('Your wafer report FAB1 2024-05-01', attachment, '上华FAB1.xlsx')
+    header = raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+    with tempfile.TemporaryDirectory() as folder:
+        saved = Path(folder) / '上华FAB1.xlsx'
+        saved.write_bytes(attachment)
+        cache = MailCache(Path(folder) / 'cache')
+        path = cache.store_parts(header, [saved], email_data_of(raw, 7), {'supplier': '上华FAB1'}, 'default')
+        assert path is not None
+        assert cache.store_parts(header, [saved], email_data_of(raw, 7), {'supplier': '上华FAB1'}) is None
+
+        msg = email.message_from_bytes(cache.read(cache.find(supplier='上华FAB1')[0]))
+        assert msg['Subject'] == 'Your wafer report FAB1 2024-05-01'
+        assert msg.get_content_type() == 'multipart/mixed'
+        parts = [part for part in msg.walk() if part.get('Content-Disposition')]
+        assert [part.get_filename() for part in parts] == ['上华FAB1.xlsx']
+        assert parts[0].get_payload(decode=True) == attachment
+        cache.close()
+    logger.info("按部件缓存测试通过")
+
+def test_retention():
+    """测试过期邮件连同文件一起清理"""
+    raw = build_supplier_mail('Lot Status', b'x' * 100, 'a.xlsx')
+    with tempfile.TemporaryDirectory() as folder:
+        cache = MailCache(Path(folder) / 'cache', retention_days=1)
+        path = cache.store(raw, email_data_of(raw, 1), {'supplier': 'PSMC'})
+        cache._conn.execute("UPDATE messages SET cached_at = ?", (time.time() - 3 * 86400,))
+        cache._conn.commit()
+        cache.close()
+
+        cache = MailCache(Path(folder) / 'cache', retention_days=1)
+        assert cache.find() == []
+        assert not path.exists()
+        cache.close()
+
+def test_shared_cache():
+    """测试同一缓存目录共用一个实例，close_all 后重新打开"""
+    raw = build_supplier_mail('Lot Status', b'x' * 100, 'a.xlsx')
+    with tempfile.TemporaryDirectory() as folder:
+        cache = MailCache.get_shared(Path(folder) / 'cache')
+        cache.store(raw, email_data_of(raw, 1), {'supplier': 'PSMC'})
+        assert MailCache.get_shared(str(Path(folder) / 'cache')) is cache
+
+        MailCache.close_all()
+        reopened = MailCache.get_shared(Path(folder) / 'cache')
+        assert reopened is not cache and len(reopened.find(supplier='PSMC')) == 1
+        MailCache.close_all()
+    logger.info("共享邮件缓存测试通过")
+
+if __name__ == "__main__":
+    test_store_and_find()
+    test_store_parts()
+    test_retention()
+    test_shared_cache()
@@ -0,0 +1,90 @@
+import sys
+import os
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infrastructure.message_ledger import MessageLedger
+from utils.bloom_filter import BloomFilter
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMAIL_DATA = {
+    'id': '101',
+    'message_id': '<20240501.1@psmc.com.tw>',
+    'from': 'wip@psmc.com.tw',
+    'subject': '[PSMC Lot Status - 8"] HUAXIN 2024-05-01',
+    'date': 'Wed, 01 May 2024 08:00:00 +0800',
+}
+
+def test_bloom_filter():
+    """测试布隆过滤器没有漏判，误判率接近设定值"""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    bloom.update(f"key{i}" for i in range(1000))
+    assert all(f"key{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    bloom.clear()
+    assert 'key1' not in bloom
+
+def test_message_key():
+    """测试台账键：优先Message-ID，缺失时使用发件人+主题+时间"""
+    assert MessageLedger.message_key(EMAIL_DATA) == 'mid:<20240501.1@psmc.com.tw>'
+    without_id = dict(EMAIL_DATA, message_id='')
+    assert MessageLedger.message_key(without_id).startswith('sha256:')
+    assert MessageLedger.message_key(dict(without_id, date='')) is None
+
+def test_record_and_forget():
+    """测试记录、重新打开后查询以及删除后重新处理"""
+    with tempfile.TemporaryDirectory() as folder:
+        key = MessageLedger.message_key(EMAIL_DATA)
+        ledger = MessageLedger(Path(folder) / 'ledger.db', capacity=10)
+        assert not ledger.contains(key)
+        assert ledger.stats['filtered'] == 1
+        ledger.record(key, EMAIL_DATA, 'PSMC', '晶圆进度表', ['abc'], {'rows': 3})
+        ledger.close()
+
+        ledger = MessageLedger(Path(folder) / 'ledger.db', capacity=10)
+        assert ledger.contains(key)
+        record = ledger.get(key)
+        assert record['supplier'] == 'PSMC'
+        assert record['attachment_hashes'] == ['abc']
+        assert [entry['key'] for entry in ledger.entries(supplier='PSMC')] == [key]
+        assert ledger.entries(since=time.time() + 60) == []
+
+        # 超出容量后自动扩容
+        for i in range(20):
+            ledger.record(f"mid:<{i}@x>", {'message_id': f"<{i}@x>"}, 'RSMC', '晶圆进度表')
+        assert ledger._filter.capacity >= 21
+        assert all(ledger.contains(f"mid:<{i}@x>") for i in range(20))
+
+        assert ledger.forget([key]) == 1
+        assert not ledger.contains(key)
+        ledger.close()
+    logger.info("已处理邮件台账测试通过")
+
+def test_shared_ledger():
+    """测试同一台账文件共用一个实例和布隆过滤器，close_all 后重新打开"""
+    with tempfile.TemporaryDirectory() as folder:
+        key = MessageLedger.message_key(EMAIL_DATA)
+        ledger = MessageLedger.get_shared(Path(folder) / 'ledger.db', capacity=10)
+        ledger.record(key, EMAIL_DATA, 'PSMC', '晶圆进度表')
+        assert MessageLedger.get_shared(str(Path(folder) / 'ledger.db')) is ledger
+
+        MessageLedger.close_all()
+        reopened = MessageLedger.get_shared(Path(folder) / 'ledger.db')
+        assert reopened is not ledger and reopened.contains(key)
+        MessageLedger.close_all()
+    logger.info("共享台账测试通过")
+
+if __name__ == "__main__":
+    test_bloom_filter()
+    test_message_key()
+    test_record_and_forget()
+    test_shared_ledger()
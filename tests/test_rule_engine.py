@@ -0,0 +1,198 @@
+import sys
+import os
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.email_processor.rules.engine import RuleEngine
+from modules.email_processor.rules.keyword_matcher import KeywordMatcher
+from utils.helpers import save_yaml
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def make_engine(rules):
+    """用临时规则文件创建规则引擎"""
+    folder = tempfile.mkdtemp()
+    rules_file = Path(folder) / 'rules.yaml'
+    save_yaml({'rules': rules}, rules_file)
+    return RuleEngine(str(rules_file))
+
+def rule(name, enabled=True, **conditions):
+    return {
+        'name': name,
+        'category': '晶圆进度表',
+        'supplier': name,
+        'conditions': conditions,
+        'actions': {'mark_as_read': True},
+        'enabled': enabled,
+    }
+
+def test_build_search_criteria():
+    """测试规则条件编译为IMAP SEARCH条件"""
+    engine = make_engine([
+        rule('a', subject_contains=['华芯微WIP']),
+        rule('b', subject_contains=['[PSMC Lot Status - 8"] HUAXIN', 'Lot'], from_contains=['*@psmc.com.tw']),
+        rule('c', enabled=False, subject_regex='.*'),
+    ])
+    criteria = engine.build_search_criteria()
+    # 中文关键词以字面量发送
+    assert criteria == (
+        'OR (SUBJECT {12}\r\n华芯微WIP) '
+        '(OR SUBJECT "[PSMC Lot Status - 8\\"] HUAXIN" SUBJECT "Lot" FROM "@psmc.com.tw")'
+    ).encode('utf-8')
+    logger.info("SEARCH条件编译测试通过")
+
+def test_unsupported_rule_disables_pushdown():
+    """测试存在无法下推的规则时不做服务器端过滤"""
+    engine = make_engine([
+        rule('a', subject_contains=['WIP']),
+        rule('b', subject_regex='Your wafer report FAB\\d'),
+    ])
+    assert engine.build_search_criteria() is None
+    # 配置文件中的 from/to/cc 不会被引擎检查，也不下推
+    engine = make_engine([rule('a', **{'from': ['x@y.com']})])
+    assert engine.build_search_criteria() is None
+
+def legacy_match(engine, email_data):
+    """逐条检查规则（编译前的匹配方式）"""
+    for item in engine.rules['rules']:
+        if item.get('enabled', True) and engine.check_rule_conditions(email_data, item):
+            return item['name']
+    return None
+
+def test_compiled_rules_match_legacy():
+    """测试编译后的规则集与逐条检查的匹配结果一致"""
+    engine = make_engine([
+        rule('psmc', from_contains=['*@PSMC.com.tw'], subject_contains=['Lot Status']),
+        rule('exact', from_contains=['wip@csmc.com', '*@hjtc.com'], to_contains=['*@h-sic.com']),
+        rule('off', enabled=False, from_contains=['*@psmc.com.tw']),
+        rule('glob', from_contains=['report?@*.cn'], subject_regex='FAB\\d'),
+        rule('cc', cc_contains=['boss@h-sic.com'], subject_contains=['WIP', '进度']),
+        rule('never', subject_contains=[]),
+        rule('any', subject_regex='^Re:'),
+    ])
+    rule_set = engine._rule_set
+    assert [rule_set.rules[i].rule['name'] for i in rule_set.always] == ['glob', 'cc', 'never', 'any']
+    assert rule_set.by_domain == {'psmc.com.tw': [0], 'hjtc.com': [1]}
+    assert rule_set.by_address == {'wip@csmc.com': [1]}
+
+    senders = ['a@psmc.com.tw', 'WIP@CSMC.com', 'x@hjtc.com', 'report1@abc.cn', 'other@qq.com', '', 'noat']
+    subjects = ['PSMC lot status', 'FAB2 WIP', 'Re: 进度', 'hello']
+    recipients = [[], ['ME@h-sic.com'], ['x@y.com', 'buyer@h-sic.com']]
+    for sender in senders:
+        for subject in subjects:
+            for to in recipients:
+                for cc in ([], ['boss@h-sic.com']):
+                    email_data = {'from': sender, 'to': to, 'cc': cc, 'subject': subject}
+                    result = engine.apply_rules(email_data)
+                    assert result.get('name') == legacy_match(engine, email_data), email_data
+    logger.info("规则编译测试通过")
+
+def test_apply_rules_batch():
+    """测试批量匹配与逐封匹配结果一致"""
+    engine = make_engine([
+        rule('off', enabled=False, subject_contains=['WIP']),
+        rule('psmc', from_contains=['*@psmc.com.tw']),
+        rule('wip', subject_contains=['WIP']),
+    ])
+    emails = [
+        {'from': 'a@psmc.com.tw', 'subject': 'WIP'},
+        {'from': 'b@csmc.com', 'subject': 'daily wip'},
+        {'from': 'c@qq.com', 'subject': 'hello'},
+    ]
+    assert list(engine.apply_rules_batch(emails)) == [1, 2, -1]
+    assert engine.match_batch(emails) == [engine.apply_rules(email_data) for email_data in emails]
+    assert list(engine.apply_rules_batch([])) == []
+
+def test_rule_stats():
+    """测试命中统计和按否决率重排条件，匹配结果不变"""
+    engine = make_engine([
+        rule('fab', from_contains=['*@csmc.com'], subject_regex='FAB\\d'),
+        rule('dead', subject_contains=['never']),
+        rule('all', from_contains=['*@csmc.com']),
+    ])
+    emails = [{'from': 'x@csmc.com', 'subject': 'FAB1' if i % 10 == 0 else 'daily'} for i in range(600)]
+    names = [result.get('name') for result in engine.match_batch(emails)]
+    assert names == [legacy_match(engine, email_data) for email_data in emails]
+
+    stats = engine.get_stats()
+    assert stats['version'] == 1 and stats['messages'] == 600
+    fab = stats['rules'][0]
+    assert fab['evaluated'] == 600 and fab['hits'] == 60 and fab['rejected'] == 540
+    # 发件人条件从不否决，主题正则被排到前面
+    assert fab['order'] == ['subject_regex', 'from_contains']
+    assert fab['conditions']['subject_regex']['rejected'] == 540
+    assert stats['dead_rules'] == ['dead']
+
+def test_keyword_matcher():
+    """测试关键词自动机与逐个子串检查的结果一致"""
+    rules = {
+        0: ['he', 'she'],
+        1: ['his', 'hers'],
+        2: ['WIP', '进度表'],
+        3: ['晶圆进度'],
+        4: ['Lot Status - 8"'],
+        5: ['', 'never'],
+    }
+    matcher = KeywordMatcher()
+    for index, keywords in rules.items():
+        matcher.add_rule(keywords, index)
+    matcher.build()
+    subjects = ['ushers', 'HIS wip', '华虹晶圆进度表', '晶圆进', '[PSMC lot status - 8"] HUAXIN', '', 'h']
+    for subject in subjects:
+        expected = {index for index, keywords in rules.items()
+                    if any(keyword.lower() in subject.lower() for keyword in keywords)}
+        assert matcher.scan(subject.lower()) == expected, subject
+    logger.info("关键词自动机测试通过")
+
+def test_hot_reload():
+    """测试规则文件修改后重新加载，校验失败时保留旧版本"""
+    engine = make_engine([rule('a', subject_contains=['WIP'])])
+    rules_file = engine.rules_file
+    email_data = {'from': 'x@csmc.com', 'subject': 'CSMC WIP 日报'}
+    assert engine.apply_rules(email_data)['name'] == 'a'
+    assert not engine.check_reload()
+
+    # 内容不变只更新修改时间不算新版本
+    os.utime(rules_file, ns=(0, 0))
+    assert not engine.check_reload()
+    assert engine.version == 1
+
+    save_yaml({'rules': [rule('b', from_contains=['*@csmc.com']), rule('a', subject_contains=['WIP'])]}, rules_file)
+    assert engine.check_reload()
+    assert engine.version == 2
+    assert engine.apply_rules(email_data)['name'] == 'b'
+
+    save_yaml({'rules': [rule('c', subject_regex='WIP(')]}, rules_file)
+    assert not engine.check_reload()
+    assert engine.version == 2
+    assert engine.reload_stats['failures'] == 1
+    assert engine.apply_rules(email_data)['name'] == 'b'
+
+    # 后台线程监视文件
+    engine.start_watching(0.01)
+    try:
+        save_yaml({'rules': [rule('d', subject_contains=['日报'])]}, rules_file)
+        deadline = time.time() + 5
+        while engine.version == 2 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        engine.stop_watching()
+    assert engine.version == 3
+    assert engine.apply_rules(email_data)['name'] == 'd'
+    logger.info("规则热加载测试通过")
+
+if __name__ == "__main__":
+    test_build_search_criteria()
+    test_unsupported_rule_disables_pushdown()
+    test_compiled_rules_match_legacy()
+    test_apply_rules_batch()
+    test_rule_stats()
+    test_keyword_matcher()
+    test_hot_reload()
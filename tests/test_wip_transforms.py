@@ -0,0 +1,59 @@
+import sys
+import os
+import logging
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.file_processor.supplier import wip_transforms
+
+# 设置基本的日志配置
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_layer_arithmetic():
+    """测试层数拆分与相减，空值和非数值得到NaN"""
+    current, total = wip_transforms.split_ratio(pd.Series(["12/30", None, "x/30", "7", 5]))
+    assert current.tolist()[:1] == [12] and total.tolist()[:1] == [30]
+    assert current.isna().tolist() == [False, True, True, False, True]
+    assert total.isna().tolist() == [False, True, False, True, True]
+
+    remain = wip_transforms.layer_difference(total, current)
+    assert remain.dtype == np.float64
+    assert remain.tolist()[0] == 18
+    assert remain.isna().tolist() == [False, True, True, True, True]
+
+def test_offset_dates():
+    """测试日期偏移，无法解析的值为NaT"""
+    dates = wip_transforms.offset_dates(pd.Series(["2025-01-30", "HOLD", None]), 7)
+    assert dates[0] == datetime.date(2025, 2, 6)
+    assert pd.isna(dates[1]) and pd.isna(dates[2])
+
+def test_status_rewrite():
+    """测试按状态改写行和清空层数"""
+    df = pd.DataFrame({
+        "forecastDate": ["2025-01-01", "HOLD-QA", "WH", None],
+        "status": ["RUN", "RUN", "RUN", "STOCK"],
+        "layerCount": [30.0, 30.0, 30.0, 30.0],
+        "remainLayer": [3.0, 3.0, 3.0, 3.0],
+        "currentPosition": [27.0, 27.0, 27.0, 27.0],
+    })
+    hold_mask = wip_transforms.contains_mask(df["forecastDate"], "HOLD")
+    wh_mask = wip_transforms.contains_mask(df["forecastDate"], "WH")
+    wip_transforms.rewrite_masked(df, hold_mask, {"status": df["forecastDate"]})
+    wip_transforms.rewrite_masked(df, wh_mask, {"status": "STOCK"})
+    assert df["status"].tolist() == ["RUN", "HOLD-QA", "STOCK", "STOCK"]
+
+    wip_transforms.clear_layers(df, wip_transforms.contains_mask(df["status"], "STOCK"))
+    assert df["layerCount"].dtype == np.float64
+    assert df["layerCount"].isna().tolist() == [False, False, True, True]
+    logger.info("WIP列运算测试通过")
+
+if __name__ == "__main__":
+    test_layer_arithmetic()
+    test_offset_dates()
+    test_status_rewrite()
@@ -0,0 +1,181 @@
+"""
+压缩包附件解压模块
+从已保存的zip/rar附件中只解出符合模式的成员，逐块流式写出，限制成员大小、总大小和压缩比
+"""
+
+import fnmatch
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from utils.logger import Logger
+from utils.attachment_writer import AttachmentSizeError, StreamingAttachmentWriter
+
+try:
+    # rar需要第三方库rarfile（以及系统中的unrar），未安装时rar附件跳过
+    import rarfile
+except ImportError:
+    rarfile = None
+
+# 支持解压的附件扩展名
+ARCHIVE_EXTENSIONS = ('.zip', '.rar')
+# 默认解出的成员
+DEFAULT_MEMBER_PATTERNS = ('*.xlsx', '*.xls', '*.csv')
+# 每次读出的解压数据大小
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArchiveLimitError(Exception):
+    """压缩包超过解压限制（疑似压缩炸弹）"""
+    pass
+
+
+def is_archive(path: Union[str, Path]) -> bool:
+    """是否为支持解压的压缩包"""
+    return Path(path).suffix.lower() in ARCHIVE_EXTENSIONS
+
+
+def _member_name(info) -> str:
+    """
+    成员的文件名（去掉目录，防止路径穿越）
+
+    Windows压缩软件写入的中文文件名通常是GBK编码且未设置UTF-8标志，zipfile会按cp437解码，这里还原
+    """
+    name = info.filename
+    if isinstance(info, zipfile.ZipInfo) and not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('gbk')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+def _is_encrypted(info) -> bool:
+    """成员是否加密"""
+    if isinstance(info, zipfile.ZipInfo):
+        return bool(info.flag_bits & 0x1)
+    return info.needs_password()
+
+
+def _open_archive(path: Path):
+    """按扩展名打开压缩包"""
+    if path.suffix.lower() == '.zip':
+        return zipfile.ZipFile(path)
+    if rarfile is None:
+        raise ImportError("未安装rarfile，无法解压rar附件")
+    return rarfile.RarFile(path)
+
+
+def extract_archive(path: Union[str, Path], dest: Optional[Union[str, Path]] = None,
+                    patterns: Iterable[str] = DEFAULT_MEMBER_PATTERNS,
+                    max_member_size: int = 200 * 1024 * 1024,
+                    max_total_size: int = 1024 * 1024 * 1024,
+                    max_ratio: float = 100.0,
+                    max_members: int = 1000) -> List[str]:
+    """
+    从压缩包中解出符合模式的成员
+
+    只读取中央目录和需要的成员，成员内容逐块解压写入临时文件，完成后原子改名；
+    大小和压缩比按实际解出的字节数检查，不信任压缩包中声明的大小。
+    加密成员跳过，解出的压缩包不会再次解压
+
+    Args:
+        path: 压缩包路径
+        dest: 解压目录，默认为压缩包所在目录下与压缩包同名的文件夹
+        patterns: 成员文件名模式（不区分大小写）
+        max_member_size: 单个成员解压后的最大字节数
+        max_total_size: 所有成员解压后的最大字节数
+        max_ratio: 成员解压后大小与压缩后大小的最大比值
+        max_members: 压缩包中的最大成员数
+    Returns:
+        解出的文件路径列表
+    Raises:
+        ArchiveLimitError: 超过解压限制，已解出的文件会被删除
+        ImportError: rar附件但未安装rarfile
+    """
+    path = Path(path)
+    dest = Path(dest) if dest else path.with_name(path.stem)
+    patterns = [pattern.lower() for pattern in patterns]
+    extracted: List[str] = []
+    total = 0
+    try:
+        with _open_archive(path) as archive:
+            members = archive.infolist()
+            if len(members) > max_members:
+                raise ArchiveLimitError(f"压缩包成员过多: {path.name} ({len(members)} 个)")
+            for info in members:
+                if info.is_dir():
+                    continue
+                name = _member_name(info)
+                if not any(fnmatch.fnmatch(name.lower(), pattern) for pattern in patterns):
+                    continue
+                if _is_encrypted(info):
+                    continue
+                # 不同目录下的同名成员解到同一目录时加序号区分
+                target = dest / name
+                index = 1
+                while str(target) in extracted:
+                    target = dest / f"{Path(name).stem}_{index}{Path(name).suffix}"
+                    index += 1
+                limit = min(max_member_size, max_total_size - total)
+                if info.file_size > limit:
+                    raise ArchiveLimitError(f"压缩包成员超过大小限制: {path.name}/{name} ({info.file_size} 字节)")
+                ratio_limit = max_ratio * max(info.compress_size, 1)
+                written = 0
+                try:
+                    with archive.open(info) as source, StreamingAttachmentWriter(target, max_size=limit) as writer:
+                        while True:
+                            chunk = source.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            written += len(chunk)
+                            if written > ratio_limit:
+                                raise ArchiveLimitError(f"压缩包成员压缩比过高: {path.name}/{name}")
+                            writer.write(chunk)
+                except AttachmentSizeError as e:
+                    raise ArchiveLimitError(str(e)) from e
+                total += written
+                extracted.append(str(target))
+    except Exception:
+        for file in extracted:
+            Path(file).unlink(missing_ok=True)
+        raise
+    return extracted
+
+
+def expand_archives(match_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把匹配结果中的压缩包附件替换为解出的文件
+
+    规则的 actions 中可配置 archive_members（成员文件名模式）、max_archive_member_size、
+    max_archive_total_size、max_archive_ratio；解压失败或超过限制的压缩包丢弃，不影响其他附件
+
+    Args:
+        match_result: 规则引擎匹配结果（含attachments）
+    Returns:
+        附件列表已展开的匹配结果（副本），没有压缩包时原样返回
+    """
+    attachments = match_result.get('attachments', [])
+    if not any(is_archive(path) for path in attachments):
+        return match_result
+    logger = Logger(__name__)
+    actions = match_result.get('actions', {})
+    limits = {
+        'patterns': actions.get('archive_members', DEFAULT_MEMBER_PATTERNS),
+        'max_member_size': actions.get('max_archive_member_size', 200 * 1024 * 1024),
+        'max_total_size': actions.get('max_archive_total_size', 1024 * 1024 * 1024),
+        'max_ratio': actions.get('max_archive_ratio', 100.0),
+    }
+    expanded = []
+    for path in attachments:
+        if not is_archive(path):
+            expanded.append(path)
+            continue
+        try:
+            files = extract_archive(path, **limits)
+        except Exception as e:
+            logger.error(f"解压附件失败: {Path(path).name}: {str(e)}")
+            continue
+        logger.info(f"已解压附件 {Path(path).name}: {len(files)} 个文件")
+        expanded.extend(files)
+    return dict(match_result, attachments=expanded)
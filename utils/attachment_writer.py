@@ -0,0 +1,133 @@
+"""
+附件流式写入模块
+按块解码附件内容并写入临时文件，写入过程中限制大小、计算哈希，完成后原子重命名
+"""
+
+import binascii
+import hashlib
+import os
+import quopri
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+# 不属于base64字母表的空白字符
+_BASE64_WHITESPACE = b' \t\r\n'
+
+
+class AttachmentSizeError(Exception):
+    """附件超过大小限制"""
+    pass
+
+
+class StreamingAttachmentWriter:
+    """
+    流式附件写入器
+
+    用法:
+        with StreamingAttachmentWriter(path, 'base64', max_size) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        writer.hexdigest  # 解码后内容的哈希
+
+    内存中只保留一个块和不足一个解码单元的余量；异常退出时删除临时文件，
+    目标文件只会以完整内容出现
+    """
+
+    def __init__(self, target: Union[str, Path], encoding: Optional[str] = None,
+                 max_size: Optional[int] = None, hash_algorithm: str = 'sha256'):
+        """
+        初始化写入器
+        Args:
+            target: 目标文件路径
+            encoding: 传输编码（base64/quoted-printable/7bit/8bit/binary）
+            max_size: 解码后的最大字节数，None表示不限制
+            hash_algorithm: 哈希算法
+        """
+        self.target = Path(target)
+        self.encoding = (encoding or '').strip().lower()
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.new(hash_algorithm)
+        self._carry = b''
+        self._file = None
+        self._temp_path: Optional[Path] = None
+
+    @property
+    def hexdigest(self) -> str:
+        """已写入内容的哈希值"""
+        return self._hash.hexdigest()
+
+    def __enter__(self) -> 'StreamingAttachmentWriter':
+        self.target.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=self.target.parent, prefix='.', suffix='.part')
+        self._file = os.fdopen(fd, 'wb')
+        self._temp_path = Path(temp_name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self._commit()
+        else:
+            self._abort()
+        return False
+
+    def write(self, chunk: Union[bytes, str]) -> None:
+        """
+        写入一块编码后的内容
+        Args:
+            chunk: 编码后的内容
+        Raises:
+            AttachmentSizeError: 解码后超过大小限制
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii', errors='ignore')
+        if self.encoding == 'base64':
+            data = self._carry + chunk.translate(None, _BASE64_WHITESPACE)
+            usable = len(data) - len(data) % 4
+            self._carry = data[usable:]
+            self._emit(binascii.a2b_base64(data[:usable]) if usable else b'')
+        elif self.encoding == 'quoted-printable':
+            # 只解码完整的行，软换行"=\r\n"不会被截断
+            data = self._carry + chunk
+            cut = data.rfind(b'\n') + 1
+            self._carry = data[cut:]
+            self._emit(quopri.decodestring(data[:cut]) if cut else b'')
+        else:
+            self._emit(chunk)
+
+    def _emit(self, data: bytes) -> None:
+        """写出解码后的内容"""
+        if not data:
+            return
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise AttachmentSizeError(f"附件超过大小限制 {self.max_size} 字节: {self.target.name}")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def _commit(self) -> None:
+        """写出剩余内容并原子替换目标文件"""
+        try:
+            if self._carry:
+                if self.encoding == 'base64':
+                    # 补齐缺失的填充后解码
+                    carry = self._carry + b'=' * (-len(self._carry) % 4)
+                    self._emit(binascii.a2b_base64(carry))
+                else:
+                    self._emit(quopri.decodestring(self._carry))
+                self._carry = b''
+            self._file.close()
+            os.replace(self._temp_path, self.target)
+        except Exception:
+            self._abort()
+            raise
+
+    def _abort(self) -> None:
+        """放弃写入，删除临时文件"""
+        try:
+            if self._file and not self._file.closed:
+                self._file.close()
+        finally:
+            if self._temp_path and self._temp_path.exists():
+                self._temp_path.unlink()
@@ -0,0 +1,73 @@
+"""
+布隆过滤器
+用于快速判断一个键“一定不存在”，判断为可能存在时需要再查持久化存储确认
+"""
+
+import hashlib
+import math
+from typing import Iterable, Union
+
+
+class BloomFilter:
+    """
+    基于位数组的布隆过滤器
+
+    按预计条目数和误判率计算位数组大小与哈希次数，k个位置由一次blake2b
+    摘要的两半通过双重哈希 (h1 + i*h2) 得到。不支持删除，条目删除后需重建
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        """
+        初始化布隆过滤器
+        Args:
+            capacity: 预计条目数
+            error_rate: 条目数不超过capacity时的误判率
+        """
+        if capacity <= 0:
+            raise ValueError("capacity必须大于0")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate必须在0和1之间")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: Union[str, bytes]):
+        """计算键对应的位位置"""
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: Union[str, bytes]) -> None:
+        """
+        添加键
+        Args:
+            key: 键
+        """
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys: Iterable[Union[str, bytes]]) -> None:
+        """
+        批量添加键
+        Args:
+            keys: 键列表
+        """
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: Union[str, bytes]) -> bool:
+        """判断键是否可能存在，返回False时一定不存在"""
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def clear(self) -> None:
+        """清空过滤器"""
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
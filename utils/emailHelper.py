@@ -11,11 +11,24 @@ from email.header import decode_header
 from typing import Dict, List, Tuple, Union, Optional
 
 from utils.logger import Logger
+from utils.attachment_writer import AttachmentSizeError, StreamingAttachmentWriter
+from utils.imap_utils import (
+    BodyPart, build_uid_set, chunk_uids, parse_bodystructure, parse_fetch_response, parse_fetch_section
+)
+
+# 规则匹配和已处理台账所需的邮件头字段
+HEADER_FIELDS = 'FROM TO CC SUBJECT DATE MESSAGE-ID'
 
 class EmailHelper:
-    def __init__(self, imap: IMAP4_SSL):
+    def __init__(self, imap: IMAP4_SSL, chunk_size: int = 1024 * 1024, pipeline_depth: int = 1):
         self.logger = Logger(__name__)
         self.imap = imap
+        # 按部件下载时每次FETCH的字节数
+        self.chunk_size = chunk_size
+        # 按部件下载时连续发出、不等待响应的FETCH条数（连接支持流水线时生效）
+        self.pipeline_depth = pipeline_depth if hasattr(imap, 'uid_fetch_pipelined') else 1
+        # 已保存附件的内容哈希 {文件路径: sha256}
+        self.attachment_hashes: Dict[str, str] = {}
 
     def decode_text(self, text: Union[str, bytes], charset: Optional[str] = None) -> str:
         """
@@ -100,10 +113,56 @@ class EmailHelper:
         return email_id if isinstance(email_id, bytes) else str(email_id).encode()
     
     def fetch_email(self, email_id: bytes) -> message.Message:
-        """获取邮件内容"""
-        _, msg_data = self.imap.fetch(email_id, '(BODY.PEEK[])')  # '(BODY.PEEK[HEADER])'
-        email_body = msg_data[0][1]
-        return email.message_from_bytes(email_body)
+        """获取邮件内容（按UID）"""
+        return email.message_from_bytes(self.fetch_raw(email_id))
+
+    def fetch_raw(self, email_id: bytes) -> bytes:
+        """获取邮件原文（按UID，不改变已读状态）"""
+        status, msg_data = self.imap.uid('FETCH', email_id, '(BODY.PEEK[])')
+        if status != 'OK':
+            raise Exception(f"获取邮件失败，状态: {status}")
+        fetched = parse_fetch_response(msg_data)
+        if not fetched:
+            raise Exception(f"邮件不存在: {email_id.decode()}")
+        return fetched[0][2]
+
+    def fetch_header(self, email_id: bytes) -> bytes:
+        """获取完整的邮件头原文（按UID，不下载正文和附件）"""
+        status, msg_data = self.imap.uid('FETCH', email_id, '(BODY.PEEK[HEADER])')
+        if status != 'OK':
+            raise Exception(f"获取邮件头失败，状态: {status}")
+        fetched = parse_fetch_response(msg_data)
+        if not fetched:
+            raise Exception(f"邮件不存在: {email_id.decode()}")
+        return fetched[0][2]
+
+    def fetch_headers(self, email_ids: List[bytes], batch_size: int = 500) -> List[Tuple[bytes, message.Message]]:
+        """
+        批量获取邮件头
+
+        用一条 UID FETCH 取回整批邮件的 FROM/TO/CC/SUBJECT/MESSAGE-ID，
+        不下载正文和附件，供规则引擎做首轮匹配
+
+        参数:
+            email_ids: 邮件UID列表
+            batch_size: 每条命令包含的最大UID数量
+
+        返回:
+            list: [(UID, 仅包含邮件头的消息对象)]，按UID升序排列
+        """
+        headers = []
+        for batch in chunk_uids(email_ids, batch_size):
+            uid_set = build_uid_set(batch)
+            status, msg_data = self.imap.uid(
+                'FETCH', uid_set, f'(UID BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+            )
+            if status != 'OK':
+                raise Exception(f"批量获取邮件头失败，状态: {status}")
+            for uid, _, payload in parse_fetch_response(msg_data):
+                headers.append((uid, email.message_from_bytes(payload)))
+        headers.sort(key=lambda item: int(item[0]))
+        self.logger.debug(f"批量获取邮件头完成: {len(headers)} 封")
+        return headers
     
     # 重要: 解析邮件数据
     def parse_email_data(self, msg: message.Message, email_id: bytes) -> Dict:
@@ -117,6 +176,8 @@ class EmailHelper:
         
         return {
             'id': email_id.decode(),
+            'message_id': (msg['Message-ID'] or '').strip(),
+            'date': (msg['Date'] or '').strip(),
             'from': from_addr,
             'to': to_addrs,
             'cc': cc_addrs,
@@ -146,8 +207,9 @@ class EmailHelper:
         return False
     
     def _save_attachment_file(self, part: message.Message, filename: str,
-                            email_id: bytes, folder_path: Path) -> Optional[Path]:
-        """保存附件文件"""
+                            email_id: bytes, folder_path: Path,
+                            max_size: Optional[int] = None) -> Optional[Path]:
+        """保存附件文件（按块解码写入，不在内存中生成完整的解码副本）"""
         try:
             self.logger.debug(f"处理附件: {filename}")
             
@@ -166,19 +228,37 @@ class EmailHelper:
             #     return filepath
             
             # 保存文件
-            with filepath.open('wb') as f:
-                f.write(part.get_payload(decode=True))
+            encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+            with StreamingAttachmentWriter(filepath, encoding, max_size) as writer:
+                if encoding in ('base64', 'quoted-printable'):
+                    payload = part.get_payload()
+                    for start in range(0, len(payload), self.chunk_size):
+                        writer.write(payload[start:start + self.chunk_size])
+                else:
+                    writer.write(part.get_payload(decode=True))
+            self.attachment_hashes[str(filepath)] = writer.hexdigest
                 
             self.logger.debug(f"附件已保存: {filepath}")
             return filepath
             
-        except Exception as e:
-            self.logger.error(f"保存附件失败: {str(e)}")
+        except AttachmentSizeError as e:
+            self.logger.warning(str(e))
             return None
+        except Exception as e:
+            # 超过大小限制之外的失败交给调用方，整封邮件记为失败
+            self.logger.error(f"保存附件失败: {filename}: {str(e)}")
+            raise
 
     
+    def _is_allowed_extension(self, filename: str, allowed_extensions: Optional[List[str]]) -> bool:
+        """检查附件扩展名是否在允许列表中"""
+        if not allowed_extensions:
+            return True
+        return os.path.splitext(filename)[1].lower() in allowed_extensions
+
     def save_attachments(self, msg: message.Message, email_id: bytes, 
-                        folder_path: Path, allowed_extensions: List[str] = None) -> List[str]:
+                        folder_path: Path, allowed_extensions: List[str] = None,
+                        max_size: Optional[int] = None) -> List[str]:
         """
         保存邮件附件
         
@@ -189,9 +269,13 @@ class EmailHelper:
             email_id: 邮件ID
             folder_path: 保存文件夹路径
             allowed_extensions: 允许下载的附件类型列表
+            max_size: 单个附件的最大字节数
             
         返回:
             list: 保存的附件文件路径列表
+
+        异常:
+            Exception: 附件写入失败时抛出（超过大小限制的附件跳过）
         """
         saved_files = []
         
@@ -202,19 +286,144 @@ class EmailHelper:
             filename = self._get_attachment_filename(part)
             if filename:
                 # 检查文件扩展名是否在允许列表中
-                if allowed_extensions:
-                    file_ext = os.path.splitext(filename)[1].lower()
-                    if file_ext not in allowed_extensions:
-                        self.logger.debug(f"跳过不允许的文件类型: {filename}")
-                        continue
+                if not self._is_allowed_extension(filename, allowed_extensions):
+                    self.logger.debug(f"跳过不允许的文件类型: {filename}")
+                    continue
 
-                filepath = self._save_attachment_file(part, filename, email_id, folder_path)
+                filepath = self._save_attachment_file(part, filename, email_id, folder_path, max_size)
                 if filepath:
                     saved_files.append(str(filepath))
                     
         return saved_files
 
     
+    def fetch_attachment_parts(self, email_id: bytes, allowed_extensions: List[str] = None,
+                               max_size: Optional[int] = None) -> List[BodyPart]:
+        """
+        根据BODYSTRUCTURE确定需要下载的附件部件
+
+        只返回带文件名、扩展名在允许列表中且大小不超过限制的部件，
+        正文、内嵌图片和其它类型附件不会被下载
+
+        参数:
+            email_id: 邮件UID
+            allowed_extensions: 允许下载的附件类型列表
+            max_size: 单个附件的最大字节数
+
+        返回:
+            list: 需要下载的部件列表（文件名已解码）
+        """
+        status, msg_data = self.imap.uid('FETCH', email_id, '(UID BODYSTRUCTURE)')
+        if status != 'OK':
+            raise Exception(f"获取邮件结构失败，状态: {status}")
+        parts = parse_bodystructure(msg_data).get(email_id, [])
+
+        selected = []
+        for part in parts:
+            # 与 _is_attachment 一致：需要 Content-Disposition 和文件名
+            if not part.filename or part.disposition is None:
+                continue
+            filename = self.decode_header_value(part.filename)
+            if not self._is_allowed_extension(filename, allowed_extensions):
+                self.logger.debug(f"跳过不允许的文件类型: {filename}")
+                continue
+            # decoded_size 是下限，接近限制的附件照常下载，由写入器按实际大小检查
+            if max_size and part.decoded_size > max_size:
+                self.logger.warning(f"附件超过大小限制，跳过: {filename} ({part.decoded_size} 字节)")
+                continue
+            part.filename = filename
+            selected.append(part)
+        return selected
+
+    def _stream_part(self, email_id: bytes, part: BodyPart, writer: StreamingAttachmentWriter) -> None:
+        """
+        分段下载部件内容并交给写入器
+
+        使用 BODY.PEEK[<part>]<offset.length> 每次只取 chunk_size 字节；
+        开启流水线时按BODYSTRUCTURE中的大小一次发出多段请求
+        """
+        if self.pipeline_depth > 1:
+            self._stream_part_pipelined(email_id, part, writer)
+            return
+        offset = 0
+        while True:
+            status, msg_data = self.imap.uid(
+                'FETCH', email_id, f'(UID BODY.PEEK[{part.part}]<{offset}.{self.chunk_size}>)'
+            )
+            if status != 'OK':
+                raise Exception(f"下载附件部件失败，状态: {status}")
+            fetched = parse_fetch_response(msg_data)
+            chunk = fetched[0][2] if fetched else b''
+            if chunk:
+                writer.write(chunk)
+            offset += len(chunk)
+            if len(chunk) < self.chunk_size:
+                break
+
+    def _stream_part_pipelined(self, email_id: bytes, part: BodyPart, writer: StreamingAttachmentWriter) -> None:
+        """流水线分段下载部件：每批最多 pipeline_depth 段，按起点顺序写入"""
+        section = part.part.encode('ascii')
+        offset = 0
+        while True:
+            # 按BODYSTRUCTURE估计剩余段数，大小不准确时至少再请求一段
+            remaining = max(part.size - offset, 1)
+            count = min(self.pipeline_depth, -(-remaining // self.chunk_size))
+            offsets = [offset + i * self.chunk_size for i in range(count)]
+            statuses, msg_data = self.imap.uid_fetch_pipelined([
+                (email_id, f'(UID BODY.PEEK[{part.part}]<{start}.{self.chunk_size}>)') for start in offsets
+            ])
+            if any(status != 'OK' for status in statuses):
+                raise Exception(f"下载附件部件失败，状态: {statuses}")
+            chunks = {}
+            for uid, meta, payload in parse_fetch_response(msg_data):
+                parsed = parse_fetch_section(meta)
+                if uid == email_id and parsed and parsed[0] == section:
+                    chunks[parsed[1]] = payload
+            for start in offsets:
+                chunk = chunks.get(start, b'')
+                if chunk:
+                    writer.write(chunk)
+                if len(chunk) < self.chunk_size:
+                    return
+            offset = offsets[-1] + self.chunk_size
+
+    def save_attachment_parts(self, email_id: bytes, folder_path: Path,
+                              allowed_extensions: List[str] = None,
+                              max_size: Optional[int] = None) -> List[str]:
+        """
+        按部件下载并保存附件
+
+        先取BODYSTRUCTURE，再用 BODY.PEEK[<part>] 只下载符合条件的附件部件，分段解码写入磁盘
+
+        参数:
+            email_id: 邮件UID
+            folder_path: 保存文件夹路径
+            allowed_extensions: 允许下载的附件类型列表
+            max_size: 单个附件的最大字节数
+
+        返回:
+            list: 保存的附件文件路径列表
+
+        异常:
+            Exception: 附件下载或写入失败时抛出（超过大小限制的附件跳过）
+        """
+        saved_files = []
+        folder_path = Path(folder_path)
+        for part in self.fetch_attachment_parts(email_id, allowed_extensions, max_size):
+            filepath = folder_path.joinpath(part.filename)
+            try:
+                with StreamingAttachmentWriter(filepath, part.encoding, max_size) as writer:
+                    self._stream_part(email_id, part, writer)
+                self.attachment_hashes[str(filepath)] = writer.hexdigest
+                self.logger.debug(f"附件已保存: {filepath}")
+                saved_files.append(str(filepath))
+            except AttachmentSizeError as e:
+                self.logger.warning(str(e))
+            except Exception as e:
+                self.logger.error(f"保存附件失败: {part.filename}: {str(e)}")
+                raise
+        return saved_files
+
     def mark_email_as_read(self, email_id: Union[str, bytes]) -> bool:
         """
         标记邮件为已读
@@ -230,9 +439,34 @@ class EmailHelper:
         """
         try:
             email_id = self.normalize_email_id(email_id)
-            self.imap.store(email_id, '+FLAGS', '\\Seen')
+            self.imap.uid('STORE', email_id, '+FLAGS', '\\Seen')
             return True
         except Exception as e:
             self.logger.error(f"标记邮件为已读失败: {str(e)}")
             return False
+
+    def mark_emails_as_read(self, email_ids: List[Union[str, bytes]], batch_size: int = 1000) -> bool:
+        """
+        批量标记邮件为已读
+
+        UID列表压缩为序列集合（如 101:105,110），每批只需一条 UID STORE 命令
+
+        参数:
+            email_ids: 邮件UID列表
+            batch_size: 每条命令包含的UID数量上限
+
+        返回:
+            bool: 是否全部标记成功
+        """
+        email_ids = sorted((self.normalize_email_id(email_id) for email_id in email_ids), key=int)
+        try:
+            for batch in chunk_uids(email_ids, batch_size):
+                status, _ = self.imap.uid('STORE', build_uid_set(batch), '+FLAGS', '(\\Seen)')
+                if status != 'OK':
+                    self.logger.error(f"批量标记邮件为已读失败: {status}")
+                    return False
+            return True
+        except Exception as e:
+            self.logger.error(f"批量标记邮件为已读失败: {str(e)}")
+            return False
     
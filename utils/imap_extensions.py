@@ -0,0 +1,250 @@
+"""
+IMAP扩展模块
+在imaplib连接上提供 COMPRESS=DEFLATE 压缩传输(RFC 4978)、UID FETCH命令流水线和
+带字面量的 UID SEARCH，并统计收发字节数
+"""
+
+import imaplib
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# imaplib单行响应的长度上限
+_MAXLINE = imaplib._MAXLINE
+# 命令参数中的字面量: {n}\r\n 后跟n字节
+_LITERAL_RE = re.compile(rb'\{(\d+)\}\r\n')
+
+
+class ImapExtensionsMixin:
+    """
+    imaplib连接的扩展
+
+    - enable_compression: 服务器声明 COMPRESS=DEFLATE 时协商压缩，之后的收发都经过raw deflate
+    - uid_fetch_pipelined: 连续发出多条 UID FETCH，不等待响应，全部发出后再依次收取
+    - uid_search_literals: 条件中含多个字面量（如中文关键词）的 UID SEARCH
+    - io_stats: 明文与线上的收发字节数、流水线命令数和往返时间
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._compressor = None
+        self._decompressor = None
+        self._inbuf = bytearray()
+        # 流水线发送时暂存命令，凑齐后一次写出（避免Nagle算法把后续小包推迟到收到ACK之后）
+        self._send_buffer = None
+        self.io_stats: Dict[str, float] = {
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'wire_in': 0,
+            'wire_out': 0,
+            'pipelined_commands': 0,
+            'pipeline_batches': 0,
+            'rtt': 0.0,
+        }
+        super().__init__(*args, **kwargs)
+
+    @property
+    def compressed(self) -> bool:
+        """是否已开启压缩"""
+        return self._compressor is not None
+
+    def measure_rtt(self) -> float:
+        """
+        用NOOP测量往返时间，用于估算流水线节省的时间
+        Returns:
+            往返时间（秒）
+        """
+        started = time.perf_counter()
+        self.noop()
+        self.io_stats['rtt'] = time.perf_counter() - started
+        return self.io_stats['rtt']
+
+    def enable_compression(self, level: int = 6) -> bool:
+        """
+        协商 COMPRESS=DEFLATE
+        Args:
+            level: zlib压缩级别
+        Returns:
+            bool: 是否已开启压缩（服务器不支持时返回False）
+        """
+        if self._compressor is not None:
+            return True
+        # 登录后服务器可能声明新的能力，重新查询一次
+        status, data = self.capability()
+        capabilities = set(self.capabilities)
+        if status == 'OK' and data and data[-1]:
+            capabilities.update(data[-1].decode('ascii', errors='ignore').upper().split())
+        if 'COMPRESS=DEFLATE' not in capabilities:
+            return False
+        status, _ = self.xatom('COMPRESS', 'DEFLATE')
+        if status != 'OK':
+            return False
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        return True
+
+    def uid_fetch_pipelined(self, requests: List[Tuple[str, str]]) -> Tuple[List[str], list]:
+        """
+        流水线执行多条 UID FETCH
+
+        所有命令先全部发出，再按标签顺序收取结果，n条命令只需要约一个往返时间。
+        各命令的FETCH响应合并返回，调用方按UID和段说明区分
+
+        Args:
+            requests: [(UID集合, FETCH数据项)]，如 [('101', '(UID BODY.PEEK[2]<0.1048576>)')]
+        Returns:
+            (各命令的状态列表, 合并的FETCH数据，格式同 imaplib.uid('FETCH', ...))
+        异常:
+            imaplib.IMAP4.error: 任一命令返回BAD（其余命令的响应已全部读完）
+        """
+        self._send_buffer = []
+        try:
+            tags = [self._command('UID', 'FETCH', uid_set, items) for uid_set, items in requests]
+        finally:
+            pending, self._send_buffer = b''.join(self._send_buffer), None
+        self.send(pending)
+        self.io_stats['pipelined_commands'] += len(tags)
+        self.io_stats['pipeline_batches'] += 1
+        statuses = []
+        error = None
+        for tag in tags:
+            try:
+                status, _ = self._command_complete('UID', tag)
+            except self.abort:
+                raise
+            except self.error as e:
+                # 读完其余命令的响应，保持连接可用
+                error = error or e
+                status = 'BAD'
+            statuses.append(status)
+        data = self.untagged_responses.pop('FETCH', [])
+        if error is not None:
+            raise error
+        return statuses, data
+
+    def uid_search_literals(self, criteria: bytes, charset: Optional[str] = None) -> Tuple[str, list]:
+        """
+        执行条件中含字面量的 UID SEARCH
+
+        imaplib每条命令只能附带一个字面量，这里按 RFC 3501 逐个发送：每个字面量先发长度，
+        收到服务器的继续响应后再发内容；服务器声明 LITERAL+ 时使用 {n+}，整条命令一次发出
+
+        Args:
+            criteria: 搜索条件，字面量写作 {n}\\r\\n 后跟n字节
+            charset: 条件的字符集，如 'UTF-8'，None时不指定
+        Returns:
+            (状态, 数据)，格式同 imaplib.uid('SEARCH', ...)
+        异常:
+            imaplib.IMAP4.error: 服务器返回BAD
+        """
+        pieces = []
+        pos = 0
+        while True:
+            match = _LITERAL_RE.search(criteria, pos)
+            if not match:
+                break
+            end = match.end() + int(match.group(1))
+            pieces.append((criteria[pos:match.start()], criteria[match.end():end]))
+            pos = end
+        literal_plus = 'LITERAL+' in self.capabilities
+
+        self.untagged_responses.pop('SEARCH', None)
+        tag = self._new_tag()
+        data = tag + b' UID SEARCH '
+        if charset:
+            data += b'CHARSET ' + charset.encode('ascii') + b' '
+        for text, literal in pieces:
+            if literal_plus:
+                data += text + b'{%d+}\r\n' % len(literal) + literal
+                continue
+            self.send(data + text + b'{%d}\r\n' % len(literal))
+            while self._get_response():
+                if self.tagged_commands[tag]:
+                    # 服务器没有等待字面量就拒绝了命令（如不支持该字符集），不再发送其余部分
+                    typ, dat = self._command_complete('SEARCH', tag)
+                    return self._untagged_response(typ, dat, 'SEARCH')
+            data = literal
+        self.send(data + criteria[pos:] + b'\r\n')
+        typ, dat = self._command_complete('SEARCH', tag)
+        return self._untagged_response(typ, dat, 'SEARCH')
+
+    def send(self, data: bytes) -> None:
+        if self._send_buffer is not None:
+            self._send_buffer.append(data)
+            return
+        self.io_stats['bytes_out'] += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.io_stats['wire_out'] += len(data)
+        super().send(data)
+
+    def read(self, size: int) -> bytes:
+        if self._decompressor is None:
+            data = super().read(size)
+            self.io_stats['wire_in'] += len(data)
+        else:
+            while len(self._inbuf) < size:
+                self._fill()
+            data = bytes(self._inbuf[:size])
+            del self._inbuf[:size]
+        self.io_stats['bytes_in'] += len(data)
+        return data
+
+    def readline(self) -> bytes:
+        if self._decompressor is None:
+            line = super().readline()
+            self.io_stats['wire_in'] += len(line)
+        else:
+            while True:
+                end = self._inbuf.find(b'\n')
+                if end >= 0 or len(self._inbuf) > _MAXLINE:
+                    break
+                self._fill()
+            end = end + 1 if end >= 0 else len(self._inbuf)
+            if end > _MAXLINE:
+                raise self.error("got more than %d bytes" % _MAXLINE)
+            line = bytes(self._inbuf[:end])
+            del self._inbuf[:end]
+        self.io_stats['bytes_in'] += len(line)
+        return line
+
+    def _fill(self) -> None:
+        """从套接字读取一段压缩数据并解压到缓冲区"""
+        chunk = self.file.read1(65536)
+        if not chunk:
+            raise self.abort('socket error: EOF')
+        self.io_stats['wire_in'] += len(chunk)
+        self._inbuf += self._decompressor.decompress(chunk)
+
+
+class IMAP4(ImapExtensionsMixin, imaplib.IMAP4):
+    """带压缩和流水线扩展的IMAP连接"""
+
+
+class IMAP4_SSL(ImapExtensionsMixin, imaplib.IMAP4_SSL):
+    """带压缩和流水线扩展的IMAP over SSL连接"""
+
+
+def transfer_stats(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    """
+    计算一段时间内的传输统计
+    Args:
+        before: 开始时的 io_stats 快照
+        after: 结束时的 io_stats 快照
+    Returns:
+        明文/线上字节数、压缩节省的字节数、流水线节省的往返次数和估算节省的时间
+    """
+    delta = {key: after[key] - before.get(key, 0) for key in after if key != 'rtt'}
+    round_trips_saved = delta['pipelined_commands'] - delta['pipeline_batches']
+    return {
+        'bytes_in': int(delta['bytes_in']),
+        'bytes_out': int(delta['bytes_out']),
+        'wire_in': int(delta['wire_in']),
+        'wire_out': int(delta['wire_out']),
+        'compression_saved_bytes': int(
+            delta['bytes_in'] + delta['bytes_out'] - delta['wire_in'] - delta['wire_out']
+        ),
+        'pipelined_commands': int(delta['pipelined_commands']),
+        'round_trips_saved': int(round_trips_saved),
+        'pipeline_saved_seconds': round(round_trips_saved * after.get('rtt', 0.0), 3),
+    }
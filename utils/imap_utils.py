@@ -0,0 +1,358 @@
+"""
+IMAP协议工具模块
+提供UID集合构造、FETCH/BODYSTRUCTURE响应解析等与具体邮箱无关的纯函数
+"""
+
+import base64
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import unquote
+
+# FETCH响应中的UID字段
+_UID_RE = re.compile(rb'UID (\d+)')
+# FETCH响应中的段说明及部分下载起点，如 BODY[2]<1048576>
+_SECTION_RE = re.compile(rb'BODY\[([^\]]*)\](?:<(\d+)>)?')
+# 文件夹名中需要modified UTF-7编码的字符
+_NON_ASCII_RE = re.compile(r'([^\x20-\x7e]+)')
+
+
+def build_uid_set(uids: Iterable[Union[str, bytes, int]]) -> str:
+    """
+    将UID列表压缩为IMAP序列集合
+
+    连续的UID会合并为区间，例如 [101, 102, 103, 105] -> "101:103,105"
+
+    Args:
+        uids: UID列表
+    Returns:
+        IMAP序列集合字符串
+    """
+    numbers = sorted({int(uid) for uid in uids})
+    if not numbers:
+        return ''
+
+    ranges = []
+    start = prev = numbers[0]
+    for number in numbers[1:]:
+        if number == prev + 1:
+            prev = number
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = number
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ','.join(ranges)
+
+
+def encode_folder_name(name: str) -> str:
+    """
+    将文件夹名编码为IMAP命令参数
+
+    非ASCII字符按RFC 3501的modified UTF-7编码（如 "供应商" -> "&T5telFVG-"），
+    包含空格或引号时加双引号
+
+    Args:
+        name: 文件夹名
+    Returns:
+        可直接传给 select 的文件夹名
+    """
+    encoded = []
+    # 拆分后奇数位置是非ASCII片段
+    for index, run in enumerate(_NON_ASCII_RE.split(name)):
+        if index % 2:
+            data = base64.b64encode(run.encode('utf-16-be')).decode('ascii')
+            encoded.append('&' + data.rstrip('=').replace('/', ',') + '-')
+        else:
+            encoded.append(run.replace('&', '&-'))
+
+    result = ''.join(encoded)
+    if re.search(r'[\s"\\(){%*]', result):
+        result = '"' + result.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return result
+
+
+def chunk_uids(uids: List[bytes], size: int) -> List[List[bytes]]:
+    """
+    按固定大小切分UID列表，避免单条命令过长
+    Args:
+        uids: UID列表
+        size: 每批数量
+    Returns:
+        切分后的UID列表
+    """
+    return [uids[i:i + size] for i in range(0, len(uids), size)]
+
+
+def parse_fetch_uid(meta: bytes) -> Optional[bytes]:
+    """
+    从FETCH响应头中提取UID
+    Args:
+        meta: 响应头，如 b'1 (UID 101 BODY[HEADER] {342}'
+    Returns:
+        UID，未找到时返回None
+    """
+    match = _UID_RE.search(meta)
+    return match.group(1) if match else None
+
+
+def parse_fetch_section(meta: bytes) -> Optional[Tuple[bytes, int]]:
+    """
+    从FETCH响应头中提取段说明和部分下载的起点
+    Args:
+        meta: 响应头，如 b'1 (UID 101 BODY[2]<1048576> {1048576}'
+    Returns:
+        (段说明, 起点)，不是部分下载时起点为0；没有BODY段时返回None
+    """
+    match = _SECTION_RE.search(meta)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2) or 0)
+
+
+def parse_fetch_response(data: List[Union[bytes, Tuple[bytes, bytes]]]) -> List[Tuple[bytes, bytes, bytes]]:
+    """
+    解析imaplib返回的UID FETCH结果
+
+    imaplib把带字面量的响应拆成 (响应头, 内容) 元组，UID可能出现在
+    字面量之前的响应头中，也可能出现在紧随其后的结束片段(b' UID 101)')中。
+
+    Args:
+        data: imaplib.uid('FETCH', ...) 返回的数据列表
+    Returns:
+        [(uid, 响应头, 内容)] 列表，按服务器返回顺序排列
+    """
+    results = []
+    for index, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        meta, payload = item[0], item[1]
+        uid = parse_fetch_uid(meta)
+        if uid is None and index + 1 < len(data) and isinstance(data[index + 1], bytes):
+            uid = parse_fetch_uid(data[index + 1])
+        if uid is None:
+            continue
+        results.append((uid, meta, payload))
+    return results
+
+
+@dataclass
+class BodyPart:
+    """BODYSTRUCTURE中的单个叶子部件"""
+    part: str                      # 部件编号，如 "2" / "1.2"
+    content_type: str              # 如 "application/vnd.ms-excel"
+    encoding: str                  # 传输编码，如 "base64"
+    size: int                      # 编码后的字节数
+    filename: Optional[str] = None
+    disposition: Optional[str] = None
+
+    @property
+    def decoded_size(self) -> int:
+        """
+        解码后大小的下限，用于下载前跳过一定超过大小限制的附件（精确大小由写入器检查）
+
+        base64按每行76个字符加CRLF扣除换行，末尾最多有2个填充字符
+        """
+        if self.encoding == 'base64':
+            line_breaks = (self.size + 77) // 78
+            return max((self.size - line_breaks * 2) * 3 // 4 - 2, 0)
+        return self.size
+
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))', re.S)
+
+
+def _tokenize(segments: List[Union[bytes, Tuple[str, bytes]]]):
+    """将响应片段切分为记号，字面量内容作为字符串记号"""
+    for segment in segments:
+        if isinstance(segment, tuple):
+            yield ('STR', segment[1])
+            continue
+        pos = 0
+        while pos < len(segment):
+            match = _TOKEN_RE.match(segment, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            lparen, rparen, quoted, literal, atom = match.groups()
+            if lparen:
+                yield ('(', None)
+            elif rparen:
+                yield (')', None)
+            elif quoted is not None:
+                yield ('STR', re.sub(rb'\\(.)', rb'\1', quoted))
+            elif literal is not None:
+                continue  # 字面量内容在下一个片段中
+            elif atom is not None:
+                yield ('ATOM', atom)
+
+
+def _build_tree(tokens) -> list:
+    """把记号流组装为嵌套列表，NIL转为None"""
+    stack: List[list] = [[]]
+    for kind, value in tokens:
+        if kind == '(':
+            stack.append([])
+        elif kind == ')':
+            if len(stack) == 1:
+                break
+            node = stack.pop()
+            stack[-1].append(node)
+        elif kind == 'ATOM' and value.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(value)
+    # 响应被截断时，把未闭合的层级并入上一层
+    while len(stack) > 1:
+        node = stack.pop()
+        stack[-1].append(node)
+    return stack[0]
+
+
+def _text(value: Any) -> str:
+    return value.decode('utf-8', errors='ignore') if isinstance(value, bytes) else ''
+
+
+def _params(value: Any) -> Dict[str, str]:
+    """将参数列表 ("NAME" "a.xlsx" ...) 转为小写键字典"""
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]).lower(): _text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def _param_filename(params: Dict[str, str], name: str) -> Optional[str]:
+    """
+    读取文件名参数，支持RFC2231编码(name*)和续行(name*0*, name*1* ...)
+    """
+    if name in params:
+        return params[name]
+    if f"{name}*" in params:
+        return _decode_rfc2231(params[f"{name}*"], encoded=True)
+    pieces = []
+    encoded = False
+    index = 0
+    while True:
+        if f"{name}*{index}*" in params:
+            pieces.append(params[f"{name}*{index}*"])
+            encoded = encoded or index == 0
+        elif f"{name}*{index}" in params:
+            pieces.append(params[f"{name}*{index}"])
+        else:
+            break
+        index += 1
+    if not pieces:
+        return None
+    return _decode_rfc2231(''.join(pieces), encoded)
+
+
+def _decode_rfc2231(value: str, encoded: bool) -> str:
+    """解码 charset'lang'%XX 形式的参数值"""
+    if not encoded:
+        return value
+    charset, _, rest = value.partition("'")
+    _, _, text = rest.partition("'")
+    if not rest:
+        return unquote(value)
+    return unquote(text, encoding=charset or 'utf-8', errors='replace')
+
+
+def _walk(node: list, prefix: str, parts: List[BodyPart]) -> None:
+    """递归遍历BODYSTRUCTURE，收集叶子部件（包括转发邮件 message/rfc822 中的部件）"""
+    if node and isinstance(node[0], list):
+        # multipart：子部件在前，之后是子类型和扩展字段
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            index += 1
+            _walk(child, f"{prefix}.{index}" if prefix else str(index), parts)
+        return
+
+    main_type = _text(node[0]).lower()
+    sub_type = _text(node[1]).lower()
+    if main_type == 'message' and sub_type == 'rfc822' and len(node) > 8 and isinstance(node[8], list):
+        # 转发的邮件：子结构在信封之后，multipart的子部件编号为 N.1、N.2，单部件正文为 N.1
+        inner = node[8]
+        if inner and isinstance(inner[0], list):
+            _walk(inner, prefix, parts)
+        else:
+            _walk(inner, f"{prefix}.1" if prefix else '1', parts)
+        return
+    type_params = _params(node[2])
+    encoding = _text(node[5]).lower()
+    size = int(node[6]) if isinstance(node[6], bytes) and node[6].isdigit() else 0
+
+    # 扩展字段的位置取决于类型：text/* 多一个行数字段，message/rfc822（缺少子结构时）多信封、子结构和行数
+    if main_type == 'text':
+        disposition_index = 9
+    elif main_type == 'message' and sub_type == 'rfc822':
+        disposition_index = 11
+    else:
+        disposition_index = 8
+
+    disposition = None
+    disposition_params: Dict[str, str] = {}
+    if len(node) > disposition_index and isinstance(node[disposition_index], list):
+        disposition = _text(node[disposition_index][0]).lower()
+        if len(node[disposition_index]) > 1:
+            disposition_params = _params(node[disposition_index][1])
+
+    filename = _param_filename(disposition_params, 'filename') or _param_filename(type_params, 'name')
+    parts.append(BodyPart(
+        part=prefix or '1',
+        content_type=f"{main_type}/{sub_type}",
+        encoding=encoding,
+        size=size,
+        filename=filename,
+        disposition=disposition
+    ))
+
+
+def parse_bodystructure(data: List[Union[bytes, Tuple[bytes, bytes]]]) -> Dict[bytes, List[BodyPart]]:
+    """
+    解析 UID FETCH (UID BODYSTRUCTURE) 的结果
+
+    Args:
+        data: imaplib.uid('FETCH', uid_set, '(UID BODYSTRUCTURE)') 返回的数据列表
+    Returns:
+        {uid: [BodyPart]}，只包含叶子部件
+    """
+    # 先把同一封邮件被字面量拆开的片段拼回去
+    messages: List[List[Union[bytes, Tuple[str, bytes]]]] = []
+    current: List[Union[bytes, Tuple[str, bytes]]] = []
+    for item in data:
+        if isinstance(item, tuple):
+            meta, payload = item[0], item[1]
+            if current and re.match(rb'^\d+ \(', meta):
+                messages.append(current)
+                current = []
+            current.extend([meta, ('LIT', payload)])
+        elif isinstance(item, bytes):
+            if re.match(rb'^\d+ \(', item):
+                if current:
+                    messages.append(current)
+                current = [item]
+            else:
+                current.append(item)
+    if current:
+        messages.append(current)
+
+    results = {}
+    for segments in messages:
+        head = b''.join(s for s in segments if isinstance(s, bytes))
+        uid = parse_fetch_uid(head)
+        if uid is None:
+            continue
+        tree = _build_tree(_tokenize(segments))
+        # tree: [序号, [UID, 101, BODYSTRUCTURE, (...)]]
+        fetch_items = next((node for node in tree if isinstance(node, list)), [])
+        structure = None
+        for index, item in enumerate(fetch_items):
+            if isinstance(item, bytes) and item.upper() == b'BODYSTRUCTURE' and index + 1 < len(fetch_items):
+                structure = fetch_items[index + 1]
+                break
+        if not isinstance(structure, list):
+            continue
+        parts: List[BodyPart] = []
+        _walk(structure, '', parts)
+        results[uid] = parts
+    return results